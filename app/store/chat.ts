@@ -1015,6 +1015,17 @@ export const useChatStore = createPersistStore(
               } catch (e) {
                 console.warn("关闭reader失败:", e);
               }
+              // 异步通知后端取消，结束模型调用的重试等待，不阻塞前端操作
+              const apiBaseUrl =
+                process.env.NEXT_PUBLIC_API_BASE_URL || "https://www.ifish.me";
+              fetch(`${apiBaseUrl}/flask/agent/cancel/${sessionId}`, {
+                method: "POST",
+                headers: {
+                  "Content-Type": "application/json",
+                },
+              }).catch((error) => {
+                logger.warn(`取消后端Agent聊天异常: ${sessionId}`, error);
+              });
               break;
             }
 
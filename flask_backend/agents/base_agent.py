@@ -1,11 +1,19 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import List, Dict, Any, Optional
 import os
+import threading
 import dashscope
 from qwen_agent.agents import Assistant
+from qwen_agent.llm import RouterChatModel, get_chat_model
+from qwen_agent.llm.base import ModelServiceError
 from utils.logger import logger
 from utils.mcp_manager import mcp_manager
 
+# 进程内共享的路由模型：key为是否启用思考模式
+_router_llms: Dict[bool, RouterChatModel] = {}
+_router_llm_lock = threading.Lock()
+
 class BaseAgent(ABC):
     """Agent基类，定义所有Agent的通用接口"""
     
@@ -14,6 +22,7 @@ class BaseAgent(ABC):
         self.user_id = user_id
         self.session_id = f"{user_id}_{agent_id}"
         self.messages = []  # 会话历史
+        self._cancel_event: Optional[threading.Event] = None  # 进行中的流式聊天的取消信号
         
         # 配置DashScope
         dashscope.api_key = os.getenv('ALIBABA_API_KEY', '')
@@ -47,11 +56,20 @@ class BaseAgent(ABC):
             'generate_cfg': {
                 'enable_thinking': enable_thinking,  # 根据参数动态启用Qwen3的思考模式
                 'max_tokens': 32000,  # 设置最大输出token数量为32000（接近模型最大限制）
+                'max_retries': 3,  # 模型服务出错时的重试次数
+                'resumable_retry': True,  # 流式输出中断后从已输出的内容继续生成，而不是从头重新生成
+                # 显式提示词缓存：系统提示词和工具描述每轮都相同，标记后同一轮内的多次工具调用可命中服务端缓存
+                'prompt_cache': os.getenv('LLM_PROMPT_CACHE', 'false').lower() == 'true',
             }
         }
         
         logger.info(f"[{self.session_id}] LLM配置完成 - 模型: {llm_cfg['model']}, API密钥已配置: {bool(llm_cfg['api_key'])}, 最大输出token: {llm_cfg['generate_cfg']['max_tokens']}")
         
+        # 配置了备用模型时，通过路由模型在主备模型之间做故障切换和对冲请求
+        llm = llm_cfg
+        if os.getenv('FALLBACK_MODEL'):
+            llm = self._get_router_llm(llm_cfg, enable_thinking)
+        
         # 获取增强的工具列表
         enhanced_tools = self.get_enhanced_function_list()
         
@@ -61,7 +79,7 @@ class BaseAgent(ABC):
         # 创建Assistant实例
         logger.info(f"[{self.session_id}] 开始创建Assistant实例")
         bot = Assistant(
-            llm=llm_cfg,
+            llm=llm,
             name=self.get_agent_name(),
             description=self.get_agent_description(),
             system_message=self.get_system_prompt(),
@@ -73,6 +91,39 @@ class BaseAgent(ABC):
         return bot
             
     
+    @classmethod
+    def _get_router_llm(cls, primary_cfg: Dict[str, Any], enable_thinking: bool) -> RouterChatModel:
+        """获取进程内共享的路由模型（按思考模式区分），使各会话共享后端的延迟统计
+        
+        Args:
+            primary_cfg: 主模型配置
+            enable_thinking: 是否启用思考模式
+            
+        Returns:
+            RouterChatModel: 路由模型实例
+        """
+        with _router_llm_lock:
+            router = _router_llms.get(enable_thinking)
+            if router is None:
+                fallback_cfg = {
+                    'model': os.getenv('FALLBACK_MODEL'),
+                    'model_server': os.getenv('FALLBACK_MODEL_SERVER') or 'dashscope',
+                    'api_key': os.getenv('FALLBACK_API_KEY') or os.getenv('ALIBABA_API_KEY'),
+                    'generate_cfg': {
+                        'max_retries': 1,
+                    }
+                }
+                router_cfg = {
+                    'model_type': 'router',
+                    'backends': [primary_cfg, fallback_cfg],
+                }
+                if os.getenv('LLM_HEDGE_AFTER'):
+                    router_cfg['hedge_after'] = float(os.getenv('LLM_HEDGE_AFTER'))
+                router = get_chat_model(router_cfg)
+                _router_llms[enable_thinking] = router
+                logger.info(f"路由模型创建成功 - 主模型: {primary_cfg['model']}, 备用模型: {fallback_cfg['model']} ({fallback_cfg['model_server']})")
+            return router
+    
     def get_agent_name(self) -> str:
         """获取Agent名称，子类可重写"""
         return f"智能助手-{self.agent_id}"
@@ -312,9 +363,23 @@ class BaseAgent(ABC):
                 'session_id': self.session_id
             }
     
-    def chat_stream(self, user_input: str, file_path: str = None, deep_thinking: bool = True):
-        """处理用户输入并返回流式响应"""
-        logger.info(f"[{self.session_id}] 开始处理流式聊天请求 - 输入长度: {len(user_input)}, 文件: {file_path}, 深度思考: {deep_thinking}")
+    def chat_stream(self, user_input: str, file_path: str = None, deep_thinking: bool = True,
+                    prefetch_suggestions: bool = False, deadline: Optional[float] = None,
+                    cancel_event: Optional[threading.Event] = None):
+        """处理用户输入并返回流式响应
+        
+        Args:
+            user_input: 用户输入
+            file_path: 附带的文件路径
+            deep_thinking: 是否启用深度思考模式
+            prefetch_suggestions: 是否与主对话并行生成相关推荐问题，并在complete之前以suggestions事件返回
+            deadline: 请求截止时间（time.time()时间戳），超时后不再重试模型服务并返回超时错误
+            cancel_event: 取消信号，被设置后立即结束重试等待并返回取消错误；不传则内部创建，可通过cancel_chat()取消
+        """
+        logger.info(f"[{self.session_id}] 开始处理流式聊天请求 - 输入长度: {len(user_input)}, 文件: {file_path}, 深度思考: {deep_thinking}, 预取推荐问题: {prefetch_suggestions}")
+        suggestions_future = None
+        cancel_event = cancel_event or threading.Event()
+        self._cancel_event = cancel_event
         
         # 创建工具状态回调函数
         def tool_status_callback(status_info):
@@ -359,6 +424,11 @@ class BaseAgent(ABC):
             self.messages.append(message)
             logger.info(f"[{self.session_id}] 消息已添加到历史，当前历史长度: {len(self.messages)}")
             
+            # 用户消息已确定，与主对话并行生成相关推荐问题
+            if prefetch_suggestions:
+                from utils.suggested_questions import prefetch_related_questions
+                suggestions_future = prefetch_related_questions(self, user_input)
+            
             # 设置工具调用状态回调
             self._tool_status_generator = None
             
@@ -396,7 +466,7 @@ class BaseAgent(ABC):
             # 初始化立即发送标志
             self._immediate_tool_status = False
             
-            for resp in self.bot.run(self.messages):
+            for resp in self.bot.run(self.messages, deadline=deadline, cancel_event=cancel_event):
                 response = resp
                 response_count += 1
                 # logger.debug(f"[{self.session_id}] 收到qwen-agent流式响应 #{response_count}")
@@ -482,6 +552,12 @@ class BaseAgent(ABC):
                     assistant_reply = msg.get('content', '')
                     break
             
+            # 在完成信号之前发送预取的推荐问题
+            if suggestions_future is not None:
+                suggestions_event = self._collect_prefetched_suggestions(suggestions_future)
+                if suggestions_event:
+                    yield suggestions_event
+            
             # 发送完成信号
             yield {
                 'type': 'complete',
@@ -494,6 +570,26 @@ class BaseAgent(ABC):
             logger.info(f"[{self.session_id}] 流式聊天处理成功完成")
             
         except Exception as e:
+            if isinstance(e, ModelServiceError) and e.code == 'DeadlineExceeded':
+                logger.error(f"[{self.session_id}] 流式聊天超时: {str(e)}")
+                yield {
+                    'type': 'error',
+                    'success': False,
+                    'error': '请求超时，请稍后重试',
+                    'error_code': 'deadline_exceeded',
+                    'session_id': self.session_id
+                }
+                return
+            if isinstance(e, ModelServiceError) and e.code == 'Cancelled':
+                logger.info(f"[{self.session_id}] 流式聊天已取消")
+                yield {
+                    'type': 'error',
+                    'success': False,
+                    'error': '请求已取消',
+                    'error_code': 'cancelled',
+                    'session_id': self.session_id
+                }
+                return
             logger.error(f"[{self.session_id}] 流式聊天处理失败: {str(e)}")
             yield {
                 'type': 'error',
@@ -502,6 +598,12 @@ class BaseAgent(ABC):
                 'session_id': self.session_id
             }
         finally:
+            # 客户端断开（生成器被关闭）时同样通知仍在重试或对冲的模型调用尽快退出
+            cancel_event.set()
+            if self._cancel_event is cancel_event:
+                self._cancel_event = None
+            if suggestions_future is not None:
+                suggestions_future.cancel()
             # 恢复工具的原始调用方法，避免影响其他agent实例
             original_function_map = getattr(self.bot, 'function_map', {})
             for func_name, func_obj in original_function_map.items():
@@ -509,6 +611,24 @@ class BaseAgent(ABC):
                     func_obj.call = func_obj._original_call
             logger.debug(f"[{self.session_id}] 已恢复工具原始调用方法")
     
+    def _collect_prefetched_suggestions(self, suggestions_future) -> Optional[Dict[str, Any]]:
+        """等待预取的推荐问题，超时或失败时返回None（前端仍可单独请求推荐问题）"""
+        timeout = float(os.getenv('SUGGESTION_PREFETCH_TIMEOUT', '3'))
+        try:
+            questions = suggestions_future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"[{self.session_id}] 预取推荐问题超时({timeout}s)，跳过suggestions事件")
+            return None
+        except Exception as e:
+            logger.error(f"[{self.session_id}] 预取推荐问题失败: {str(e)}")
+            return None
+        return {
+            'type': 'suggestions',
+            'question_type': 'related',
+            'questions': questions,
+            'session_id': self.session_id
+        }
+    
     def _handle_tool_status(self, status_info):
         """处理工具调用状态"""
         if not hasattr(self, '_pending_tool_status'):
@@ -554,6 +674,15 @@ class BaseAgent(ABC):
         """清空会话历史"""
         self.messages = []
     
+    def cancel_chat(self) -> bool:
+        """取消进行中的流式聊天，返回是否有聊天被取消"""
+        cancel_event = self._cancel_event
+        if cancel_event is None or cancel_event.is_set():
+            return False
+        cancel_event.set()
+        logger.info(f"[{self.session_id}] 已请求取消流式聊天")
+        return True
+    
     def load_history(self, messages: List[Dict[str, Any]]):
         """加载历史消息"""
         self.messages = messages
@@ -23,6 +23,7 @@ from flask_cors import CORS
 from routes.agent_routes import agent_bp
 from routes.auth_routes import auth_bp
 import logging
+import threading
 import traceback
 from utils.logger import logger
 from utils.session_manager import SessionManager
@@ -65,62 +66,100 @@ def handle_exception(e):
         'traceback': traceback.format_exc()
     }), 500
 
-# 初始化MCP管理器
-if app.config.get('ENABLE_MCP', 'true').lower() == 'true':
-    logger.info("正在预注册默认MCP工具...")
-    if mcp_manager.pre_register_default_tools():
-        logger.info("默认MCP工具预注册成功")
+_services_lock = threading.Lock()
+_services_pid = None  # 已完成初始化的进程
+
+def _init_mcp_tools():
+    """初始化MCP管理器"""
+    if app.config.get('ENABLE_MCP', 'true').lower() == 'true':
+        logger.info("正在预注册默认MCP工具...")
+        if mcp_manager.pre_register_default_tools():
+            logger.info("默认MCP工具预注册成功")
         
-        # 在应用启动时就完成MCP工具的完整初始化
-        logger.info("正在初始化MCP工具实例...")
-        try:
-            from qwen_agent.tools.mcp_manager import MCPToolFactory
+            # 在应用启动时就完成MCP工具的完整初始化
+            logger.info("正在初始化MCP工具实例...")
+            try:
+                from qwen_agent.tools.mcp_manager import MCPToolFactory
             
-            # 获取可用的工具名称
-            available_tools = mcp_manager.get_available_tool_names()
-            if available_tools:
-                logger.info(f"发现可用MCP工具: {available_tools}")
-                
-                # 创建MCP管理器实例并初始化工具
-                manager = MCPToolFactory.create_manager()
+                # 获取可用的工具名称
+                available_tools = mcp_manager.get_available_tool_names()
+                if available_tools:
+                    logger.info(f"发现可用MCP工具: {available_tools}")
                 
-                # 获取默认MCP配置并初始化工具实例
-                default_configs = mcp_manager.get_default_mcp_config()
-                if default_configs:
-                    # 使用第一个配置进行初始化
-                    config = default_configs[0]
-                    logger.info(f"使用配置初始化MCP工具: {list(config.get('mcpServers', {}).keys())}")
-                    
-                    # 调用真正的MCP工具初始化
-                    tool_instances = manager.initConfig(config)
-                    if tool_instances:
-                        # 注册工具实例到单例管理器
-                        if mcp_manager.register_mcp_tools(available_tools, tool_instances):
-                            logger.info(f"MCP工具实例初始化成功，工具数量: {len(tool_instances)}")
+                    # 获取默认MCP配置并初始化工具实例
+                    default_configs = mcp_manager.get_default_mcp_config()
+                    if default_configs:
+                        broker_socket = os.getenv('MCP_BROKER_SOCKET', '')
+                        if broker_socket:
+                            # 多worker部署：通过MCP代理进程共享同一套MCP服务器
+                            from utils.mcp_broker import MCPBrokerClient
+                            logger.info(f"使用MCP代理进程获取MCP工具: {broker_socket}")
+                            tool_instances = MCPBrokerClient(broker_socket).create_tools()
                         else:
-                            logger.error("MCP工具实例注册失败")
+                            # 创建MCP管理器实例
+                            manager = MCPToolFactory.create_manager()
+                            # 使用第一个配置进行初始化
+                            config = default_configs[0]
+                            logger.info(f"使用配置初始化MCP工具: {list(config.get('mcpServers', {}).keys())}")
+                        
+                            # 调用真正的MCP工具初始化
+                            tool_instances = manager.initConfig(config)
+                        if tool_instances:
+                            # 注册工具实例到单例管理器
+                            if mcp_manager.register_mcp_tools(available_tools, tool_instances):
+                                logger.info(f"MCP工具实例初始化成功，工具数量: {len(tool_instances)}")
+                            else:
+                                logger.error("MCP工具实例注册失败")
+                        else:
+                            logger.error("MCP工具实例初始化返回空列表")
                     else:
-                        logger.error("MCP工具实例初始化返回空列表")
+                        logger.warning("没有找到默认MCP配置")
                 else:
-                    logger.warning("没有找到默认MCP配置")
-            else:
-                logger.warning("没有发现可用的MCP工具")
+                    logger.warning("没有发现可用的MCP工具")
                 
-        except Exception as e:
-            logger.error(f"MCP工具实例初始化失败: {e}")
-            import traceback
-            logger.error(f"详细错误信息: {traceback.format_exc()}")
+            except Exception as e:
+                logger.error(f"MCP工具实例初始化失败: {e}")
+                import traceback
+                logger.error(f"详细错误信息: {traceback.format_exc()}")
+        else:
+            logger.error(f"默认MCP工具预注册失败: {mcp_manager.get_load_error()}")
     else:
-        logger.error(f"默认MCP工具预注册失败: {mcp_manager.get_load_error()}")
-else:
-    logger.info("MCP功能已禁用")
+        logger.info("MCP功能已禁用")
 
-# 全局会话管理器 - 确保sessions.json文件在flask_backend目录下生成
-session_file_path = os.path.join(os.path.dirname(__file__), 'sessions.json')
-session_manager = SessionManager(session_file=session_file_path)
+def init_app_services():
+    """初始化MCP工具、会话管理器和推荐问题预热，每个进程执行一次
 
-# 将会话管理器添加到应用上下文中，供其他模块使用
-app.session_manager = session_manager
+    这些初始化会启动线程（MCP事件循环、会话清理、预热）和MCP服务器子进程，而fork后子进程中只有调用fork的线程，
+    因此不能在导入时执行，否则gunicorn --preload的各worker会等待一个并未运行的事件循环。gunicorn部署时由
+    gunicorn.conf.py的post_fork钩子在每个worker中调用，直接运行app.py时在启动前调用，其他方式则在首个请求前调用。
+    """
+    global _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        _init_mcp_tools()
+
+        # 全局会话管理器 - 确保sessions.json文件在flask_backend目录下生成
+        session_file_path = os.path.join(os.path.dirname(__file__), 'sessions.json')
+        # 将会话管理器添加到应用上下文中，供其他模块使用
+        app.session_manager = SessionManager(session_file=session_file_path)
+
+        # 预生成各Agent类型的默认推荐问题（后台线程，不阻塞启动）
+        if os.getenv('SUGGESTION_WARMUP', 'true').lower() == 'true':
+            from utils.suggested_questions import warm_up_suggested_questions
+            warm_up_suggested_questions(list(dict.fromkeys(app.session_manager.agent_types.values())))
+        _services_pid = os.getpid()
+
+@app.before_request
+def ensure_app_services():
+    """未通过post_fork钩子初始化时（如其他WSGI服务器），在首个请求前初始化"""
+    init_app_services()
+
+# 预加载分词器：配合gunicorn --preload在fork前加载，各worker通过写时复制共享词表内存，避免首个请求时加载
+# （导入时只加载分词器这类不启动线程的内容，其余初始化见init_app_services）
+if os.getenv('TOKENIZER_PRELOAD', 'true').lower() == 'true':
+    from qwen_agent.utils.tokenization_qwen import get_tokenizer
+    get_tokenizer()
 
 @app.route('/flask/static/<path:filename>')
 def serve_static_file(filename):
@@ -171,4 +210,5 @@ if __name__ == '__main__':
     else:
         logger.info("启动生产模式 - 禁用debug模式")
     
+    init_app_services()
     app.run(debug=debug_mode, port=5000, host='0.0.0.0')
\ No newline at end of file
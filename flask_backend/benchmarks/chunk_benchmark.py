@@ -0,0 +1,208 @@
+"""文档分块的基准测试
+
+生成一份中英文混合的长文档（默认1000页，包含普通段落、需要按句子拆分的长段落和超长句子），
+对比优化前的分块实现（逐段落判断、逐句子调用分词器并把token转换为字符串形式计数、
+逐字节拼接超长句子的切片）与当前实现（按段落和句子的累计token偏移二分查找分块边界、
+句子只编码一次、分词器跳过特殊token匹配的快速路径）的CPU耗时，并校验两者的分块结果完全一致。
+
+运行方式（在项目根目录下）：
+    python flask_backend/benchmarks/chunk_benchmark.py [--pages 1000] [--page-size 500]
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import unicodedata
+
+_flask_backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for _path in (os.path.dirname(_flask_backend_path), _flask_backend_path):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from qwen_agent.tools.doc_parser import Chunk, DocParser
+from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL
+from qwen_agent.utils.tokenization_qwen import QWenTokenizer, count_tokens, get_tokenizer, tokenizer
+
+WORDS = ('营业收入', '同比增长', '净利润', '现金流', '毛利率', '研发投入', '市场份额', '季度', '公司', '产品', 'revenue',
+         'growth', 'margin', 'quarter', 'the', 'of', 'market', 'model', 'retrieval', 'index', '2024', '15.3%')
+
+
+def make_document(num_pages: int, seed: int = 0) -> list:
+    """生成解析后的文档（与SimpleDocParser的输出格式相同，段落带有token数）"""
+    rng = random.Random(seed)
+
+    def sentence(min_words: int, max_words: int) -> str:
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+    pages = []
+    for page_num in range(1, num_pages + 1):
+        paras = []
+        for _ in range(rng.randint(4, 10)):
+            kind = rng.random()
+            if kind < 0.1:  # 长段落：需要按句子拆分
+                text = ''.join(sentence(5, 40) + rng.choice(['. ', '。']) for _ in range(rng.randint(20, 60)))
+            elif kind < 0.13:  # 超长句子：需要按token切分
+                text = sentence(600, 1200)
+            else:
+                text = '。'.join(sentence(3, 30) for _ in range(rng.randint(1, 4)))
+            paras.append({'text': text, 'token': count_tokens(text)})
+        pages.append({'page_num': page_num, 'content': paras})
+    return pages
+
+
+def _baseline_tokenize(self, text, allowed_special='all', disallowed_special=()):
+    tokens = []
+    text = unicodedata.normalize('NFC', text)
+    for t in self.tokenizer.encode(text, allowed_special=allowed_special, disallowed_special=disallowed_special):
+        tokens.append(self.decoder[t])
+    return tokens
+
+
+def _baseline_convert_tokens_to_string(self, tokens):
+    text = ''
+    temp = b''
+    for t in tokens:
+        if isinstance(t, str):
+            if temp:
+                text += temp.decode('utf-8', errors=self.errors)
+                temp = b''
+            text += t
+        else:
+            temp += t
+    if temp:
+        text += temp.decode('utf-8', errors=self.errors)
+    return text
+
+
+def _baseline_iter_doc_chunks(self, doc, path, title='', parser_page_size=500):
+    """优化前的分块实现"""
+
+    def _make_chunk(chunk, available_token, num_chunks):
+        if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
+            chunk.pop()
+        return Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
+                     metadata={
+                         'source': path,
+                         'title': title,
+                         'chunk_id': num_chunks
+                     },
+                     token=parser_page_size - available_token)
+
+    def _next_chunk(chunk):
+        overlap_txt = self._get_last_part(chunk)
+        if overlap_txt.strip():
+            return [f'[page: {str(chunk[-1][1])}]', overlap_txt], parser_page_size - count_tokens(overlap_txt)
+        return [], parser_page_size
+
+    num_chunks = 0
+    chunk = []
+    available_token = parser_page_size
+    has_para = False
+    for page in doc:
+        page_num = page['page_num']
+        if not chunk or f'[page: {str(page_num)}]' != chunk[0]:
+            chunk.append(f'[page: {str(page_num)}]')
+        idx = 0
+        while idx < len(page['content']):
+            if not chunk:
+                chunk.append(f'[page: {str(page_num)}]')
+            para = page['content'][idx]
+            txt = para.get('text', para.get('table'))
+            token = para['token']
+            if token <= available_token:
+                available_token -= token
+                chunk.append([txt, page_num])
+                has_para = True
+                idx += 1
+            elif has_para:
+                yield _make_chunk(chunk, available_token, num_chunks)
+                num_chunks += 1
+                chunk, available_token = _next_chunk(chunk)
+                has_para = False
+            else:
+                sentences = []
+                for s in re.split(r'\. |。', txt):
+                    token = count_tokens(s)
+                    if not s.strip() or token == 0:
+                        continue
+                    if token <= available_token:
+                        sentences.append([s, token])
+                    else:
+                        token_list = tokenizer.tokenize(s)
+                        for si in range(0, len(token_list), available_token):
+                            ss = tokenizer.convert_tokens_to_string(
+                                token_list[si:min(len(token_list), si + available_token)])
+                            sentences.append([ss, min(available_token, len(token_list) - si)])
+                sent_index = 0
+                while sent_index < len(sentences):
+                    s, token = sentences[sent_index]
+                    if not chunk:
+                        chunk.append(f'[page: {str(page_num)}]')
+                    if token <= available_token or (not has_para):
+                        available_token -= token
+                        chunk.append([s, page_num])
+                        has_para = True
+                        sent_index += 1
+                    else:
+                        yield _make_chunk(chunk, available_token, num_chunks)
+                        num_chunks += 1
+                        chunk, available_token = _next_chunk(chunk)
+                        has_para = False
+                idx += 1
+    if has_para:
+        yield _make_chunk(chunk, available_token, num_chunks)
+
+
+@contextlib.contextmanager
+def _baseline_implementation():
+    """临时恢复优化前的实现"""
+    saved = (QWenTokenizer.tokenize, QWenTokenizer.encode, QWenTokenizer.count_tokens,
+             QWenTokenizer.convert_tokens_to_string, DocParser.iter_doc_chunks)
+    QWenTokenizer.tokenize = _baseline_tokenize
+    QWenTokenizer.encode = lambda self, text: self.convert_tokens_to_ids(self.tokenize(text))
+    QWenTokenizer.count_tokens = lambda self, text: len(self.tokenize(text))
+    QWenTokenizer.convert_tokens_to_string = _baseline_convert_tokens_to_string
+    DocParser.iter_doc_chunks = _baseline_iter_doc_chunks
+    try:
+        yield
+    finally:
+        (QWenTokenizer.tokenize, QWenTokenizer.encode, QWenTokenizer.count_tokens,
+         QWenTokenizer.convert_tokens_to_string, DocParser.iter_doc_chunks) = saved
+
+
+def measure(parser: DocParser, doc: list, page_size: int):
+    start = time.process_time()
+    chunks = parser.split_doc_to_chunk(doc, 'benchmark.pdf', title='benchmark', parser_page_size=page_size)
+    return time.process_time() - start, [chk.to_dict() for chk in chunks]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文档分块的基准测试')
+    parser.add_argument('--pages', type=int, default=1000, help='文档页数')
+    parser.add_argument('--page-size', type=int, default=500, help='每个分块的最大token数量')
+    args = parser.parse_args()
+
+    get_tokenizer()  # 分词器的加载时间不计入
+    doc = make_document(args.pages)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_parser = DocParser({'path': tmp_dir})
+        with _baseline_implementation():
+            results = {'优化前': measure(doc_parser, doc, args.page_size)}
+        results['当前实现'] = measure(doc_parser, doc, args.page_size)
+
+    num_paras = sum(len(page['content']) for page in doc)
+    num_chunks = len(results['当前实现'][1])
+    same = results['优化前'][1] == results['当前实现'][1]
+    print(f'{args.pages}页，{num_paras}个段落，分块大小{args.page_size}，共{num_chunks}个分块，分块结果{"一致" if same else "不一致"}\n')
+    print(f'{"实现":<10}{"CPU耗时(秒)":>14}')
+    for name, (cpu_time, _) in results.items():
+        print(f'{name:<10}{cpu_time:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
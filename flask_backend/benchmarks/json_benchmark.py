@@ -0,0 +1,86 @@
+"""JSON解析与SSE编码的微基准测试
+
+对比工具调用参数的几种解析方式（json5、标准库json、orjson、qwen_agent的json_loads快速路径），
+以及SSE消息的编码方式（标准库json、encode_sse）。
+
+运行方式（在项目根目录下）：
+    python flask_backend/benchmarks/json_benchmark.py [--number 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+_flask_backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for _path in (os.path.dirname(_flask_backend_path), _flask_backend_path):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import json5
+
+from qwen_agent.utils.utils import json_loads
+from utils.sse import encode_sse, orjson
+
+# 模型实际输出的工具调用参数（<tool_call>标签内的文本）
+TOOL_CALL_PAYLOADS = {
+    'MCP工具-短参数': '{"name": "amap-maps-maps_weather", "arguments": {"city": "杭州"}}',
+    'SQL查询':
+        '{"name": "mysql-execute_sql", "arguments": {"query": "SELECT trade_date, open, high, low, close, vol '
+        'FROM stock_daily WHERE ts_code = \'600519.SH\' AND trade_date >= \'20240101\' ORDER BY trade_date"}}',
+    '代码执行':
+        json.dumps(
+            {
+                'name': 'code_interpreter',
+                'arguments': {
+                    'code': ('import pandas as pd\nimport matplotlib.pyplot as plt\n\n'
+                             "df = pd.read_csv('sales.csv')\n"
+                             "monthly = df.groupby('month')['amount'].sum()\n"
+                             "monthly.plot(kind='bar', title='月度销售额')\n"
+                             "plt.savefig('sales.png')\nprint(monthly.describe())\n") * 4
+                }
+            },
+            ensure_ascii=False),
+    '非严格JSON（需json5）': "{name: 'retrieval', arguments: {query: '年度报告中的营收数据', files: ['report.pdf',],},}",
+}
+
+SSE_CHUNK = {
+    'type': 'chunk',
+    'content': '根据检索到的数据，2024年第一季度的营收同比增长了12.5%，主要来自于海外市场的扩张。' * 3,
+    'reasoning_content': '',
+    'session_id': 'b7e4c1d2-5a6f-4e3b-9c8d-0f1e2a3b4c5d',
+}
+
+
+def _bench(func, number: int) -> float:
+    """返回单次调用的平均耗时（微秒）"""
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def run(number: int):
+    print(f'orjson: {"已安装" if orjson is not None else "未安装"}，每项重复{number}次，单位：微秒/次\n')
+
+    print(f'{"工具调用参数":<24}{"json5":>10}{"json":>10}{"orjson":>10}{"json_loads":>12}')
+    for name, payload in TOOL_CALL_PAYLOADS.items():
+        row = [_bench(lambda: json5.loads(payload), number)]
+        for loads in (json.loads, orjson.loads if orjson is not None else None):
+            try:
+                loads(payload)
+                row.append(_bench(lambda: loads(payload), number))
+            except Exception:
+                row.append(None)  # 非严格JSON或未安装orjson
+        row.append(_bench(lambda: json_loads(payload), number))
+        print(f'{name:<24}' + ''.join(f'{"-" if t is None else f"{t:.1f}":>10}' for t in row[:3]) +
+              f'{row[3]:>12.1f}')
+
+    print(f'\n{"SSE编码":<24}{"json":>10}{"encode_sse":>12}')
+    t_json = _bench(lambda: f"data: {json.dumps(SSE_CHUNK, ensure_ascii=False)}\n\n".encode('utf-8'), number)
+    t_sse = _bench(lambda: encode_sse(SSE_CHUNK), number)
+    print(f'{"chunk消息":<24}{t_json:>10.1f}{t_sse:>12.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='JSON解析与SSE编码的微基准测试')
+    parser.add_argument('--number', type=int, default=2000, help='每项测试的重复次数')
+    run(parser.parse_args().number)
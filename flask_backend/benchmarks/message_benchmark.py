@@ -0,0 +1,145 @@
+"""消息处理的基准测试（模拟多轮工具调用的流式Agent循环）
+
+模拟一次包含多轮工具调用的流式回复：每个chunk都经过qwen_agent的输出后处理
+（转换为多模态格式、停止词截断、转换为文本格式），并像Agent.run一样把完整的
+回复列表转换为dict返回。对比优化前的实现（通过model_dump读取ContentItem、
+每个chunk深拷贝消息和重新分词停止词、每次yield重新dump全部消息）与当前实现的
+CPU耗时和内存峰值。
+
+运行方式（在项目根目录下）：
+    python flask_backend/benchmarks/message_benchmark.py [--rounds 4] [--chunks 200]
+"""
+
+import argparse
+import contextlib
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+_flask_backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for _path in (os.path.dirname(_flask_backend_path), _flask_backend_path):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import qwen_agent.llm.base as llm_base
+from qwen_agent.agent import _dump_message
+from qwen_agent.llm.base import _format_as_text_messages, _postprocess_stop_words
+from qwen_agent.llm.schema import ASSISTANT, FUNCTION, ContentItem, Message
+from qwen_agent.utils.tokenization_qwen import tokenizer
+from qwen_agent.utils.utils import format_as_multimodal_message
+
+CHUNK_TEXT = '根据查询结果，该股票近30个交易日的平均收盘价为1685.2元，'
+TOOL_RESULT = '\n'.join(f'2024-03-{i:02d},1680.{i},1702.{i},1671.{i},1695.{i},{30000 + i}' for i in range(1, 31))
+# 模拟服务端返回的原始响应，会随每个chunk保存在Message.extra中
+SERVICE_INFO = {
+    'status_code': 200,
+    'request_id': 'c6a5e3f0-1b2d-4c8e-9f7a-0d1e2f3a4b5c',
+    'output': {
+        'choices': [{
+            'finish_reason': 'null',
+            'message': {
+                'role': 'assistant',
+                'content': CHUNK_TEXT
+            }
+        }]
+    },
+    'usage': {
+        'input_tokens': 3120,
+        'output_tokens': 48,
+        'prompt_tokens_details': {
+            'cached_tokens': 2944
+        }
+    },
+}
+STOP_WORDS = ['✿RESULT✿', '✿RETURN✿']
+
+
+@contextlib.contextmanager
+def _baseline_implementation():
+    """临时恢复优化前的实现"""
+
+    def get_type_and_value(self):
+        (t, v), = self.model_dump().items()
+        return t, v
+
+    def get_partial_stop_words(stop):
+        partial_stop = []
+        for s in stop:
+            s = tokenizer.tokenize(s)[:-1]
+            if s:
+                partial_stop.append(tokenizer.convert_tokens_to_string(s))
+        return sorted(set(partial_stop))
+
+    saved = (ContentItem.get_type_and_value, llm_base.copy_messages, llm_base._get_partial_stop_words)
+    ContentItem.get_type_and_value = get_type_and_value
+    llm_base.copy_messages = copy.deepcopy
+    llm_base._get_partial_stop_words = get_partial_stop_words
+    try:
+        yield
+    finally:
+        ContentItem.get_type_and_value, llm_base.copy_messages, llm_base._get_partial_stop_words = saved
+
+
+def _postprocess(messages):
+    messages = [
+        format_as_multimodal_message(msg,
+                                     add_upload_info=False,
+                                     add_multimodel_upload_info=False,
+                                     add_audio_upload_info=False) for msg in messages
+    ]
+    messages = _postprocess_stop_words(messages, stop=STOP_WORDS)
+    return _format_as_text_messages(messages)
+
+
+def run_agent_loop(rounds: int, chunks: int, baseline: bool):
+    response = []
+    dumped = {}
+    for _ in range(rounds):
+        text = ''
+        output = []
+        for _ in range(chunks):
+            text += CHUNK_TEXT
+            output = _postprocess([Message(role=ASSISTANT, content=text, extra={'model_service_info': SERVICE_INFO})])
+            rsp = response + output
+            if baseline:
+                _ = [x.model_dump() for x in rsp]
+            else:
+                dumped = {id(x): _dump_message(x, dumped) for x in rsp}
+                _ = [dumped[id(x)][2] for x in rsp]
+        response.extend(output)
+        response.append(Message(role=FUNCTION, name='mysql-execute_sql', content=TOOL_RESULT))
+
+
+def measure(rounds: int, chunks: int, baseline: bool):
+    start = time.process_time()
+    run_agent_loop(rounds, chunks, baseline)
+    cpu_time = time.process_time() - start
+
+    # tracemalloc本身会拖慢执行，内存单独再跑一遍统计
+    tracemalloc.start()
+    run_agent_loop(rounds, chunks, baseline)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息处理的基准测试')
+    parser.add_argument('--rounds', type=int, default=4, help='工具调用轮数')
+    parser.add_argument('--chunks', type=int, default=200, help='每轮回复的流式chunk数量')
+    args = parser.parse_args()
+
+    with _baseline_implementation():
+        results = {'优化前': measure(args.rounds, args.chunks, baseline=True)}
+    results['当前实现'] = measure(args.rounds, args.chunks, baseline=False)
+
+    print(f'{args.rounds}轮工具调用，每轮{args.chunks}个chunk\n')
+    print(f'{"实现":<10}{"CPU耗时(秒)":>14}{"内存峰值(KB)":>16}')
+    for name, (cpu_time, peak) in results.items():
+        print(f'{name:<10}{cpu_time:>14.3f}{peak / 1024:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
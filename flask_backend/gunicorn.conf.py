@@ -0,0 +1,13 @@
+"""gunicorn配置文件
+
+gunicorn默认读取当前目录下的gunicorn.conf.py，因此需要在flask_backend目录下启动：
+    cd flask_backend && gunicorn --preload -w 4 -b 0.0.0.0:5000 wsgi:application
+
+使用--preload时，主进程导入应用时只预加载分词器，fork后各worker通过写时复制共享词表内存；
+MCP工具、会话管理器和推荐问题预热会启动线程，而线程不会随fork复制，因此在post_fork钩子中于每个worker内初始化。
+"""
+
+
+def post_fork(server, worker):
+    from app import init_app_services
+    init_app_services()
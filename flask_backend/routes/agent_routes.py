@@ -1,5 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app
 from utils.logger import logger
+from utils.suggested_questions import generate_suggested_questions
+from qwen_agent.tools.simple_doc_parser import get_parse_cache_stats
+import os
+import time
 import uuid
 
 agent_bp = Blueprint('agent', __name__)
@@ -59,7 +63,7 @@ def init_agent():
 def chat_with_agent():
     """与Agent对话（流式响应）"""
     from flask import Response
-    import json
+    from utils.sse import encode_sse
     import time
     
     data = request.get_json()
@@ -71,6 +75,15 @@ def chat_with_agent():
     file_paths = data.get('file_paths', [])  # 修改为file_paths以匹配前端
     file_path = data.get('file_path')  # 保持向后兼容
     deep_thinking = data.get('deep_thinking', True)  # 新增深度思考模式参数，默认开启
+    prefetch_suggestions = bool(data.get('prefetch_suggestions', False))  # 是否在流中返回相关推荐问题
+    
+    # 请求的时间预算（秒）：客户端可以缩短但不能超过服务端配置的上限
+    # JSON中的true/false会被解析为bool（int的子类），需要显式排除，避免true被当作1秒
+    timeout = float(os.getenv('CHAT_REQUEST_TIMEOUT', '300'))
+    client_timeout = data.get('timeout')
+    if isinstance(client_timeout, (int, float)) and not isinstance(client_timeout, bool) and client_timeout > 0:
+        timeout = min(timeout, float(client_timeout))
+    deadline = time.time() + timeout
     
     # 验证前日志：记录接收到的参数
     logger.info(f"[/chat] 验证前参数检查 - session_id: {session_id} (类型: {type(session_id).__name__}), message: {message[:50] if message else None}... (类型: {type(message).__name__}), file_paths: {file_paths} (类型: {type(file_paths).__name__}), file_path: {file_path} (类型: {type(file_path).__name__}), deep_thinking: {deep_thinking} (类型: {type(deep_thinking).__name__})")
@@ -112,8 +125,9 @@ def chat_with_agent():
             # 使用Agent的流式聊天方法
             if files:
                 # 如果有文件，需要特殊处理
-                for chunk in agent.chat_stream(message, files[0], deep_thinking=deep_thinking):
-                    chunk_data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                for chunk in agent.chat_stream(message, files[0], deep_thinking=deep_thinking,
+                                               prefetch_suggestions=prefetch_suggestions, deadline=deadline):
+                    chunk_data = encode_sse(chunk)
                     yield chunk_data
                     # 强制刷新输出缓冲区，确保数据立即发送
                     sys.stdout.flush()
@@ -121,8 +135,9 @@ def chat_with_agent():
                 session_mgr.touch_session(session_id)
             else:
                 # 使用流式方法
-                for chunk in agent.chat_stream(message, deep_thinking=deep_thinking):
-                    chunk_data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                for chunk in agent.chat_stream(message, deep_thinking=deep_thinking,
+                                               prefetch_suggestions=prefetch_suggestions, deadline=deadline):
+                    chunk_data = encode_sse(chunk)
                     yield chunk_data
                     # 强制刷新输出缓冲区，确保数据立即发送
                     sys.stdout.flush()
@@ -130,7 +145,7 @@ def chat_with_agent():
                 session_mgr.touch_session(session_id)
             
             # 发送结束标记
-            final_data = f"data: {json.dumps({'type': 'done', 'success': True}, ensure_ascii=False)}\n\n"
+            final_data = encode_sse({'type': 'done', 'success': True})
             yield final_data
             sys.stdout.flush()
             logger.info(f"流式聊天响应完成 - session_id: {session_id}")
@@ -143,7 +158,7 @@ def chat_with_agent():
                 'success': False,
                 'error': str(e)
             }
-            error_data = f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
+            error_data = encode_sse(error_chunk)
             yield error_data
             sys.stdout.flush()
     
@@ -240,6 +255,29 @@ def clear_session_history(session_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@agent_bp.route('/cancel/<session_id>', methods=['POST'])
+def cancel_chat(session_id):
+    """取消会话中进行中的流式聊天（模型调用的重试等待会立即结束）"""
+    # 验证前日志：记录接收到的参数
+    logger.info(f"[/cancel] 验证前参数检查 - session_id: {session_id} (类型: {type(session_id).__name__})")
+    
+    agent = get_session_manager().get_session(session_id)
+    if not agent:
+        logger.error(f"[/cancel] 验证失败 - 会话不存在: {session_id}")
+        return jsonify({'error': '会话不存在'}), 404
+    
+    logger.info(f"[/cancel] 参数验证通过")
+    
+    try:
+        cancelled = agent.cancel_chat()
+        return jsonify({
+            'success': True,
+            'cancelled': cancelled,
+            'message': '已取消进行中的聊天' if cancelled else '没有进行中的聊天'
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @agent_bp.route('/remove/<session_id>', methods=['DELETE'])
 def remove_session(session_id):
     """移除会话"""
@@ -271,7 +309,8 @@ def get_status():
             'session_count': get_session_manager().get_session_count(),
             'supported_agents': list(get_session_manager().agent_types.keys()),
             'alibaba_api_configured': bool(current_app.config.get('ALIBABA_API_KEY')),
-            'mcp_enabled': current_app.config.get('ENABLE_MCP', False)
+            'mcp_enabled': current_app.config.get('ENABLE_MCP', False),
+            'parse_cache': get_parse_cache_stats()  # 文档解析缓存命中率（仅为处理本次请求的进程的统计，多worker部署时各worker分别统计）
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -456,7 +495,7 @@ def generate_suggested_questions():
     
     try:
         # 生成推荐问题
-        questions = _generate_questions_with_llm(agent, question_type, user_message)
+        questions = generate_suggested_questions(agent, question_type, user_message)
         
         logger.info(f"[/suggested-questions] 推荐问题生成成功 - session_id: {session_id}, 问题数量: {len(questions)}")
         
@@ -470,180 +509,3 @@ def generate_suggested_questions():
     except Exception as e:
         logger.error(f"[/suggested-questions] 生成推荐问题失败 - session_id: {session_id}, error: {str(e)}")
         return jsonify({'error': str(e)}), 500
-
-def _generate_questions_with_llm(agent, question_type: str, user_message: str = '') -> list:
-    """使用大模型生成推荐问题
-    
-    Args:
-        agent: Agent实例（可以为None）
-        question_type: 问题类型 ('default' 或 'related')
-        user_message: 用户消息（用于生成相关问题）
-        
-    Returns:
-        list: 推荐问题列表
-    """
-    import uuid
-    import json
-    
-    # 如果没有agent，创建临时的默认agent来生成推荐问题
-    if not agent:
-        logger.info(f"[推荐问题生成] 无有效agent，创建临时默认agent生成推荐问题")
-        try:
-            # 创建临时的默认agent，提供必需的agent_id和user_id参数
-            from agents.general_agent import GeneralAgent
-            temp_agent = GeneralAgent(agent_id="temp_general", user_id="temp_user")
-            agent = temp_agent
-            logger.info(f"[推荐问题生成] 临时默认agent创建成功")
-        except Exception as e:
-            logger.error(f"[推荐问题生成] 创建临时agent失败: {str(e)}，使用备用推荐问题")
-            return _get_fallback_questions(question_type, user_message)
-    
-    try:
-        if question_type == 'default':
-            # 根据agent的系统提示词生成默认推荐问题
-            system_prompt = agent.get_system_prompt()
-            prompt = f"""基于以下AI助手的能力描述，生成3个用户可能会问的问题，这些问题应该以用户的口吻提问，展示助手的核心功能和特色。
-
-助手能力描述：
-{system_prompt}
-
-请生成3个简洁、自然且实用的问题，每个问题不超过20个字，问题应该以用户的口吻提问（比如"你能帮我..."、"如何..."、"什么是..."等）。请以JSON格式返回，格式如下：
-{{
-  "questions": [
-    "问题1",
-    "问题2", 
-    "问题3"
-  ]
-}}
-
-只返回JSON，不要包含其他内容。"""
-        else:
-            # 根据用户消息生成相关问题
-            prompt = f"""基于用户的提问内容，生成3个相关的后续问题，这些问题应该以用户的口吻提问，能够帮助用户深入了解相关话题或解决相关问题。
-
-用户的提问：
-{user_message}
-
-请生成3个简洁、相关且有价值的后续问题，每个问题不超过20个字，问题应该以用户的口吻提问（比如"你能帮我..."、"如何..."、"什么是..."、"能详细说说..."等）。请以JSON格式返回，格式如下：
-{{
-  "questions": [
-    "问题1",
-    "问题2",
-    "问题3"
-  ]
-}}
-
-只返回JSON，不要包含其他内容。"""
-        
-        # 构建临时消息用于生成推荐问题
-        temp_messages = [
-            {'role': 'user', 'content': prompt}
-        ]
-        
-        logger.info(f"[推荐问题生成] 开始调用大模型生成{question_type}类型的推荐问题")
-        
-        # 调用大模型生成问题
-        response = []
-        for resp in agent.bot.run(temp_messages):
-            response = resp
-        
-        # 提取助手回复
-        assistant_reply = None
-        for msg in reversed(response):
-            if msg.get('role') == 'assistant':
-                assistant_reply = msg.get('content', '')
-                break
-        
-        if not assistant_reply:
-            logger.warning(f"[推荐问题生成] 大模型未返回有效回复")
-            return _get_fallback_questions(question_type, user_message)
-        
-        # 解析JSON响应
-        try:
-            # 尝试提取JSON部分
-            json_start = assistant_reply.find('{')
-            json_end = assistant_reply.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = assistant_reply[json_start:json_end]
-                result = json.loads(json_str)
-                questions_list = result.get('questions', [])
-            else:
-                logger.warning(f"[推荐问题生成] 响应中未找到JSON格式: {assistant_reply[:100]}...")
-                return _get_fallback_questions(question_type, user_message)
-        except json.JSONDecodeError as e:
-            logger.warning(f"[推荐问题生成] JSON解析失败: {e}, 响应内容: {assistant_reply[:100]}...")
-            return _get_fallback_questions(question_type, user_message)
-        
-        # 转换为标准格式
-        questions = []
-        for i, question_text in enumerate(questions_list[:3]):  # 最多取3个问题
-            if isinstance(question_text, str) and question_text.strip():
-                questions.append({
-                    'id': f'{question_type}-{uuid.uuid4().hex[:8]}',
-                    'text': question_text.strip()
-                })
-        
-        if not questions:
-            logger.warning(f"[推荐问题生成] 未生成有效问题，使用备用方案")
-            return _get_fallback_questions(question_type, user_message)
-        
-        logger.info(f"[推荐问题生成] 成功生成{len(questions)}个推荐问题")
-        return questions
-        
-    except Exception as e:
-        logger.error(f"[推荐问题生成] 生成过程出错: {str(e)}")
-        return _get_fallback_questions(question_type, user_message)
-
-def _get_fallback_questions(question_type: str, user_message: str = '') -> list:
-    """获取备用推荐问题
-    
-    Args:
-        question_type: 问题类型
-        user_message: 用户消息
-        
-    Returns:
-        list: 备用推荐问题列表
-    """
-    import uuid
-    
-    if question_type == 'default':
-        fallback_questions = [
-            "你能介绍一下AI技术对生活的影响吗？",
-            "如何提高我的工作效率和学习能力？",
-            "能分享一些实用的生活小技巧吗？"
-        ]
-    else:
-        # 根据用户消息内容生成相关问题
-        message_lower = user_message.lower()
-        if 'ai' in message_lower or '人工智能' in message_lower:
-            fallback_questions = [
-                "AI在哪些领域应用最广泛？",
-                "AI技术有哪些局限性？",
-                "如何学习AI相关知识？"
-            ]
-        elif '编程' in message_lower or '代码' in message_lower or 'code' in message_lower:
-            fallback_questions = [
-                "如何提高我的编程技能？",
-                "学习编程需要掌握哪些基础知识？",
-                "有哪些好的编程实践方法？"
-            ]
-        elif '学习' in message_lower or '教育' in message_lower:
-            fallback_questions = [
-                "如何制定有效的学习计划？",
-                "有哪些高效的学习方法？",
-                "如何保持学习动力？"
-            ]
-        else:
-            fallback_questions = [
-                "能详细解释一下这个概念吗？",
-                "有什么实际应用案例吗？",
-                "还有其他相关的信息吗？"
-            ]
-    
-    return [
-        {
-            'id': f'fallback-{uuid.uuid4().hex[:8]}',
-            'text': question
-        }
-        for question in fallback_questions
-    ]
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""辅助LLM调用
+
+推荐问题、会话标题、摘要等辅助提示词只需要一次普通的大模型调用，
+不需要Agent的工具、MCP和函数调用提示词。本模块按模型名复用进程内共享的
+chat model实例，直接调用llm.chat，避免为一次辅助调用创建完整的Agent，
+同时减少提示词token。
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from qwen_agent.llm import BaseChatModel, get_chat_model
+from .logger import logger
+
+DEFAULT_AUX_MAX_TOKENS = 1024  # 辅助调用的最大输出token数量
+
+_llm_pool: Dict[str, BaseChatModel] = {}
+_pool_lock = threading.Lock()
+
+
+def get_aux_llm(model: Optional[str] = None) -> BaseChatModel:
+    """获取共享的辅助chat model实例（按模型名复用）
+
+    Args:
+        model: 模型名称，默认使用DEFAULT_MODEL
+
+    Returns:
+        BaseChatModel: chat model实例
+    """
+    model = model or os.getenv('DEFAULT_MODEL', 'qwen-turbo-latest')
+    llm = _llm_pool.get(model)
+    if llm is None:
+        with _pool_lock:
+            llm = _llm_pool.get(model)
+            if llm is None:
+                llm = get_chat_model({
+                    'model': model,
+                    'api_key': os.getenv('ALIBABA_API_KEY'),
+                    'generate_cfg': {
+                        'enable_thinking': False,  # 辅助调用不需要思考模式
+                        'max_tokens': DEFAULT_AUX_MAX_TOKENS,
+                        'max_retries': 2,
+                    }
+                })
+                _llm_pool[model] = llm
+                logger.info(f"[辅助LLM] 创建共享chat model实例 - 模型: {model}")
+    return llm
+
+
+def aux_chat(prompt: str, system_prompt: Optional[str] = None, model: Optional[str] = None) -> Optional[str]:
+    """执行一次不带工具的辅助大模型调用
+
+    Args:
+        prompt: 用户提示词
+        system_prompt: 可选的系统提示词
+        model: 模型名称，默认使用DEFAULT_MODEL
+
+    Returns:
+        Optional[str]: 模型回复文本，调用失败时返回None
+    """
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    messages.append({'role': 'user', 'content': prompt})
+
+    try:
+        response = get_aux_llm(model).chat(messages=messages, stream=False)
+    except Exception as e:
+        logger.error(f"[辅助LLM] 调用失败: {str(e)}")
+        return None
+
+    for msg in reversed(response):
+        if msg.get('role') == 'assistant' and isinstance(msg.get('content'), str):
+            return msg['content']
+    return None
@@ -0,0 +1,282 @@
+"""MCP代理进程（跨worker共享MCP服务器）
+
+在gunicorn多worker部署下，每个worker都会各自启动一套MCP服务器子进程。
+本模块提供一个独立的MCP代理进程：由它统一持有MCP服务器连接，并通过本地
+Unix socket对外提供工具列表查询和工具调用，所有worker通过MCPBrokerClient
+共享同一套MCP服务器。
+
+启动方式：
+    python flask_backend/utils/mcp_broker.py --socket /tmp/ifish_mcp.sock
+
+worker端只需设置环境变量 MCP_BROKER_SOCKET=/tmp/ifish_mcp.sock，
+应用启动时会自动改为从代理进程获取MCP工具。
+
+通信协议为按行分隔的JSON：
+    请求 {"op": "list_tools"}
+    响应 {"ok": true, "tools": [{"register_name": ..., "server_name": ..., "tool_name": ...,
+                                 "description": ..., "parameters": {...}}]}
+    请求 {"op": "call_tool", "name": "<register_name>", "arguments": "<json字符串>"}
+    响应 {"ok": true, "result": "..."} 或 {"ok": false, "error": "..."}
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+from typing import Any, Dict, List, Optional, Union
+
+if __name__ == '__main__':
+    # 作为独立进程启动时，补齐与app.py一致的模块搜索路径
+    _flask_backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    for _path in (os.path.dirname(_flask_backend_path), _flask_backend_path):
+        if _path not in sys.path:
+            sys.path.insert(0, _path)
+
+from qwen_agent.tools.base import BaseTool
+from utils.logger import logger
+
+DEFAULT_CALL_TIMEOUT = 300  # MCP工具调用的默认超时时间（秒）
+
+
+def _send_json(sock_file, data: Dict[str, Any]):
+    sock_file.write((json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8'))
+    sock_file.flush()
+
+
+def _recv_json(sock_file) -> Optional[Dict[str, Any]]:
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """处理单个worker连接，一个连接上可以串行发送多个请求"""
+
+    def handle(self):
+        broker: 'MCPBroker' = self.server.broker
+        while True:
+            try:
+                request = _recv_json(self.rfile)
+            except (ValueError, OSError) as e:
+                logger.warning(f"[MCP代理] 请求解析失败，关闭连接: {e}")
+                return
+            if request is None:
+                return
+            try:
+                response = broker.dispatch(request)
+            except Exception as e:
+                logger.error(f"[MCP代理] 请求处理失败: {e}")
+                response = {'ok': False, 'error': str(e)}
+            try:
+                _send_json(self.wfile, response)
+            except OSError:
+                return
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MCPBroker:
+    """MCP代理服务端，持有唯一的一套MCP服务器连接"""
+
+    def __init__(self, socket_path: str, config: Dict[str, Any]):
+        self.socket_path = socket_path
+        self.config = config
+        self.tools: Dict[str, BaseTool] = {}
+        self.tool_infos: List[Dict[str, Any]] = []
+
+    def init_tools(self):
+        """初始化MCP服务器并缓存工具实例"""
+        from qwen_agent.tools.mcp_manager import MCPToolFactory
+
+        manager = MCPToolFactory.create_manager()
+        tool_instances = manager.initConfig(self.config) or []
+        for tool in tool_instances:
+            server_name, tool_name = tool.name.split('-', 1)
+            for candidate in self.config['mcpServers']:
+                # 服务器名本身可能包含'-'，以配置中的服务器名为准
+                if tool.name.startswith(candidate + '-'):
+                    server_name, tool_name = candidate, tool.name[len(candidate) + 1:]
+                    break
+            self.tools[tool.name] = tool
+            self.tool_infos.append({
+                'register_name': tool.name,
+                'server_name': server_name,
+                'tool_name': tool_name,
+                'description': tool.description,
+                'parameters': tool.parameters,
+            })
+        logger.info(f"[MCP代理] MCP工具初始化完成，工具数量: {len(self.tools)}")
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get('op')
+        if op == 'list_tools':
+            return {'ok': True, 'tools': self.tool_infos}
+        if op == 'call_tool':
+            name = request.get('name')
+            if name not in self.tools:
+                return {'ok': False, 'error': f'MCP工具不存在: {name}'}
+            arguments = request.get('arguments', '{}')
+            if not isinstance(arguments, str):
+                arguments = json.dumps(arguments, ensure_ascii=False)
+            result = self.tools[name].call(arguments)
+            if result is None:
+                return {'ok': False, 'error': f'MCP工具调用失败: {name}'}
+            return {'ok': True, 'result': result}
+        if op == 'ping':
+            return {'ok': True}
+        return {'ok': False, 'error': f'不支持的操作: {op}'}
+
+    def serve_forever(self):
+        """初始化工具后在Unix socket上提供服务（阻塞）"""
+        self.init_tools()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = _ThreadingUnixServer(self.socket_path, _BrokerRequestHandler)
+        server.broker = self
+        logger.info(f"[MCP代理] 开始监听: {self.socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class MCPBrokerClient:
+    """MCP代理客户端，在worker进程中使用，内部维护一个小的连接池"""
+
+    def __init__(self, socket_path: str, pool_size: int = 8, timeout: float = DEFAULT_CALL_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._pool: 'queue.LifoQueue' = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if conn[2] == os.getpid():
+                return conn
+            # fork（如gunicorn --preload）前建立的连接会被各worker继承，多个进程共用同一连接会读到彼此的响应，
+            # 因此只关闭本进程的文件描述符副本，并新建连接
+            self._close(conn)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock, sock.makefile('rwb'), os.getpid()
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        sock, sock_file, _ = conn
+        try:
+            sock_file.close()
+            sock.close()
+        except OSError:
+            pass
+
+    def request(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """发送一个请求并等待响应，连接出错时丢弃该连接"""
+        conn = self._acquire()
+        try:
+            _send_json(conn[1], data)
+            response = _recv_json(conn[1])
+            if response is None:
+                raise ConnectionError('MCP代理连接已关闭')
+        except Exception:
+            self._close(conn)
+            raise
+        self._release(conn)
+        return response
+
+    def list_tools(self) -> List[Dict[str, Any]]:
+        response = self.request({'op': 'list_tools'})
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', '获取MCP工具列表失败'))
+        return response['tools']
+
+    def call_tool(self, register_name: str, arguments: Union[str, dict]) -> str:
+        response = self.request({'op': 'call_tool', 'name': register_name, 'arguments': arguments})
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', 'MCP工具调用失败'))
+        return response['result']
+
+    def create_tools(self) -> List[BaseTool]:
+        """根据代理进程的工具列表创建本地代理工具实例"""
+        return [self._create_tool(info) for info in self.list_tools()]
+
+    def _create_tool(self, info: Dict[str, Any]) -> BaseTool:
+        client = self
+        register_name = info['register_name']
+        server_name = info['server_name']
+        tool_name = info['tool_name']
+
+        def _notify(status_callback, status_type: str, message: str):
+            if not status_callback:
+                return
+            try:
+                status_callback({
+                    'type': status_type,
+                    'message': message,
+                    'server_name': server_name,
+                    'tool_name': tool_name
+                })
+            except Exception as e:
+                logger.warning(f"[MCP代理调用] 状态回调失败: {e}")
+
+        def call(self, params: Union[str, dict], **kwargs) -> str:
+            status_callback = kwargs.get('status_callback')
+            logger.info(f"[MCP代理调用] 开始执行MCP工具 - 服务器: {server_name}, 工具: {tool_name}")
+            _notify(status_callback, 'tool_start', f'正在调用MCP工具，请耐心等候: {tool_name}')
+            try:
+                result = client.call_tool(register_name, params)
+            except Exception as e:
+                logger.error(f"[MCP代理调用] MCP工具执行失败 - 服务器: {server_name}, 工具: {tool_name}, 错误: {e}")
+                _notify(status_callback, 'error', f'MCP工具调用失败: {tool_name} - {str(e)}')
+                return None
+            _notify(status_callback, 'tool_success', f'成功调用MCP工具: {tool_name}')
+            return result
+
+        # 不写入全局TOOL_REGISTRY，避免与本进程内的同名MCP工具冲突
+        tool_class = type(f'{register_name}_Class', (BaseTool,), {
+            'name': register_name,
+            'description': info['description'],
+            'parameters': info['parameters'],
+            'call': call,
+        })
+        return tool_class()
+
+
+def main():
+    import argparse
+
+    from dotenv import load_dotenv
+
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    load_dotenv(os.path.join(project_root, '.env'))
+
+    from utils.mcp_manager import mcp_manager
+
+    parser = argparse.ArgumentParser(description='iFishAI MCP代理进程')
+    parser.add_argument('--socket',
+                        default=os.getenv('MCP_BROKER_SOCKET', '/tmp/ifish_mcp.sock'),
+                        help='Unix socket路径')
+    args = parser.parse_args()
+
+    config = mcp_manager.get_default_mcp_config()[0]
+    MCPBroker(args.socket, config).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
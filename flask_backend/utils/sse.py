@@ -0,0 +1,32 @@
+"""SSE消息编码
+
+流式聊天接口会把Agent输出的每个chunk编码为一条SSE消息，长回复会产生大量消息。
+安装了orjson时使用orjson编码（C实现，比标准库json快数倍，直接输出UTF-8字节），
+orjson无法编码的数据（如非字符串的key、超出64位的整数）以及未安装orjson时
+退化为标准库json。
+"""
+
+import json
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_sse(data: Dict[str, Any]) -> bytes:
+    """将数据编码为一条SSE消息（data: <json>\\n\\n）
+
+    Args:
+        data: 可JSON序列化的消息内容
+
+    Returns:
+        bytes: UTF-8编码的SSE消息
+    """
+    if orjson is not None:
+        try:
+            return b'data: ' + orjson.dumps(data) + b'\n\n'
+        except TypeError:
+            pass
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
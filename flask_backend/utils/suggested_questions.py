@@ -0,0 +1,246 @@
+"""推荐问题生成
+
+默认推荐问题根据Agent的系统提示词生成，相关推荐问题根据用户消息生成，
+均通过共享的辅助LLM调用，并经过推荐问题缓存。
+"""
+
+import json
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from .aux_llm import aux_chat
+from .logger import logger
+from .suggestion_cache import suggestion_cache
+
+# 与主对话流并行生成相关问题的线程池
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='suggestion-prefetch')
+
+
+def generate_suggested_questions(agent, question_type: str, user_message: str = '') -> list:
+    """生成推荐问题，优先从推荐问题缓存中获取
+    
+    Args:
+        agent: Agent实例（可以为None）
+        question_type: 问题类型 ('default' 或 'related')
+        user_message: 用户消息（用于生成相关问题）
+        
+    Returns:
+        list: 推荐问题列表
+    """
+    if question_type == 'default':
+        # 默认问题只取决于Agent的系统提示词，按Agent类型缓存；无会话时使用通用助手
+        if agent:
+            agent_type = type(agent).__name__
+            system_prompt = agent.get_system_prompt()
+        else:
+            from agents.general_agent import GeneralAgent
+            agent_type = GeneralAgent.__name__
+            system_prompt = _get_agent_system_prompt(GeneralAgent)
+        question_texts = suggestion_cache.get_default(
+            agent_type,
+            system_prompt,
+            lambda: _call_llm_for_questions(question_type, system_prompt=system_prompt)
+        )
+    else:
+        question_texts = suggestion_cache.get_related(
+            user_message,
+            lambda: _call_llm_for_questions(question_type, user_message=user_message)
+        )
+    
+    if not question_texts:
+        return _get_fallback_questions(question_type, user_message)
+    
+    return [
+        {
+            'id': f'{question_type}-{uuid.uuid4().hex[:8]}',
+            'text': text
+        }
+        for text in question_texts
+    ]
+
+
+def warm_up_suggested_questions(agent_classes):
+    """在后台线程中为各Agent类型预先生成默认推荐问题
+    
+    Args:
+        agent_classes: Agent类列表
+    """
+    def _warm_up():
+        for agent_class in agent_classes:
+            try:
+                system_prompt = _get_agent_system_prompt(agent_class)
+                suggestion_cache.get_default(
+                    agent_class.__name__,
+                    system_prompt,
+                    lambda: _call_llm_for_questions('default', system_prompt=system_prompt)
+                )
+            except Exception as e:
+                logger.error(f"[推荐问题预生成] {agent_class.__name__} 默认问题预生成失败: {str(e)}")
+    
+    threading.Thread(target=_warm_up, name='suggestion-warmup', daemon=True).start()
+
+
+def prefetch_related_questions(agent, user_message: str) -> Future:
+    """在后台线程中提前生成相关问题，供流式对话在结束前直接返回
+
+    Args:
+        agent: Agent实例
+        user_message: 用户消息
+
+    Returns:
+        Future: 结果为推荐问题列表
+    """
+    return _prefetch_executor.submit(generate_suggested_questions, agent, 'related', user_message)
+
+
+def _get_agent_system_prompt(agent_class) -> str:
+    """获取Agent类的系统提示词
+    
+    各Agent的系统提示词与实例状态无关，这里跳过__init__（不创建Assistant和MCP工具）直接读取
+    """
+    return object.__new__(agent_class).get_system_prompt()
+
+
+def _call_llm_for_questions(question_type: str, system_prompt: str = '', user_message: str = '') -> Optional[List[str]]:
+    """通过共享的辅助LLM生成推荐问题（不经过Agent的工具和函数调用提示词）
+    
+    Args:
+        question_type: 问题类型 ('default' 或 'related')
+        system_prompt: Agent的系统提示词（用于生成默认问题）
+        user_message: 用户消息（用于生成相关问题）
+        
+    Returns:
+        Optional[List[str]]: 推荐问题文本列表，生成失败时返回None
+    """
+    try:
+        if question_type == 'default':
+            # 根据agent的系统提示词生成默认推荐问题
+            prompt = f"""基于以下AI助手的能力描述，生成3个用户可能会问的问题，这些问题应该以用户的口吻提问，展示助手的核心功能和特色。
+
+助手能力描述：
+{system_prompt}
+
+请生成3个简洁、自然且实用的问题，每个问题不超过20个字，问题应该以用户的口吻提问（比如"你能帮我..."、"如何..."、"什么是..."等）。请以JSON格式返回，格式如下：
+{{
+  "questions": [
+    "问题1",
+    "问题2", 
+    "问题3"
+  ]
+}}
+
+只返回JSON，不要包含其他内容。"""
+        else:
+            # 根据用户消息生成相关问题
+            prompt = f"""基于用户的提问内容，生成3个相关的后续问题，这些问题应该以用户的口吻提问，能够帮助用户深入了解相关话题或解决相关问题。
+
+用户的提问：
+{user_message}
+
+请生成3个简洁、相关且有价值的后续问题，每个问题不超过20个字，问题应该以用户的口吻提问（比如"你能帮我..."、"如何..."、"什么是..."、"能详细说说..."等）。请以JSON格式返回，格式如下：
+{{
+  "questions": [
+    "问题1",
+    "问题2",
+    "问题3"
+  ]
+}}
+
+只返回JSON，不要包含其他内容。"""
+        
+        logger.info(f"[推荐问题生成] 开始调用大模型生成{question_type}类型的推荐问题")
+        
+        # 调用大模型生成问题
+        assistant_reply = aux_chat(prompt)
+        
+        if not assistant_reply:
+            logger.warning(f"[推荐问题生成] 大模型未返回有效回复")
+            return None
+        
+        # 解析JSON响应
+        try:
+            # 尝试提取JSON部分
+            json_start = assistant_reply.find('{')
+            json_end = assistant_reply.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                json_str = assistant_reply[json_start:json_end]
+                result = json.loads(json_str)
+                questions_list = result.get('questions', [])
+            else:
+                logger.warning(f"[推荐问题生成] 响应中未找到JSON格式: {assistant_reply[:100]}...")
+                return None
+        except json.JSONDecodeError as e:
+            logger.warning(f"[推荐问题生成] JSON解析失败: {e}, 响应内容: {assistant_reply[:100]}...")
+            return None
+        
+        # 过滤无效问题
+        questions = []
+        for question_text in questions_list[:3]:  # 最多取3个问题
+            if isinstance(question_text, str) and question_text.strip():
+                questions.append(question_text.strip())
+        
+        if not questions:
+            logger.warning(f"[推荐问题生成] 未生成有效问题")
+            return None
+        
+        logger.info(f"[推荐问题生成] 成功生成{len(questions)}个推荐问题")
+        return questions
+        
+    except Exception as e:
+        logger.error(f"[推荐问题生成] 生成过程出错: {str(e)}")
+        return None
+
+
+def _get_fallback_questions(question_type: str, user_message: str = '') -> list:
+    """获取备用推荐问题
+    
+    Args:
+        question_type: 问题类型
+        user_message: 用户消息
+        
+    Returns:
+        list: 备用推荐问题列表
+    """
+    if question_type == 'default':
+        fallback_questions = [
+            "你能介绍一下AI技术对生活的影响吗？",
+            "如何提高我的工作效率和学习能力？",
+            "能分享一些实用的生活小技巧吗？"
+        ]
+    else:
+        # 根据用户消息内容生成相关问题
+        message_lower = user_message.lower()
+        if 'ai' in message_lower or '人工智能' in message_lower:
+            fallback_questions = [
+                "AI在哪些领域应用最广泛？",
+                "AI技术有哪些局限性？",
+                "如何学习AI相关知识？"
+            ]
+        elif '编程' in message_lower or '代码' in message_lower or 'code' in message_lower:
+            fallback_questions = [
+                "如何提高我的编程技能？",
+                "学习编程需要掌握哪些基础知识？",
+                "有哪些好的编程实践方法？"
+            ]
+        elif '学习' in message_lower or '教育' in message_lower:
+            fallback_questions = [
+                "如何制定有效的学习计划？",
+                "有哪些高效的学习方法？",
+                "如何保持学习动力？"
+            ]
+        else:
+            fallback_questions = [
+                "能详细解释一下这个概念吗？",
+                "有什么实际应用案例吗？",
+                "还有其他相关的信息吗？"
+            ]
+    
+    return [
+        {
+            'id': f'fallback-{uuid.uuid4().hex[:8]}',
+            'text': question
+        }
+        for question in fallback_questions
+    ]
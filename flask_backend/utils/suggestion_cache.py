@@ -0,0 +1,208 @@
+"""推荐问题缓存
+
+推荐问题接口的两类问题都有很高的重复度：
+- 默认问题只取决于Agent的系统提示词，按Agent类型缓存，过期后在后台线程刷新，
+  请求始终直接返回已缓存的结果（应用启动时可预先生成）；
+- 相关问题按归一化后的用户消息缓存（LRU + TTL），可选通过文本向量相似度
+  命中语义相近的历史提问。
+
+缓存中只保存问题文本列表，问题id由调用方在返回时生成。
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .logger import logger
+
+# 生成函数：返回问题文本列表，生成失败时返回None（失败结果不会被缓存）
+QuestionGenerator = Callable[[], Optional[List[str]]]
+
+_PUNCTUATION_PATTERN = re.compile(r'[\s\?？!！。.,，、~～…]+$')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """归一化用户消息：全角转半角、统一小写、合并空白并去掉末尾标点"""
+    text = unicodedata.normalize('NFKC', message or '').strip().lower()
+    text = _WHITESPACE_PATTERN.sub(' ', text)
+    return _PUNCTUATION_PATTERN.sub('', text)
+
+
+class SuggestionCache:
+    """推荐问题缓存（线程安全）"""
+
+    def __init__(self,
+                 default_ttl: int = 3600,
+                 related_ttl: int = 86400,
+                 max_related: int = 2048,
+                 similarity_threshold: float = 0.0,
+                 embedding_model: str = 'text-embedding-v1'):
+        self.default_ttl = default_ttl  # 默认问题的刷新间隔（秒）
+        self.related_ttl = related_ttl  # 相关问题的过期时间（秒）
+        self.max_related = max_related  # 相关问题最多缓存的条数
+        self.similarity_threshold = similarity_threshold  # 向量相似度阈值，<=0表示不启用语义匹配
+        self.embedding_model = embedding_model
+        self._lock = threading.Lock()
+        # 默认问题：key为Agent类型，value为(系统提示词hash, 问题列表, 生成时间)
+        self._default: Dict[str, Tuple[Optional[str], List[str], float]] = {}
+        self._refreshing = set()
+        # 相关问题：key为归一化后的用户消息，value为(问题列表, 生成时间, 文本向量)
+        self._related: 'OrderedDict[str, Tuple[List[str], float, Optional[object]]]' = OrderedDict()
+        self._stats = {'default_hits': 0, 'default_misses': 0, 'related_hits': 0, 'semantic_hits': 0, 'related_misses': 0}
+
+    @staticmethod
+    def _hash_prompt(system_prompt: Optional[str]) -> Optional[str]:
+        if system_prompt is None:
+            return None
+        return hashlib.md5(system_prompt.encode('utf-8')).hexdigest()
+
+    # ---------------- 默认问题 ----------------
+
+    def get_default(self, agent_type: str, system_prompt: Optional[str],
+                    generate: QuestionGenerator) -> Optional[List[str]]:
+        """获取默认问题
+
+        Args:
+            agent_type: Agent类型（缓存key）
+            system_prompt: 当前的系统提示词，提示词变化时缓存失效；为None时不校验提示词
+            generate: 缓存未命中或需要刷新时调用的生成函数
+
+        Returns:
+            Optional[List[str]]: 问题文本列表，生成失败时返回None
+        """
+        prompt_hash = self._hash_prompt(system_prompt)
+        with self._lock:
+            entry = self._default.get(agent_type)
+            if entry and (prompt_hash is None or entry[0] == prompt_hash):
+                self._stats['default_hits'] += 1
+                if time.time() - entry[2] > self.default_ttl:
+                    # 已过期：先返回旧结果，再在后台刷新
+                    self._refresh_in_background(agent_type, prompt_hash or entry[0], generate)
+                return list(entry[1])
+            self._stats['default_misses'] += 1
+        return self._generate_default(agent_type, prompt_hash, generate)
+
+    def _refresh_in_background(self, agent_type: str, prompt_hash: Optional[str], generate: QuestionGenerator):
+        # 调用方需持有self._lock
+        if agent_type in self._refreshing:
+            return
+        self._refreshing.add(agent_type)
+
+        def _refresh():
+            try:
+                self._generate_default(agent_type, prompt_hash, generate)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(agent_type)
+
+        threading.Thread(target=_refresh, name=f'suggestion-refresh-{agent_type}', daemon=True).start()
+
+    def _generate_default(self, agent_type: str, prompt_hash: Optional[str],
+                          generate: QuestionGenerator) -> Optional[List[str]]:
+        try:
+            questions = generate()
+        except Exception as e:
+            logger.error(f"[推荐问题缓存] 默认问题生成失败 - Agent类型: {agent_type}, 错误: {e}")
+            return None
+        if questions:
+            with self._lock:
+                self._default[agent_type] = (prompt_hash, list(questions), time.time())
+            logger.info(f"[推荐问题缓存] 默认问题已更新 - Agent类型: {agent_type}")
+        return questions
+
+    # ---------------- 相关问题 ----------------
+
+    def get_related(self, user_message: str, generate: QuestionGenerator) -> Optional[List[str]]:
+        """获取相关问题，先按归一化消息精确匹配，再按向量相似度匹配，都未命中时调用生成函数"""
+        key = normalize_message(user_message)
+        now = time.time()
+        with self._lock:
+            entry = self._related.get(key)
+            if entry and now - entry[1] <= self.related_ttl:
+                self._related.move_to_end(key)
+                self._stats['related_hits'] += 1
+                return list(entry[0])
+
+        embedding = None
+        if self.similarity_threshold > 0 and key:
+            embedding = self._embed(key)
+            if embedding is not None:
+                questions = self._lookup_similar(embedding, now)
+                if questions is not None:
+                    return questions
+
+        with self._lock:
+            self._stats['related_misses'] += 1
+        questions = generate()
+        if questions:
+            with self._lock:
+                self._related[key] = (list(questions), time.time(), embedding)
+                self._related.move_to_end(key)
+                while len(self._related) > self.max_related:
+                    self._related.popitem(last=False)
+        return questions
+
+    def _lookup_similar(self, embedding, now: float) -> Optional[List[str]]:
+        import numpy as np
+
+        with self._lock:
+            candidates = [(k, v) for k, v in self._related.items() if v[2] is not None and now - v[1] <= self.related_ttl]
+        if not candidates:
+            return None
+        matrix = np.stack([v[2] for _, v in candidates])
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._related:
+                self._related.move_to_end(key)
+            self._stats['semantic_hits'] += 1
+        logger.info(f"[推荐问题缓存] 语义命中 - 相似度: {float(scores[best]):.3f}, 命中消息: {key[:50]}")
+        return list(entry[0])
+
+    def _embed(self, text: str):
+        """计算归一化后的文本向量，失败时返回None（退化为精确匹配）"""
+        try:
+            import dashscope
+            import numpy as np
+
+            resp = dashscope.TextEmbedding.call(model=self.embedding_model, input=text)
+            if resp.status_code != 200:
+                logger.warning(f"[推荐问题缓存] 文本向量计算失败: {resp.code} {resp.message}")
+                return None
+            vector = np.asarray(resp.output['embeddings'][0]['embedding'], dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm > 0 else None
+        except Exception as e:
+            logger.warning(f"[推荐问题缓存] 文本向量计算失败: {e}")
+            return None
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['default_entries'] = len(self._default)
+            stats['related_entries'] = len(self._related)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._default.clear()
+            self._related.clear()
+
+
+# 全局推荐问题缓存实例
+suggestion_cache = SuggestionCache(
+    default_ttl=int(os.getenv('SUGGESTION_DEFAULT_TTL', '3600')),
+    related_ttl=int(os.getenv('SUGGESTION_RELATED_TTL', '86400')),
+    max_related=int(os.getenv('SUGGESTION_RELATED_MAX_SIZE', '2048')),
+    similarity_threshold=float(os.getenv('SUGGESTION_SIMILARITY_THRESHOLD', '0')),
+    embedding_model=os.getenv('SUGGESTION_EMBEDDING_MODEL', 'text-embedding-v1'),
+)
@@ -110,6 +110,7 @@ class Agent(ABC):
                     new_messages[0][CONTENT] = [ContentItem(text=self.system_message + '\n\n')
                                                ] + new_messages[0][CONTENT]  # noqa
 
+        dumped = {}
         for rsp in self._run(messages=new_messages, **kwargs):
             for i in range(len(rsp)):
                 if not rsp[i].name and self.name:
@@ -117,7 +118,10 @@ class Agent(ABC):
             if _return_message_type == 'message':
                 yield [Message(**x) if isinstance(x, dict) else x for x in rsp]
             else:
-                yield [x.model_dump() if not isinstance(x, dict) else x for x in rsp]
+                # The earlier messages of a response, e.g. the finished rounds of tool calls, are yielded again with
+                # every streamed chunk. They are dumped once and reused as long as they are unchanged.
+                dumped = {id(x): _dump_message(x, dumped) for x in rsp if not isinstance(x, dict)}
+                yield [dumped[id(x)][2] if not isinstance(x, dict) else x for x in rsp]
 
     @abstractmethod
     def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
@@ -164,6 +168,19 @@ class Agent(ABC):
                                  new_generate_cfg=extra_generate_cfg,
                              ))
 
+    def _get_functions(self) -> Tuple[Dict, ...]:
+        """The functions of the agent's tools, in the format passed to the LLM.
+
+        The tuple is only rebuilt when the tools change, so that the LLM can look up its rendered tool prompt by the
+        identity of the tuple instead of hashing all the functions on every call.
+        """
+        tools = tuple(self.function_map.values())
+        cached = getattr(self, '_functions_cache', None)
+        if cached is None or cached[0] != tools:
+            cached = (tools, tuple(tool.function for tool in tools))
+            self._functions_cache = cached
+        return cached[1]
+
     def _call_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> Union[str, List[ContentItem]]:
         """The interface of calling tools for the agent.
 
@@ -253,10 +270,22 @@ class Agent(ABC):
 
 
 # The most basic form of an agent is just a LLM, not augmented with any tool or workflow.
+def _dump_message(msg: Message, dumped: Dict[int, tuple]) -> tuple:
+    fields = (msg.role, msg.content, msg.reasoning_content, msg.name, msg.function_call, msg.extra)
+    cached = dumped.get(id(msg))
+    if cached and (cached[0] is msg) and all(a is b for a, b in zip(cached[1], fields)):
+        return cached
+    return msg, fields, msg.model_dump()
+
+
 class BasicAgent(Agent):
 
     def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
         extra_generate_cfg = {'lang': lang}
         if kwargs.get('seed') is not None:
             extra_generate_cfg['seed'] = kwargs['seed']
+        if kwargs.get('deadline') is not None:
+            extra_generate_cfg['deadline'] = kwargs['deadline']
+        if kwargs.get('cancel_event') is not None:
+            extra_generate_cfg['cancel_event'] = kwargs['cancel_event']
         return self._call_llm(messages, extra_generate_cfg=extra_generate_cfg)
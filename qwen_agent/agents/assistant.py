@@ -5,7 +5,7 @@ from typing import Dict, Iterator, List, Literal, Optional, Union
 
 from qwen_agent.agents.fncall_agent import FnCallAgent
 from qwen_agent.llm import BaseChatModel
-from qwen_agent.llm.schema import CONTENT, DEFAULT_SYSTEM_MESSAGE, ROLE, SYSTEM, ContentItem, Message
+from qwen_agent.llm.schema import CONTENT, DEFAULT_SYSTEM_MESSAGE, DYNAMIC_SUFFIX, ROLE, SYSTEM, ContentItem, Message
 from qwen_agent.log import logger
 from qwen_agent.tools import BaseTool
 from qwen_agent.utils.utils import get_basename_from_url, print_traceback
@@ -134,14 +134,21 @@ class Assistant(FnCallAgent):
             knowledge_prompt = KNOWLEDGE_TEMPLATE[lang].format(knowledge='\n\n'.join(snippets))
 
         if knowledge_prompt:
+            # The knowledge changes from turn to turn, so it is kept as a separate item at the end of the system message
+            # and marked as its dynamic suffix. The static instructions in front of it remain a cacheable prefix.
             if messages and messages[0][ROLE] == SYSTEM:
                 if isinstance(messages[0][CONTENT], str):
-                    messages[0][CONTENT] += '\n\n' + knowledge_prompt
-                else:
-                    assert isinstance(messages[0][CONTENT], list)
-                    messages[0][CONTENT] += [ContentItem(text='\n\n' + knowledge_prompt)]
+                    messages[0][CONTENT] = [ContentItem(text=messages[0][CONTENT])] if messages[0][CONTENT] else []
+                assert isinstance(messages[0][CONTENT], list)
+                knowledge_prompt = '\n\n' + knowledge_prompt
+                messages[0][CONTENT] += [ContentItem(text=knowledge_prompt)]
+                messages[0].extra = {**(messages[0].extra or {}), DYNAMIC_SUFFIX: knowledge_prompt}
             else:
-                messages = [Message(role=SYSTEM, content=knowledge_prompt)] + messages
+                messages = [
+                    Message(role=SYSTEM,
+                            content=[ContentItem(text=knowledge_prompt)],
+                            extra={DYNAMIC_SUFFIX: knowledge_prompt})
+                ] + messages
         return messages
 
 
@@ -4,8 +4,6 @@ import re
 import time
 from typing import Dict, Iterator, List, Optional, Union
 
-import json5
-
 from qwen_agent.agents.assistant import KNOWLEDGE_SNIPPET, Assistant, format_knowledge_to_source_and_content
 from qwen_agent.agents.doc_qa.parallel_doc_qa_member import NO_RESPONSE, ParallelDocQAMember
 from qwen_agent.agents.doc_qa.parallel_doc_qa_summary import ParallelDocQASummary
@@ -19,7 +17,7 @@ from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
 from qwen_agent.utils.parallel_executor import parallel_exec
 from qwen_agent.utils.tokenization_qwen import count_tokens
 from qwen_agent.utils.utils import (extract_files_from_messages, extract_text_from_message, get_file_type,
-                                    print_traceback)
+                                    json_loads, print_traceback)
 
 MAX_NO_RESPONSE_RETRY = 4
 DEFAULT_NAME = 'Simple Parallel DocQA With RAG Sum Agents'
@@ -111,7 +109,7 @@ class ParallelDocQA(Assistant):
 
         try:
             logger.info(keyword)
-            keyword_dict = json5.loads(keyword)
+            keyword_dict = json_loads(keyword)
             keyword_dict['text'] = query
             if unuse_member_res:
                 keyword_dict['text'] += '\n\n' + member_res
@@ -167,7 +165,7 @@ class ParallelDocQA(Assistant):
         if content.endswith('```'):
             content = content[:-3]
         try:
-            content_dict = json5.loads(content)
+            content_dict = json_loads(content)
             return True, content_dict
         except Exception:
             return False, content
@@ -1,11 +1,13 @@
 import copy
-from typing import Dict, Iterator, List, Literal, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 from qwen_agent import Agent
 from qwen_agent.llm import BaseChatModel
-from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, FUNCTION, Message
+from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, FUNCTION, FunctionCall, Message
+from qwen_agent.log import logger
 from qwen_agent.memory import Memory
-from qwen_agent.settings import MAX_LLM_CALL_PER_RUN
+from qwen_agent.settings import EARLY_TOOL_DISPATCH, MAX_LLM_CALL_PER_RUN
 from qwen_agent.tools import BaseTool
 from qwen_agent.utils.utils import extract_files_from_messages
 
@@ -66,21 +68,52 @@ class FnCallAgent(Agent):
             extra_generate_cfg = {'lang': lang}
             if kwargs.get('seed') is not None:
                 extra_generate_cfg['seed'] = kwargs['seed']
+            if kwargs.get('deadline') is not None:
+                extra_generate_cfg['deadline'] = kwargs['deadline']
+            if kwargs.get('cancel_event') is not None:
+                extra_generate_cfg['cancel_event'] = kwargs['cancel_event']
             output_stream = self._call_llm(messages=messages,
-                                           functions=[func.function for func in self.function_map.values()],
+                                           functions=self._get_functions(),
                                            extra_generate_cfg=extra_generate_cfg)
             output: List[Message] = []
-            for output in output_stream:
-                if output:
-                    yield response + output
+            early_calls: Dict[int, Tuple[str, str, Future]] = {}
+            executor = ThreadPoolExecutor(max_workers=1) if EARLY_TOOL_DISPATCH else None
+            completed = False
+            try:
+                for output in output_stream:
+                    if output:
+                        yield response + output
+                        if executor:
+                            self._dispatch_complete_tool_calls(executor, early_calls, messages, output, **kwargs)
+                completed = True
+            finally:
+                if executor:
+                    if not completed:
+                        # The response failed or was abandoned: drop the calls not started yet, and do not leave
+                        # the running one behind the caller's back.
+                        for _, _, future in early_calls.values():
+                            future.cancel()
+                    executor.shutdown(wait=not completed)
             if output:
                 response.extend(output)
                 messages.extend(output)
                 used_any_tool = False
-                for out in output:
+                for i, out in enumerate(output):
                     use_tool, tool_name, tool_args, _ = self._detect_tool(out)
                     if use_tool:
-                        tool_result = self._call_tool(tool_name, tool_args, messages=messages, **kwargs)
+                        early_call = early_calls.get(i)
+                        if early_call:
+                            if early_call[:2] != (tool_name, tool_args):
+                                # The tool has been run already, and running it again could repeat its side effects.
+                                # Keep the call that was actually made, so that the history matches the result.
+                                logger.warning(f'Tool call {i} changed after it was dispatched early, from '
+                                               f'{early_call[0]}({early_call[1]}) to {tool_name}({tool_args}). '
+                                               'Using the result of the dispatched call.')
+                                tool_name, tool_args = early_call[:2]
+                                out.function_call = FunctionCall(name=tool_name, arguments=tool_args)
+                            tool_result = early_call[2].result()
+                        else:
+                            tool_result = self._call_tool(tool_name, tool_args, messages=messages, **kwargs)
                         fn_msg = Message(
                             role=FUNCTION,
                             name=tool_name,
@@ -94,6 +127,22 @@ class FnCallAgent(Agent):
                     break
         yield response
 
+    def _dispatch_complete_tool_calls(self, executor: ThreadPoolExecutor, early_calls: Dict[int, tuple],
+                                      messages: List[Message], output: List[Message], **kwargs):
+        # A tool call in the streamed output is complete once another message follows it, so it can be started
+        # while the rest of the response is still being generated. The single worker keeps the calls in order.
+        for i in range(len(output) - 1):
+            if i in early_calls:
+                continue
+            use_tool, tool_name, tool_args, _ = self._detect_tool(output[i])
+            if use_tool:
+                future = executor.submit(self._call_tool,
+                                         tool_name,
+                                         tool_args,
+                                         messages=messages + output[:i + 1],
+                                         **kwargs)
+                early_calls[i] = (tool_name, tool_args, future)
+
     def _call_tool(self, tool_name: str, tool_args: Union[str, dict] = '{}', **kwargs) -> str:
         if tool_name not in self.function_map:
             return f'Tool {tool_name} does not exists.'
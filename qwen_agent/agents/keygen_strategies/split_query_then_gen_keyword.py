@@ -1,14 +1,13 @@
 import json
 from typing import Dict, Iterator, List, Optional, Union
 
-import json5
-
 from qwen_agent import Agent
 from qwen_agent.agents.keygen_strategies.gen_keyword import GenKeyword
 from qwen_agent.agents.keygen_strategies.split_query import SplitQuery
 from qwen_agent.llm.base import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.tools import BaseTool
+from qwen_agent.utils.utils import json_loads
 
 
 class SplitQueryThenGenKeyword(Agent):
@@ -32,7 +31,7 @@ class SplitQueryThenGenKeyword(Agent):
         if information.endswith('```'):
             information = information[:-3]
         try:
-            information = '\n'.join(json5.loads(information)['information']).strip()
+            information = '\n'.join(json_loads(information)['information']).strip()
             if 0 < len(information) <= len(query):
                 query = information
         except Exception:
@@ -48,7 +47,7 @@ class SplitQueryThenGenKeyword(Agent):
             if keyword.endswith('```'):
                 keyword = keyword[:-3]
             try:
-                keyword_dict = json5.loads(keyword)
+                keyword_dict = json_loads(keyword)
                 keyword_dict['text'] = query
                 yield [Message(role=ASSISTANT, content=json.dumps(keyword_dict, ensure_ascii=False))]
             except Exception:
@@ -10,6 +10,7 @@ from .qwenaudio_dashscope import QwenAudioChatAtDS
 from .qwenomni_oai import QwenOmniChatAtOAI
 from .qwenvl_dashscope import QwenVLChatAtDS
 from .qwenvl_oai import QwenVLChatAtOAI
+from .router import RouterChatModel
 
 
 def get_chat_model(cfg: Union[dict, str] = 'qwen-plus') -> BaseChatModel:
@@ -93,6 +94,7 @@ __all__ = [
     'QwenVLChatAtOAI',
     'QwenAudioChatAtDS',
     'QwenOmniChatAtOAI',
+    'RouterChatModel',
     'OpenVINO',
     'get_chat_model',
     'ModelServiceError',
@@ -1,18 +1,21 @@
 import copy
 import json
-import os
 import random
+import threading
 import time
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from pprint import pformat
 from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
-from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, SYSTEM, USER, Message
+from qwen_agent.llm.response_cache import ResponseCache
+from qwen_agent.llm.schema import (ASSISTANT, DEFAULT_SYSTEM_MESSAGE, DYNAMIC_SUFFIX, SYSTEM, USER, ContentItem,
+                                   Message, copy_messages)
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_INPUT_TOKENS
 from qwen_agent.utils.tokenization_qwen import tokenizer
 from qwen_agent.utils.utils import (extract_text_from_message, format_as_multimodal_message, format_as_text_message,
-                                    has_chinese_messages, json_dumps_compact, merge_generate_cfgs, print_traceback)
+                                    has_chinese_messages, json_dumps_compact, merge_generate_cfgs)
 
 LLM_REGISTRY = {}
 
@@ -65,24 +68,22 @@ class BaseChatModel(ABC):
         self.model = cfg.get('model', '').strip()
         generate_cfg = copy.deepcopy(cfg.get('generate_cfg', {}))
         cache_dir = cfg.get('cache_dir', generate_cfg.pop('cache_dir', None))
+        cache_memory_size = cfg.get('cache_memory_size', generate_cfg.pop('cache_memory_size', None))
+        cache_ttl = cfg.get('cache_ttl', generate_cfg.pop('cache_ttl', None))
+        cache_scope = cfg.get('cache_scope', generate_cfg.pop('cache_scope', 'all'))
         self.max_retries = generate_cfg.pop('max_retries', 0)
+        # When streaming, resume an interrupted response from the emitted prefix instead of regenerating it.
+        self.resumable_retry = generate_cfg.pop('resumable_retry', False)
+        # Put explicit prompt-cache markers on the stable prompt prefix, for services that support them.
+        self.prompt_cache = generate_cfg.pop('prompt_cache', False)
         self.generate_cfg = generate_cfg
         self.model_type = cfg.get('model_type', '')
         if 'dashscope' in self.model_type:
             self.generate_cfg['incremental_output'] = True
 
-        if cache_dir:
-            try:
-                import diskcache
-            except ImportError:
-                print_traceback(is_error=False)
-                logger.warning('Caching disabled because diskcache is not installed. Please `pip install diskcache`.')
-                cache_dir = None
-        if cache_dir:
-            os.makedirs(cache_dir, exist_ok=True)
-            self.cache = diskcache.Cache(directory=cache_dir)
-        else:
-            self.cache = None
+        # Two-tier response cache: an in-process LRU in front of an optional diskcache.
+        cache = ResponseCache(cache_dir=cache_dir, memory_size=cache_memory_size, ttl=cache_ttl, scope=cache_scope)
+        self.cache: Optional[ResponseCache] = cache if cache.enabled else None
 
     def quick_chat(self, prompt: str) -> str:
         *_, responses = self.chat(messages=[Message(role=USER, content=prompt)])
@@ -109,6 +110,12 @@ class BaseChatModel(ABC):
               (1) When False (recommended): Stream the full response every iteration.
               (2) When True: Stream the chunked response, i.e, delta responses.
             extra_generate_cfg: Extra LLM generation hyper-paramters.
+              It may contain `use_cache` (bool) to force the response cache on or off for this call,
+              overriding the configured `cache_scope`, `deadline` (a `time.time()` timestamp) by which
+              the call must finish, and `cancel_event` (a `threading.Event`) that aborts the call once set.
+              Retries are only attempted while the remaining budget allows them, each attempt's request
+              timeout is capped at the remaining budget, and the backoff wait returns as soon as the call
+              is cancelled.
 
         Returns:
             the generated message list response by llm.
@@ -129,11 +136,23 @@ class BaseChatModel(ABC):
         if not messages:
             raise ValueError("Messages can not be empty.")
 
+        # Per-call controls that are neither sent to the model service nor part of the cache key.
+        use_cache, deadline, cancel_event = None, None, None
+        if extra_generate_cfg and any((k in extra_generate_cfg) for k in ('use_cache', 'deadline', 'cancel_event')):
+            # A shallow copy, since a threading.Event cannot be deep-copied
+            extra_generate_cfg = dict(extra_generate_cfg)
+            use_cache = extra_generate_cfg.pop('use_cache', None)
+            deadline = extra_generate_cfg.pop('deadline', None)
+            cancel_event = extra_generate_cfg.pop('cancel_event', None)
+        if use_cache is None:
+            use_cache = (self.cache is not None) and self.cache.in_scope(messages)
+        use_cache = bool(use_cache) and (self.cache is not None)
+
         # Cache lookup:
-        if self.cache is not None:
-            cache_key = dict(messages=messages, functions=functions, extra_generate_cfg=extra_generate_cfg)
-            cache_key: str = json_dumps_compact(cache_key, sort_keys=True)
-            cache_value: str = self.cache.get(cache_key)
+        cache_key = None
+        if use_cache:
+            cache_key: str = self.cache.make_key(messages, functions, extra_generate_cfg)
+            cache_value: Optional[str] = self.cache.get(cache_key)
             if cache_value:
                 cache_value: List[dict] = json.loads(cache_value)
                 if _return_message_type == 'message':
@@ -194,7 +213,15 @@ class BaseChatModel(ABC):
                 if k in generate_cfg:
                     del generate_cfg[k]
 
-        def _call_model_service():
+        def _call_model_service(messages=messages, generate_cfg=generate_cfg):
+            if deadline is not None:
+                # Checking the deadline between chunks cannot interrupt a stalled connection,
+                # so also bound every attempt's HTTP/SDK timeout by the remaining budget.
+                _check_deadline(deadline, cancel_event)
+                remaining = deadline - time.time()
+                if generate_cfg.get('request_timeout') is not None:
+                    remaining = min(remaining, generate_cfg['request_timeout'])
+                generate_cfg = {**generate_cfg, 'request_timeout': remaining}
             if fncall_mode:
                 return self._chat_with_functions(
                     messages=messages,
@@ -217,13 +244,38 @@ class BaseChatModel(ABC):
                         generate_cfg=generate_cfg,
                     )
 
+        _check_deadline(deadline, cancel_event)
         if stream and delta_stream:
             # No retry for delta streaming
             output = _call_model_service()
         elif stream and (not delta_stream):
-            output = retry_model_service_iterator(_call_model_service, max_retries=self.max_retries)
+            if self.resumable_retry and (self.max_retries > 0):
+
+                def _resume_model_service(prefix: str):
+                    if not prefix:
+                        return _call_model_service()
+                    resume_cfg = generate_cfg
+                    if resume_cfg.get('enable_thinking'):
+                        # The reasoning has already been emitted, and assistant-prefix continuation does not
+                        # support the thinking mode.
+                        resume_cfg = {**resume_cfg, 'enable_thinking': False}
+                    return _call_model_service(messages=_append_assistant_prefix(messages, prefix),
+                                               generate_cfg=resume_cfg)
+
+                output = retry_model_service_iterator_resumable(_resume_model_service,
+                                                                max_retries=self.max_retries,
+                                                                deadline=deadline,
+                                                                cancel_event=cancel_event)
+            else:
+                output = retry_model_service_iterator(_call_model_service,
+                                                      max_retries=self.max_retries,
+                                                      deadline=deadline,
+                                                      cancel_event=cancel_event)
         else:
-            output = retry_model_service(_call_model_service, max_retries=self.max_retries)
+            output = retry_model_service(_call_model_service,
+                                         max_retries=self.max_retries,
+                                         deadline=deadline,
+                                         cancel_event=cancel_event)
 
         if isinstance(output, list):
             assert not stream
@@ -231,7 +283,7 @@ class BaseChatModel(ABC):
             output = self._postprocess_messages(output, fncall_mode=fncall_mode, generate_cfg=generate_cfg)
             if not self.support_multimodal_output:
                 output = _format_as_text_messages(messages=output)
-            if self.cache:
+            if use_cache:
                 self.cache.set(cache_key, json_dumps_compact(output))
             return self._convert_messages_to_target_type(output, _return_message_type)
         else:
@@ -247,11 +299,13 @@ class BaseChatModel(ABC):
             def _format_and_cache() -> Iterator[List[Message]]:
                 o = []
                 for o in output:
+                    # A slow stream must not outlive the budget either
+                    _check_deadline(deadline, cancel_event)
                     if o:
                         if not self.support_multimodal_output:
                             o = _format_as_text_messages(messages=o)
                         yield o
-                if o and (self.cache is not None):
+                if o and use_cache:
                     self.cache.set(cache_key, json_dumps_compact(o))
 
             return self._convert_messages_iterator_to_target_type(_format_and_cache(), _return_message_type)
@@ -458,8 +512,62 @@ def _format_as_text_messages(messages: List[Message]) -> List[Message]:
     return messages
 
 
+PROMPT_CACHE_CONTROL = {'type': 'ephemeral'}
+
+
+def apply_prompt_cache(messages: List[dict], explicit: bool = False) -> List[dict]:
+    """Prepare the dumped text messages of a chat service for provider-side prompt caching.
+
+    The dynamic suffix of the system message is split off, and with `explicit=True` cache markers are put on the
+    static part of the system message and on the latest message. The latter lets the next call of the same turn,
+    e.g. the next round of tool calls, reuse the whole conversation prefix.
+    """
+    system = None
+    suffix = ''
+    if messages and messages[0]['role'] == SYSTEM:
+        system = messages[0]
+        if system.get('extra') and (DYNAMIC_SUFFIX in system['extra']):
+            extra = dict(system['extra'])
+            suffix = extra.pop(DYNAMIC_SUFFIX) or ''
+            if extra:
+                system['extra'] = extra
+            else:
+                del system['extra']
+    if not explicit:
+        return messages
+
+    if system and isinstance(system['content'], str) and system['content']:
+        content = system['content']
+        if suffix and content.endswith(suffix) and len(content) > len(suffix):
+            system['content'] = [_cache_marked_text(content[:-len(suffix)]), {'type': 'text', 'text': suffix}]
+        elif not suffix:
+            system['content'] = [_cache_marked_text(content)]
+    last = messages[-1] if messages else None
+    if last and (last is not system) and last['role'] != ASSISTANT and isinstance(last['content'], str):
+        if last['content']:
+            last['content'] = [_cache_marked_text(last['content'])]
+    return messages
+
+
+def _cache_marked_text(text: str) -> dict:
+    return {'type': 'text', 'text': text, 'cache_control': PROMPT_CACHE_CONTROL}
+
+
+def get_cached_tokens(usage: Any) -> Optional[int]:
+    """Read the number of prompt tokens served from the provider's prompt cache, from a usage dict or object."""
+
+    def _get(obj: Any, key: str) -> Any:
+        if obj is None:
+            return None
+        if isinstance(obj, dict):
+            return obj.get(key)
+        return getattr(obj, key, None)
+
+    return _get(_get(usage, 'prompt_tokens_details'), 'cached_tokens')
+
+
 def _postprocess_stop_words(messages: List[Message], stop: List[str]) -> List[Message]:
-    messages = copy.deepcopy(messages)
+    messages = copy_messages(messages)
 
     # Make sure it stops before stop words.
     trunc_messages = []
@@ -481,13 +589,7 @@ def _postprocess_stop_words(messages: List[Message], stop: List[str]) -> List[Me
 
     # It may ends with partial stopword 'Observation' when the full stopword is 'Observation:'.
     # The following post-processing step removes partial stop words.
-    partial_stop = []
-    for s in stop:
-        s = tokenizer.tokenize(s)[:-1]
-        if s:
-            s = tokenizer.convert_tokens_to_string(s)
-            partial_stop.append(s)
-    partial_stop = sorted(set(partial_stop))
+    partial_stop = _get_partial_stop_words(tuple(stop))
     last_msg = messages[-1].content
     for i in range(len(last_msg) - 1, -1, -1):
         item_type, item_text = last_msg[i].get_type_and_value()
@@ -500,6 +602,18 @@ def _postprocess_stop_words(messages: List[Message], stop: List[str]) -> List[Me
     return messages
 
 
+@lru_cache(maxsize=128)
+def _get_partial_stop_words(stop: Tuple[str, ...]) -> List[str]:
+    # Runs for every streamed chunk with the same stop words, so the tokenization is done once per set of stop words
+    partial_stop = []
+    for s in stop:
+        s = tokenizer.tokenize(s)[:-1]
+        if s:
+            s = tokenizer.convert_tokens_to_string(s)
+            partial_stop.append(s)
+    return sorted(set(partial_stop))
+
+
 def _truncate_at_stop_word(text: str, stop: List[str]):
     truncated = False
     for s in stop:
@@ -592,6 +706,8 @@ def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -
 def retry_model_service(
     fn,
     max_retries: int = 10,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Any:
     """Retry a function"""
 
@@ -601,12 +717,23 @@ def retry_model_service(
             return fn()
 
         except ModelServiceError as e:
-            num_retries, delay = _raise_or_delay(e, num_retries, delay, max_retries)
+            num_retries, delay = _raise_or_delay(e,
+                                                 num_retries,
+                                                 delay,
+                                                 max_retries,
+                                                 deadline=deadline,
+                                                 cancel_event=cancel_event)
+        except Exception:
+            # E.g., the request timed out because its timeout was capped at the remaining budget
+            _check_deadline(deadline, cancel_event)
+            raise
 
 
 def retry_model_service_iterator(
     it_fn,
     max_retries: int = 10,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Iterator:
     """Retry an iterator"""
 
@@ -618,7 +745,115 @@ def retry_model_service_iterator(
             break
 
         except ModelServiceError as e:
-            num_retries, delay = _raise_or_delay(e, num_retries, delay, max_retries)
+            num_retries, delay = _raise_or_delay(e,
+                                                 num_retries,
+                                                 delay,
+                                                 max_retries,
+                                                 deadline=deadline,
+                                                 cancel_event=cancel_event)
+        except Exception:
+            # E.g., the request timed out because its timeout was capped at the remaining budget
+            _check_deadline(deadline, cancel_event)
+            raise
+
+
+RESUME_DEDUP_WINDOW = 64  # The number of leading characters of a continuation checked for repeated text
+RESUME_MIN_OVERLAP = 8  # Shorter overlaps are likely to be legitimate repetitions rather than re-emitted text
+
+
+def retry_model_service_iterator_resumable(
+    it_fn,
+    max_retries: int = 10,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> Iterator[List[Message]]:
+    """Retry a full-streaming iterator by resuming from the content emitted so far.
+
+    `it_fn(prefix)` starts a new response when `prefix` is empty, and otherwise continues the assistant response
+    from `prefix`. The prefix is prepended to every continued output, so the outputs stay cumulative and the
+    already-emitted content is neither regenerated nor sent twice. Responses whose content is not plain text,
+    or that fail before any content (e.g., while reasoning), are restarted instead.
+    """
+
+    num_retries, delay = 0, 1.0
+    prefix, prefix_reasoning = '', ''
+    while True:
+        skip = None if prefix else 0  # The number of re-emitted characters to drop from the continuation
+        pending = None
+        last_content = None
+        try:
+            for rsp in it_fn(prefix):
+                if (not rsp) or (not isinstance(rsp[-1].content, str)):
+                    last_content = None
+                    yield rsp
+                    continue
+                if skip is None:
+                    skip = _resume_overlap(prefix, rsp[-1].content, final=False)
+                    if skip is None:
+                        pending = rsp
+                        continue
+                    pending = None
+                rsp = _merge_resumed_output(rsp, prefix, prefix_reasoning, skip)
+                last_content = (rsp[-1].content, rsp[-1].reasoning_content or '')
+                yield rsp
+            if pending is not None:
+                skip = _resume_overlap(prefix, pending[-1].content, final=True)
+                yield _merge_resumed_output(pending, prefix, prefix_reasoning, skip)
+            break
+
+        except ModelServiceError as e:
+            num_retries, delay = _raise_or_delay(e,
+                                                 num_retries,
+                                                 delay,
+                                                 max_retries,
+                                                 deadline=deadline,
+                                                 cancel_event=cancel_event)
+            if last_content and last_content[0]:
+                prefix, prefix_reasoning = last_content
+                logger.info(f'Resuming the interrupted response after {len(prefix)} characters.')
+        except Exception:
+            # E.g., the request timed out because its timeout was capped at the remaining budget
+            _check_deadline(deadline, cancel_event)
+            raise
+
+
+def _resume_overlap(prefix: str, continuation: str, final: bool) -> Optional[int]:
+    """Decide how many leading characters of a continuation repeat the end of the prefix.
+
+    Returns None if more of the continuation is needed to decide.
+    """
+    if continuation.startswith(prefix):  # The service echoed the whole prefix
+        return len(prefix)
+    if (not final) and prefix.startswith(continuation):  # It may still turn out to be an echo
+        return None
+    if (not final) and (len(continuation) < RESUME_DEDUP_WINDOW):
+        return None
+    for k in range(min(len(prefix), len(continuation), RESUME_DEDUP_WINDOW), RESUME_MIN_OVERLAP - 1, -1):
+        if prefix.endswith(continuation[:k]):
+            return k
+    return 0
+
+
+def _merge_resumed_output(rsp: List[Message], prefix: str, prefix_reasoning: str, skip: int) -> List[Message]:
+    if not prefix:
+        return rsp
+    msg = rsp[-1]
+    msg.content = prefix + msg.content[skip:]
+    msg.reasoning_content = prefix_reasoning + (msg.reasoning_content or '')
+    return rsp
+
+
+def _append_assistant_prefix(messages: List[Message], prefix: str) -> List[Message]:
+    """Append the emitted prefix as (the end of) the last assistant message, for assistant-prefix continuation."""
+    messages = copy.deepcopy(messages)
+    if messages[-1].role == ASSISTANT:
+        if isinstance(messages[-1].content, str):
+            messages[-1].content += prefix
+        else:
+            messages[-1].content = messages[-1].content + [ContentItem(text=prefix)]
+    else:
+        messages.append(Message(role=ASSISTANT, content=prefix))
+    return messages
 
 
 def _raise_or_delay(
@@ -628,8 +863,16 @@ def _raise_or_delay(
     max_retries: int = 10,
     max_delay: float = 300.0,
     exponential_base: float = 2.0,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Tuple[int, float]:
-    """Retry with exponential backoff"""
+    """Retry with exponential backoff, within the remaining budget if a deadline is given"""
+
+    if e.code in ('DeadlineExceeded', 'Cancelled'):
+        raise e
+
+    # The error may be caused by the budget running out, e.g., a request timeout capped at the remaining budget
+    _check_deadline(deadline, cancel_event)
 
     if max_retries <= 0:  # no retry
         raise e
@@ -656,10 +899,27 @@ def _raise_or_delay(
     num_retries += 1
     jitter = 1.0 + random.random()
     delay = min(delay * exponential_base, max_delay) * jitter
-    time.sleep(delay)
+    if deadline is not None:
+        # Give up early rather than sleeping into a retry that cannot finish in time
+        remaining = deadline - time.time()
+        if delay >= remaining:
+            raise ModelServiceError(code='DeadlineExceeded',
+                                    message=f'Not retrying after "{str(e).strip()}": the request deadline '
+                                    f'leaves {max(remaining, 0):.1f}s, less than the {delay:.1f}s backoff.')
+    if cancel_event is None:
+        time.sleep(delay)
+    elif cancel_event.wait(delay):  # Wakes up as soon as the caller cancels, instead of sleeping out the backoff
+        raise ModelServiceError(code='Cancelled', message='The request has been cancelled.')
     return num_retries, delay
 
 
+def _check_deadline(deadline: Optional[float], cancel_event: Optional[threading.Event] = None):
+    if (cancel_event is not None) and cancel_event.is_set():
+        raise ModelServiceError(code='Cancelled', message='The request has been cancelled.')
+    if (deadline is not None) and (time.time() >= deadline):
+        raise ModelServiceError(code='DeadlineExceeded', message='The request deadline has been exceeded.')
+
+
 def _rm_think(text: str) -> str:
     if '</think>' in text:
         return text.split('</think>')[-1].lstrip('\n')
@@ -1,11 +1,82 @@
-from typing import List, Literal, Union
+import threading
+from collections import OrderedDict
+from typing import List, Literal, Sequence, Tuple, Union
 
-from qwen_agent.llm.schema import FUNCTION, Message
-from qwen_agent.utils.utils import format_as_multimodal_message, format_as_text_message, has_chinese_messages
+from qwen_agent.llm.schema import DYNAMIC_SUFFIX, FUNCTION, SYSTEM, ContentItem, Message
+from qwen_agent.utils.utils import (format_as_multimodal_message, format_as_text_message, has_chinese_messages,
+                                    hash_sha256, json_dumps_compact)
+
+TOOL_SYSTEM_CACHE_SIZE = 256
 
 
 class BaseFnCallPrompt(object):
 
+    # Rendered tool system prompts, shared by all prompt types and keyed by (template, function set, lang, ...):
+    _tool_system_cache: 'OrderedDict[str, str]' = OrderedDict()
+    # The same prompts keyed by the identity of a function tuple, e.g. the one an agent passes on every call, which
+    # saves hashing the functions. An entry holds its tuple, so the id cannot be reused by another object meanwhile.
+    _tool_system_by_id: 'OrderedDict[tuple, Tuple[tuple, str]]' = OrderedDict()
+    _tool_system_cache_lock = threading.Lock()
+
+    @classmethod
+    def get_tool_system(cls,
+                        functions: Sequence[dict],
+                        lang: Literal['en', 'zh'],
+                        parallel_function_calls: bool = True) -> str:
+        """
+        Return the system prompt that describes the tools, which is rendered once per function set and then cached.
+        The result is byte-identical across calls, so it can serve as a stable prefix for provider-side prompt caching.
+
+        Pass the functions as a tuple that is reused across calls to look the prompt up without hashing them.
+        """
+        id_key = None
+        if isinstance(functions, tuple):
+            id_key = (id(functions), cls.__name__, lang, parallel_function_calls)
+            with cls._tool_system_cache_lock:
+                entry = cls._tool_system_by_id.get(id_key)
+                if entry is not None and entry[0] is functions:
+                    cls._tool_system_by_id.move_to_end(id_key)
+                    return entry[1]
+
+        key = hash_sha256(json_dumps_compact([cls.__name__, lang, parallel_function_calls, functions]))
+        with cls._tool_system_cache_lock:
+            tool_system = cls._tool_system_cache.get(key)
+            if tool_system is not None:
+                cls._tool_system_cache.move_to_end(key)
+        if tool_system is None:
+            tool_system = cls._render_tool_system(functions, lang=lang, parallel_function_calls=parallel_function_calls)
+        with cls._tool_system_cache_lock:
+            _put_lru(cls._tool_system_cache, key, tool_system)
+            if id_key is not None:
+                _put_lru(cls._tool_system_by_id, id_key, (functions, tool_system))
+        return tool_system
+
+    @staticmethod
+    def add_tool_system(messages: List[Message], tool_system: str) -> List[Message]:
+        """
+        Add the tool system prompt to the system message, in front of the system message's dynamic suffix if any,
+        so that the system instructions and the tool descriptions together form a stable prompt prefix.
+        """
+        if not (messages and messages[0].role == SYSTEM):
+            return [Message(role=SYSTEM, content=[ContentItem(text=tool_system)])] + messages
+
+        system = messages[0]
+        suffix = (system.extra or {}).get(DYNAMIC_SUFFIX)
+        if suffix and system.content and system.content[-1].text == suffix:
+            if len(system.content) > 1:
+                system.content.insert(len(system.content) - 1, ContentItem(text='\n\n' + tool_system))
+            else:
+                suffix = '\n\n' + suffix
+                system.content = [ContentItem(text=tool_system), ContentItem(text=suffix)]
+                system.extra = {**system.extra, DYNAMIC_SUFFIX: suffix}
+        else:
+            system.content.append(ContentItem(text='\n\n' + tool_system))
+        return messages
+
+    @staticmethod
+    def _render_tool_system(functions: List[dict], lang: Literal['en', 'zh'], parallel_function_calls: bool) -> str:
+        raise NotImplementedError
+
     @staticmethod
     def preprocess_fncall_messages(messages: List[Message],
                                    functions: List[dict],
@@ -71,3 +142,10 @@ class BaseFnCallPrompt(object):
 
         messages = [format_as_text_message(msg, add_upload_info=False) for msg in messages]
         return messages
+
+
+def _put_lru(cache: 'OrderedDict', key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > TOOL_SYSTEM_CACHE_SIZE:
+        cache.popitem(last=False)
@@ -1,12 +1,11 @@
 import copy
 import json
 import os
-from typing import List, Literal, Union
-
-import json5
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
 from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt
 from qwen_agent.llm.schema import ASSISTANT, FUNCTION, SYSTEM, USER, ContentItem, FunctionCall, Message
+from qwen_agent.utils.utils import json_loads
 
 
 class NousFnCallPrompt(BaseFnCallPrompt):
@@ -36,11 +35,11 @@ class NousFnCallPrompt(BaseFnCallPrompt):
                 fn_call = msg.function_call
                 if fn_call:
                     if (not SPECIAL_CODE_MODE) or (CODE_TOOL_PATTERN not in fn_call.name):
-                        fc = {'name': fn_call.name, 'arguments': json5.loads(fn_call.arguments)}
+                        fc = {'name': fn_call.name, 'arguments': json_loads(fn_call.arguments)}
                         fc = json.dumps(fc, ensure_ascii=False)
                         fc = f'<tool_call>\n{fc}\n</tool_call>'
                     else:
-                        para = json5.loads(fn_call.arguments)
+                        para = json_loads(fn_call.arguments)
                         code = para['code']
                         para['code'] = ''
                         fc = {'name': fn_call.name, 'arguments': para}
@@ -70,18 +69,18 @@ class NousFnCallPrompt(BaseFnCallPrompt):
             else:
                 raise TypeError
 
+        tool_system = NousFnCallPrompt.get_tool_system(functions, lang='en', parallel_function_calls=True)
+        messages = NousFnCallPrompt.add_tool_system(messages, tool_system)
+        return messages
+
+    @staticmethod
+    def _render_tool_system(functions: List[dict], lang: Literal['en', 'zh'], parallel_function_calls: bool) -> str:
         tool_descs = [{'type': 'function', 'function': f} for f in functions]
         tool_names = [function.get('name_for_model', function.get('name', '')) for function in functions]
         tool_descs = '\n'.join([json.dumps(f, ensure_ascii=False) for f in tool_descs])
         if SPECIAL_CODE_MODE and any([CODE_TOOL_PATTERN in x for x in tool_names]):
-            tool_system = FN_CALL_TEMPLATE_WITH_CI.format(tool_descs=tool_descs)
-        else:
-            tool_system = FN_CALL_TEMPLATE.format(tool_descs=tool_descs)
-        if messages and messages[0].role == SYSTEM:
-            messages[0].content.append(ContentItem(text='\n\n' + tool_system))
-        else:
-            messages = [Message(role=SYSTEM, content=[ContentItem(text=tool_system)])] + messages
-        return messages
+            return FN_CALL_TEMPLATE_WITH_CI.format(tool_descs=tool_descs)
+        return FN_CALL_TEMPLATE.format(tool_descs=tool_descs)
 
     def postprocess_fncall_messages(
         self,
@@ -89,12 +88,19 @@ class NousFnCallPrompt(BaseFnCallPrompt):
         parallel_function_calls: bool = True,
         function_choice: Union[Literal['auto'], str] = 'auto',
         thought_in_content: bool = False,
+        parse_state: Optional[Dict[Tuple[int, int], '_StreamParseState']] = None,
     ) -> List[Message]:
+        """
+        Args:
+            parse_state: A dict kept by the caller across the chunks of one streamed response. It holds what has
+              been parsed from the accumulated text of each content item, so that every chunk only scans the newly
+              arrived text and every complete tool call is parsed once.
+        """
         if function_choice != 'auto':
             raise NotImplementedError
         # Convert plaintext responses to function_call responses:
         new_messages = []
-        for msg in messages:
+        for msg_idx, msg in enumerate(messages):
             role, content, reasoning_content, extra = msg.role, msg.content, msg.reasoning_content, msg.extra
             assert isinstance(content, list)
 
@@ -108,65 +114,27 @@ class NousFnCallPrompt(BaseFnCallPrompt):
                 new_messages.append(Message(role=role, content='', reasoning_content=reasoning_content, extra=extra))
 
             new_content = []
-            for item in content:
+            for item_idx, item in enumerate(content):
                 item_type, item_text = item.get_type_and_value()
 
                 if item_type != 'text':  # multimodal
                     new_content.append(item)
                     continue
-                if thought_in_content:
-                    if '</think>' not in item_text:
-                        new_content.append(ContentItem(text=item_text))
-                        continue
-                    _item_text = item_text.split('</think>')
-                    # assert len(_item_text) == 2
-                    new_content.append(ContentItem(text='</think>'.join(_item_text[:-1]) + '</think>'))
-                    item_text = _item_text[-1]
-
-                i = item_text.find('<tool_call>')
-                # If no function call:
-                if i < 0:
-                    show_text = item_text
-                    if show_text:
-                        new_content.append(ContentItem(text=show_text))
-                    continue
 
-                # split tool-call to separate assistant msg
-                tool_call_list = item_text.split('<tool_call>')
-                pre_thought = tool_call_list[0]
-                if pre_thought.strip():
-                    new_content.append(ContentItem(text=pre_thought))
-                for txt in tool_call_list[1:]:
-                    if not txt.strip():
-                        continue
+                state = None if parse_state is None else parse_state.get((msg_idx, item_idx))
+                if (state is None) or (not state.continues(item_text)):
+                    state = _StreamParseState()
+                    if parse_state is not None:
+                        parse_state[(msg_idx, item_idx)] = state
+                thought, parts = state.update(item_text, thought_in_content=thought_in_content)
+                if thought is not None:
+                    new_content.append(ContentItem(text=thought))
 
-                    if '</tool_call>' not in txt:
-                        # incomplete </tool_call>: This is to better represent incomplete tool calls in streaming output
-                        fn_name, fn_args = extract_fn(txt)
-                        if fn_name:  # need to call function
-                            if new_content:
-                                new_messages.append(Message(
-                                    role=role,
-                                    content=new_content,
-                                    extra=extra,
-                                ))  # split thought and function call
-                                new_content = []
-                            # TODO: process incomplete tool-call messages
-                            new_messages.append(
-                                Message(
-                                    role=ASSISTANT,
-                                    content=[],
-                                    function_call=FunctionCall(
-                                        name=fn_name,
-                                        arguments=fn_args,
-                                    ),
-                                    extra=extra,
-                                ))
+                # split tool-call to separate assistant msg
+                for part in parts:
+                    if isinstance(part, str):
+                        new_content.append(ContentItem(text=part))
                         continue
-
-                    one_tool_call_txt = txt.split('</tool_call>')
-
-                    # The complete tool-call response
                     if new_content:
                         new_messages.append(Message(
                             role=role,
@@ -174,37 +142,106 @@ class NousFnCallPrompt(BaseFnCallPrompt):
                             extra=extra,
                         ))  # split thought and function call
                         new_content = []
-                    if SPECIAL_CODE_MODE and '<code>' in one_tool_call_txt[0] and '</code>' in one_tool_call_txt[0]:
-                        _snips = one_tool_call_txt[0].split('<code>')
-                        fn = None
-                        for i, _s in enumerate(_snips):
-                            if i == 0:
-                                fn = json5.loads(_s)
-                            else:
-                                # TODO: support more flexible params
-                                code = _s.replace('</code>', '')
-                                fn['arguments']['code'] = code
-                    else:
-                        fn = json5.loads(one_tool_call_txt[0].strip())
-                    new_messages.append(
-                        Message(
-                            role=ASSISTANT,
-                            content=[],
-                            function_call=FunctionCall(
-                                name=fn['name'],
-                                arguments=json.dumps(fn['arguments'], ensure_ascii=False),
-                            ),
-                            extra=extra,
-                        ))
-                    # Expected not to output extra tails
-                    # if one_tool_call_txt[1].strip():
-                    #     new_content.append(ContentItem(text=one_tool_call_txt[1]))
+                    new_messages.append(Message(
+                        role=ASSISTANT,
+                        content=[],
+                        function_call=copy.copy(part),
+                        extra=extra,
+                    ))
 
             if new_content:
                 new_messages.append(Message(role=role, content=new_content, extra=extra))
         return new_messages
 
 
+class _StreamParseState:
+    """What has been parsed from the accumulated text of one content item.
+
+    The text of a streamed response only grows from chunk to chunk. The state remembers how far the text has been
+    scanned, the thought and tool calls found so far, and the start of the tool call still being generated, so that
+    the next chunk resumes the scan from there instead of splitting the whole text again.
+    """
+
+    def __init__(self):
+        self.scanned = 0  # The length of the text scanned so far
+        self.tail = ''  # The end of the scanned text, to detect a restarted (rather than continued) stream
+        self.thought = None  # The text up to and including the last </think>
+        self.pos = 0  # The start of the text not parsed into `parts` yet
+        self.in_calls = False  # Whether the first <tool_call> has been found, i.e., `pos` starts a tool call segment
+        self.parts: List[Union[str, FunctionCall]] = []  # The thought text and tool calls before `pos`
+        self.call: Optional[FunctionCall] = None  # The tool call at `pos`, once its </tool_call> has arrived
+
+    def continues(self, text: str) -> bool:
+        return text.startswith(self.tail, self.scanned - len(self.tail))
+
+    def update(self,
+               text: str,
+               thought_in_content: bool = False) -> Tuple[Optional[str], List[Union[str, FunctionCall]]]:
+        """Scan the text that has arrived since the last update.
+
+        Returns the thought text (if any) and the thought texts and (possibly incomplete) tool calls after it.
+        """
+        if thought_in_content:
+            k = text.rfind(THINK_END, max(self.scanned - len(THINK_END) + 1, 0))
+            if k >= 0:
+                # Tool calls are only parsed after the last </think>
+                self.thought = text[:k + len(THINK_END)]
+                self.pos, self.in_calls, self.parts, self.call = len(self.thought), False, [], None
+            if self.thought is None:
+                self._mark_scanned(text)
+                return None, [text]
+
+        if not self.in_calls:
+            i = text.find(TOOL_CALL_START, max(self.scanned - len(TOOL_CALL_START) + 1, self.pos))
+            if i < 0:  # If no function call
+                show_text = text[self.pos:] if self.pos else text
+                self._mark_scanned(text)
+                return self.thought, ([show_text] if show_text else [])
+            pre_thought = text[self.pos:i]
+            if pre_thought.strip():
+                self.parts.append(pre_thought)
+            self.pos, self.in_calls = i + len(TOOL_CALL_START), True
+
+        while True:
+            j = text.find(TOOL_CALL_START, max(self.scanned - len(TOOL_CALL_START) + 1, self.pos))
+            if self.call is None:
+                k = text.find(TOOL_CALL_END, max(self.scanned - len(TOOL_CALL_END) + 1, self.pos),
+                              len(text) if j < 0 else j)
+                if k >= 0:  # The complete tool-call response
+                    self.call = parse_tool_call(text[self.pos:k])
+            if j < 0:
+                break
+            # Another tool call has started, so this one will not change any more
+            part = self._segment_part(text[self.pos:j])
+            if part is not None:
+                self.parts.append(part)
+            self.pos, self.call = j + len(TOOL_CALL_START), None
+
+        parts = list(self.parts)
+        part = self._segment_part(text[self.pos:])
+        if part is not None:
+            parts.append(part)
+        self._mark_scanned(text)
+        return self.thought, parts
+
+    def _segment_part(self, txt: str) -> Optional[FunctionCall]:
+        # Expected not to output extra tails after </tool_call>
+        if self.call is not None:
+            return self.call
+        if not txt.strip():
+            return None
+        # incomplete </tool_call>: This is to better represent incomplete tool calls in streaming output
+        fn_name, fn_args = extract_fn(txt)
+        if not fn_name:
+            return None
+        # TODO: process incomplete tool-call messages
+        return FunctionCall(name=fn_name, arguments=fn_args)
+
+    def _mark_scanned(self, text: str):
+        self.scanned = len(text)
+        self.tail = text[-STREAM_TAIL_CHECK_LEN:]
+
+
 FN_CALL_TEMPLATE = """# Tools
 
 You may call one or more functions to assist with the user query.
@@ -219,6 +256,11 @@ For each function call, return a json object with function name and arguments wi
 {{"name": <function-name>, "arguments": <args-json-object>}}
 </tool_call>"""
 
+TOOL_CALL_START = '<tool_call>'
+TOOL_CALL_END = '</tool_call>'
+THINK_END = '</think>'
+STREAM_TAIL_CHECK_LEN = 16  # The number of trailing characters compared to tell a continued stream from a new one
+
 SPECIAL_CODE_MODE = os.getenv('SPECIAL_CODE_MODE', 'false').lower() == 'true'
 CODE_TOOL_PATTERN = 'code_interpreter'
 FN_CALL_TEMPLATE_WITH_CI = """# Tools
@@ -243,6 +285,23 @@ Here is the code.
 </tool_call>"""
 
 
+def parse_tool_call(text: str) -> FunctionCall:
+    """Parse the text between <tool_call> and </tool_call> into a function call."""
+    if SPECIAL_CODE_MODE and '<code>' in text and '</code>' in text:
+        _snips = text.split('<code>')
+        fn = None
+        for i, _s in enumerate(_snips):
+            if i == 0:
+                fn = json_loads(_s)
+            else:
+                # TODO: support more flexible params
+                code = _s.replace('</code>', '')
+                fn['arguments']['code'] = code
+    else:
+        fn = json_loads(text.strip())
+    return FunctionCall(name=fn['name'], arguments=json.dumps(fn['arguments'], ensure_ascii=False))
+
+
 # Mainly for removing incomplete special tokens when streaming the output
 # This assumes that '<tool_call>\n{"name": "' is the special token for the NousFnCallPrompt
 def remove_incomplete_special_tokens(text: str) -> str:
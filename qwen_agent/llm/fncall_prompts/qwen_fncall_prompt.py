@@ -3,7 +3,8 @@ import json
 from typing import Dict, List, Literal, Union
 
 from qwen_agent.llm.fncall_prompts.base_fncall_prompt import BaseFnCallPrompt
-from qwen_agent.llm.schema import ASSISTANT, FUNCTION, SYSTEM, USER, ContentItem, FunctionCall, Message
+from qwen_agent.llm.schema import (ASSISTANT, FUNCTION, SYSTEM, USER, ContentItem, FunctionCall, Message,
+                                   copy_messages)
 from qwen_agent.utils.utils import extract_text_from_message
 
 
@@ -58,14 +59,10 @@ class QwenFnCallPrompt(BaseFnCallPrompt):
                 raise TypeError
 
         # Add a system prompt for function calling:
-        tool_desc_template = FN_CALL_TEMPLATE[lang + ('_parallel' if parallel_function_calls else '')]
-        tool_descs = '\n\n'.join(get_function_description(function, lang=lang) for function in functions)
-        tool_names = ','.join(function.get('name_for_model', function.get('name', '')) for function in functions)
-        tool_system = tool_desc_template.format(tool_descs=tool_descs, tool_names=tool_names)
-        if messages and messages[0].role == SYSTEM:
-            messages[0].content.append(ContentItem(text='\n\n' + tool_system))
-        else:
-            messages = [Message(role=SYSTEM, content=[ContentItem(text=tool_system)])] + messages
+        tool_system = QwenFnCallPrompt.get_tool_system(functions,
+                                                       lang=lang,
+                                                       parallel_function_calls=parallel_function_calls)
+        messages = QwenFnCallPrompt.add_tool_system(messages, tool_system)
 
         # Remove ': ' for continued generation of function calling,
         # because ': ' may form a single token with its following words:
@@ -95,12 +92,19 @@ class QwenFnCallPrompt(BaseFnCallPrompt):
 
         return messages
 
+    @staticmethod
+    def _render_tool_system(functions: List[dict], lang: Literal['en', 'zh'], parallel_function_calls: bool) -> str:
+        tool_desc_template = FN_CALL_TEMPLATE[lang + ('_parallel' if parallel_function_calls else '')]
+        tool_descs = '\n\n'.join(get_function_description(function, lang=lang) for function in functions)
+        tool_names = ','.join(function.get('name_for_model', function.get('name', '')) for function in functions)
+        return tool_desc_template.format(tool_descs=tool_descs, tool_names=tool_names)
+
     @staticmethod
     def postprocess_fncall_messages(messages: List[Message],
                                     parallel_function_calls: bool = True,
                                     function_choice: Union[Literal['auto'], str] = 'auto',
                                     **kwargs) -> List[Message]:
-        messages = copy.deepcopy(messages)
+        messages = copy_messages(messages)
 
         # Prepend a prefix for function_choice:
         if function_choice not in ('auto', 'none'):
@@ -1,9 +1,11 @@
 import copy
 from abc import ABC
+from pprint import pformat
 from typing import Dict, Iterator, List, Literal, Optional, Union
 
 from qwen_agent.llm.base import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, FUNCTION, USER, ContentItem, Message
+from qwen_agent.log import logger
 
 
 class BaseFnCallModel(BaseChatModel, ABC):
@@ -53,6 +55,7 @@ class BaseFnCallModel(BaseChatModel, ABC):
         messages: List[Message],
         fncall_mode: bool,
         generate_cfg: dict,
+        parse_state: Optional[dict] = None,
     ) -> List[Message]:
         messages = super()._postprocess_messages(messages, fncall_mode=fncall_mode, generate_cfg=generate_cfg)
         if fncall_mode:
@@ -61,9 +64,32 @@ class BaseFnCallModel(BaseChatModel, ABC):
                 parallel_function_calls=generate_cfg.get('parallel_function_calls', False),
                 function_choice=generate_cfg.get('function_choice', 'auto'),
                 thought_in_content=generate_cfg.get('thought_in_content', False),
+                parse_state=parse_state,
             )
         return messages
 
+    def _postprocess_messages_iterator(
+        self,
+        messages: Iterator[List[Message]],
+        fncall_mode: bool,
+        generate_cfg: dict,
+    ) -> Iterator[List[Message]]:
+        if not fncall_mode:
+            yield from super()._postprocess_messages_iterator(messages,
+                                                              fncall_mode=fncall_mode,
+                                                              generate_cfg=generate_cfg)
+            return
+        # Each chunk carries the whole accumulated text. The parse state is kept across chunks, so that every chunk
+        # only scans the newly arrived text and every tool call is parsed only once per streamed response.
+        parse_state = {}
+        pre_msg = []
+        for pre_msg in messages:
+            yield self._postprocess_messages(pre_msg,
+                                             fncall_mode=fncall_mode,
+                                             generate_cfg=generate_cfg,
+                                             parse_state=parse_state)
+        logger.debug(f'LLM Output:\n{pformat([_.model_dump() for _ in pre_msg], indent=2)}')
+
     def _remove_fncall_messages(self, messages: List[Message], lang: Literal['en', 'zh']) -> List[Message]:
         # Change function calls into user messages so that the model won't try
         # to generate function calls when given functions and function_choice="none".
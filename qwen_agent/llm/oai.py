@@ -12,7 +12,7 @@ if openai.__version__.startswith('0.'):
 else:
     from openai import OpenAIError
 
-from qwen_agent.llm.base import ModelServiceError, register_llm
+from qwen_agent.llm.base import ModelServiceError, apply_prompt_cache, get_cached_tokens, register_llm
 from qwen_agent.llm.function_calling import BaseFnCallModel
 from qwen_agent.llm.schema import ASSISTANT, Message
 from qwen_agent.log import logger
@@ -86,7 +86,10 @@ class TextChatAtOAI(BaseFnCallModel):
         delta_stream: bool,
         generate_cfg: dict,
     ) -> Iterator[List[Message]]:
-        messages = self.convert_messages_to_dicts(messages)
+        messages = self.convert_messages_to_dicts(messages, prompt_cache=self.prompt_cache)
+        if self.prompt_cache and ('stream_options' not in generate_cfg):
+            # Ask for the usage chunk at the end of the stream, to report the cached prompt tokens
+            generate_cfg = {**generate_cfg, 'stream_options': {'include_usage': True}}
         try:
             response = self._chat_complete_create(model=self.model, messages=messages, stream=True, **generate_cfg)
             if delta_stream:
@@ -105,6 +108,14 @@ class TextChatAtOAI(BaseFnCallModel):
                 full_response = ''
                 full_reasoning_content = ''
                 for chunk in response:
+                    cached_tokens = get_cached_tokens(getattr(chunk, 'usage', None))
+                    if cached_tokens is not None:
+                        yield [
+                            Message(role=ASSISTANT,
+                                    content=full_response,
+                                    reasoning_content=full_reasoning_content,
+                                    extra={'cached_tokens': cached_tokens})
+                        ]
                     if chunk.choices:
                         if hasattr(chunk.choices[0].delta,
                                    'reasoning_content') and chunk.choices[0].delta.reasoning_content:
@@ -120,26 +131,33 @@ class TextChatAtOAI(BaseFnCallModel):
         messages: List[Message],
         generate_cfg: dict,
     ) -> List[Message]:
-        messages = self.convert_messages_to_dicts(messages)
+        messages = self.convert_messages_to_dicts(messages, prompt_cache=self.prompt_cache)
         try:
             response = self._chat_complete_create(model=self.model, messages=messages, stream=False, **generate_cfg)
+            cached_tokens = get_cached_tokens(getattr(response, 'usage', None))
+            extra = {'cached_tokens': cached_tokens} if cached_tokens is not None else None
             if hasattr(response.choices[0].message, 'reasoning_content'):
                 return [
                     Message(role=ASSISTANT,
                             content=response.choices[0].message.content,
-                            reasoning_content=response.choices[0].message.reasoning_content)
+                            reasoning_content=response.choices[0].message.reasoning_content,
+                            extra=extra)
                 ]
             else:
-                return [Message(role=ASSISTANT, content=response.choices[0].message.content)]
+                return [Message(role=ASSISTANT, content=response.choices[0].message.content, extra=extra)]
         except OpenAIError as ex:
             raise ModelServiceError(exception=ex)
 
     @staticmethod
-    def convert_messages_to_dicts(messages: List[Message]) -> List[dict]:
+    def convert_messages_to_dicts(messages: List[Message], prompt_cache: bool = False) -> List[dict]:
         # TODO: Change when the VLLM deployed model needs to pass reasoning_complete.
         #  At this time, in order to be compatible with lower versions of vLLM,
         #  and reasoning content is currently not useful
         messages = [msg.model_dump(exclude={'reasoning_content'}) for msg in messages]
+        messages = apply_prompt_cache(messages, explicit=prompt_cache)
+        for msg in messages:
+            # `extra` holds local bookkeeping only, and is not part of the OpenAI message format
+            msg.pop('extra', None)
 
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'LLM Input:\n{pformat(messages, indent=2)}')
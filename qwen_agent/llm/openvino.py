@@ -112,6 +112,7 @@ class OpenVINO(BaseFnCallModel):
             ))
         del generate_cfg['stop']
         del generate_cfg['seed']
+        generate_cfg.pop('request_timeout', None)  # Local generation does not go through an HTTP request
         
         def generate_and_signal_complete():
             self.ov_model.generate(**generate_cfg)
@@ -143,6 +144,7 @@ class OpenVINO(BaseFnCallModel):
             ))
         del generate_cfg['stop']
         del generate_cfg['seed']
+        generate_cfg.pop('request_timeout', None)  # Local generation does not go through an HTTP request
 
         response = self.ov_model.generate(**generate_cfg)
         response = response[:, len(input_token[0]):]
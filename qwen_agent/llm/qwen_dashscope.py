@@ -5,7 +5,7 @@ from typing import Dict, Iterator, List, Optional
 
 import dashscope
 
-from qwen_agent.llm.base import ModelServiceError, register_llm
+from qwen_agent.llm.base import ModelServiceError, apply_prompt_cache, get_cached_tokens, register_llm
 from qwen_agent.llm.function_calling import BaseFnCallModel
 from qwen_agent.llm.schema import ASSISTANT, Message
 from qwen_agent.log import logger
@@ -25,7 +25,7 @@ class QwenChatAtDS(BaseFnCallModel):
         delta_stream: bool,
         generate_cfg: dict,
     ) -> Iterator[List[Message]]:
-        messages = [msg.model_dump() for msg in messages]
+        messages = apply_prompt_cache([msg.model_dump() for msg in messages], explicit=self.prompt_cache)
         if messages[-1]['role'] == ASSISTANT:
             messages[-1]['partial'] = True
         logger.debug(f'LLM Input:\n{pformat(messages, indent=2)}')
@@ -45,7 +45,7 @@ class QwenChatAtDS(BaseFnCallModel):
         messages: List[Message],
         generate_cfg: dict,
     ) -> List[Message]:
-        messages = [msg.model_dump() for msg in messages]
+        messages = apply_prompt_cache([msg.model_dump() for msg in messages], explicit=self.prompt_cache)
         if messages[-1]['role'] == ASSISTANT:
             messages[-1]['partial'] = True
         logger.debug(f'LLM Input:\n{pformat(messages, indent=2)}')
@@ -60,7 +60,7 @@ class QwenChatAtDS(BaseFnCallModel):
                 Message(role=ASSISTANT,
                         content=response.output.choices[0].message.content,
                         reasoning_content=response.output.choices[0].message.get('reasoning_content', ''),
-                        extra={'model_service_info': response})
+                        extra=_make_extra(response))
             ]
         else:
             raise ModelServiceError(code=response.code,
@@ -83,7 +83,7 @@ class QwenChatAtDS(BaseFnCallModel):
                     Message(role=ASSISTANT,
                             content=chunk.output.choices[0].message.content,
                             reasoning_content=chunk.output.choices[0].message.reasoning_content,
-                            extra={'model_service_info': chunk})
+                            extra=_make_extra(chunk))
                 ]
             else:
                 raise ModelServiceError(code=chunk.code, message=chunk.message, extra={'model_service_info': chunk})
@@ -102,12 +102,20 @@ class QwenChatAtDS(BaseFnCallModel):
                     Message(role=ASSISTANT,
                             content=full_content,
                             reasoning_content=full_reasoning_content,
-                            extra={'model_service_info': chunk})
+                            extra=_make_extra(chunk))
                 ]
             else:
                 raise ModelServiceError(code=chunk.code, message=chunk.message, extra={'model_service_info': chunk})
 
 
+def _make_extra(response) -> dict:
+    extra = {'model_service_info': response}
+    cached_tokens = get_cached_tokens(response.get('usage'))
+    if cached_tokens is not None:
+        extra['cached_tokens'] = cached_tokens
+    return extra
+
+
 def initialize_dashscope(cfg: Optional[Dict] = None) -> None:
     cfg = cfg or {}
 
@@ -20,7 +20,8 @@ class QwenVLChatAtOAI(TextChatAtOAI):
         return True
 
     @staticmethod
-    def convert_messages_to_dicts(messages: List[Message]) -> List[dict]:
+    def convert_messages_to_dicts(messages: List[Message], prompt_cache: bool = False) -> List[dict]:
+        # Explicit prompt-cache markers are only put on text messages, see `TextChatAtOAI`.
         new_messages = []
 
         for msg in messages:
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Literal, Optional, Tuple
+
+from qwen_agent.llm.schema import ASSISTANT, FUNCTION, USER, Message
+from qwen_agent.log import logger
+from qwen_agent.utils.utils import hash_sha256, json_dumps_compact, print_traceback
+
+CacheScope = Literal['all', 'non_conversational']
+CACHE_SCOPES = ('all', 'non_conversational')
+
+DEFAULT_MEMORY_CACHE_SIZE = 1024
+
+
+class ResponseCache:
+    """A two-tier cache of LLM responses.
+
+    Lookups go to an in-process LRU first and then to an optional diskcache. Keys are sha256 digests of the request,
+    so neither tier stores or compares the full conversation history.
+    """
+
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 memory_size: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 scope: CacheScope = 'all'):
+        if scope not in CACHE_SCOPES:
+            raise ValueError(f'cache_scope must be one of {CACHE_SCOPES}, but cache_scope="{scope}" is received.')
+        self.scope = scope
+        self.ttl = ttl if (ttl and ttl > 0) else None
+
+        if cache_dir:
+            try:
+                import diskcache
+            except ImportError:
+                print_traceback(is_error=False)
+                logger.warning('Caching disabled because diskcache is not installed. Please `pip install diskcache`.')
+                cache_dir = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_cache = diskcache.Cache(directory=cache_dir)
+        else:
+            self.disk_cache = None
+
+        if memory_size is None:
+            # The memory tier comes for free with a disk cache, but has to be requested explicitly otherwise.
+            memory_size = DEFAULT_MEMORY_CACHE_SIZE if self.disk_cache is not None else 0
+        self.memory_size = max(int(memory_size), 0)
+        self._memory: 'OrderedDict[str, Tuple[Optional[float], str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return (self.memory_size > 0) or (self.disk_cache is not None)
+
+    def in_scope(self, messages: List[Message]) -> bool:
+        if self.scope == 'all':
+            return True
+        # non_conversational: one-shot prompts such as keyword generation or question suggestion,
+        # whose answers do not depend on a chat history.
+        n_user = 0
+        for msg in messages:
+            if msg.role in (ASSISTANT, FUNCTION):
+                return False
+            if msg.role == USER:
+                n_user += 1
+        return n_user <= 1
+
+    @staticmethod
+    def make_key(messages: List[Message], functions: Optional[List[dict]], extra_generate_cfg: Optional[dict]) -> str:
+        key = dict(messages=messages, functions=functions, extra_generate_cfg=extra_generate_cfg)
+        return hash_sha256(json_dumps_compact(key, sort_keys=True))
+
+    def get(self, key: str) -> Optional[str]:
+        if self.memory_size > 0:
+            with self._lock:
+                item = self._memory.get(key)
+                if item is not None:
+                    expire_at, value = item
+                    if (expire_at is None) or (expire_at > time.time()):
+                        self._memory.move_to_end(key)
+                        return value
+                    del self._memory[key]
+        if self.disk_cache is not None:
+            value, expire_at = self.disk_cache.get(key, expire_time=True)
+            if value:
+                self._set_memory(key, value, expire_at=expire_at)
+                return value
+        return None
+
+    def set(self, key: str, value: str):
+        self._set_memory(key, value)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value, expire=self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+
+    def _set_memory(self, key: str, value: str, expire_at: Optional[float] = None):
+        if self.memory_size <= 0:
+            return
+        if (expire_at is None) and self.ttl:
+            expire_at = time.time() + self.ttl
+        with self._lock:
+            self._memory[key] = (expire_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
@@ -0,0 +1,235 @@
+import copy
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Union
+
+from qwen_agent.llm.base import BaseChatModel, ModelServiceError, register_llm
+from qwen_agent.llm.schema import Message
+from qwen_agent.log import logger
+
+
+class BackendStats:
+    """Latency and error tracking of one backend.
+
+    Latency is the time to the first streamed chunk, or to the whole response when not streaming.
+    """
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.num_calls = 0
+        self.num_errors = 0
+        self.num_fallback_wins = 0
+        self.last_error_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self.num_calls += 1
+            self.latencies.append(latency)
+
+    def record_error(self):
+        with self._lock:
+            self.num_calls += 1
+            self.num_errors += 1
+            self.last_error_time = time.time()
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def to_dict(self) -> dict:
+        return {
+            'num_calls': self.num_calls,
+            'num_errors': self.num_errors,
+            'num_fallback_wins': self.num_fallback_wins,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+class _Attempt:
+
+    def __init__(self, index: int):
+        self.index = index
+        self.start_time = time.time()
+        self.abandoned = False
+
+
+@register_llm('router')
+class RouterChatModel(BaseChatModel):
+    """A chat model that routes each call over several backend chat models.
+
+    Backends are tried in order. A backend that fails before producing any output is failed over to the next one,
+    and is skipped for `failure_cooldown` seconds afterwards. If the first output of a backend takes longer than the
+    hedging threshold, the next backend is started concurrently and whichever answers first wins. The threshold is
+    `hedge_after` seconds if configured, or else the `hedge_quantile` of the backend's recent latencies once it has
+    `hedge_min_samples` of them.
+
+    Example cfg:
+        {
+            'model_type': 'router',
+            'backends': [
+                {'model': 'qwen-turbo-latest', 'model_server': 'dashscope'},
+                {'model': 'Qwen2.5-7B-Instruct', 'model_server': 'http://127.0.0.1:8000/v1'},
+            ],
+            'hedge_quantile': 0.95,
+        }
+    """
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        from qwen_agent.llm import get_chat_model
+
+        cfg = copy.deepcopy(cfg or {})
+        backend_cfgs = cfg.pop('backends', [])
+        if not backend_cfgs:
+            raise ValueError('The router model requires at least one backend in cfg["backends"].')
+        self.hedge_after: Optional[float] = cfg.pop('hedge_after', None)
+        self.hedge_quantile: float = cfg.pop('hedge_quantile', 0.95)
+        self.hedge_min_samples: int = cfg.pop('hedge_min_samples', 20)
+        self.failure_cooldown: float = cfg.pop('failure_cooldown', 30.0)
+        super().__init__(cfg)
+
+        self.backends: List[BaseChatModel] = [
+            b if isinstance(b, BaseChatModel) else get_chat_model(b) for b in backend_cfgs
+        ]
+        self.stats: List[BackendStats] = [BackendStats() for _ in self.backends]
+        self.model = self.model or self.backends[0].model
+
+    @property
+    def support_multimodal_input(self) -> bool:
+        return self.backends[0].support_multimodal_input
+
+    @property
+    def support_multimodal_output(self) -> bool:
+        return self.backends[0].support_multimodal_output
+
+    @property
+    def support_audio_input(self) -> bool:
+        return self.backends[0].support_audio_input
+
+    def get_stats(self) -> List[dict]:
+        return [dict(model=b.model, model_type=b.model_type, **s.to_dict()) for b, s in zip(self.backends, self.stats)]
+
+    def chat(
+        self,
+        messages: List[Union[Message, Dict]],
+        functions: Optional[List[Dict]] = None,
+        stream: bool = True,
+        delta_stream: bool = False,
+        extra_generate_cfg: Optional[Dict] = None,
+    ) -> Union[List[Message], List[Dict], Iterator[List[Message]], Iterator[List[Dict]]]:
+        # Each backend does its own preprocessing, caching and retries, so the call is forwarded as is.
+        kwargs = dict(messages=messages,
+                      functions=functions,
+                      stream=stream,
+                      delta_stream=delta_stream,
+                      extra_generate_cfg=extra_generate_cfg)
+        return self._route(kwargs, stream=stream)
+
+    def _candidates(self) -> List[int]:
+        now = time.time()
+        healthy = [i for i, s in enumerate(self.stats) if now - s.last_error_time >= self.failure_cooldown]
+        cooling = [i for i in range(len(self.backends)) if i not in healthy]
+        return healthy + cooling  # Backends in cooldown are only used as the last resort
+
+    def _hedge_delay(self, index: int) -> Optional[float]:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self.stats[index].latencies) < self.hedge_min_samples:
+            return None
+        return self.stats[index].quantile(self.hedge_quantile)
+
+    def _route(self, kwargs: dict, stream: bool):
+        candidates = self._candidates()
+        results = queue.Queue()
+        attempts: List[_Attempt] = []
+
+        def _run(attempt: _Attempt):
+            try:
+                output = self.backends[attempt.index].chat(**kwargs)
+                if stream:
+                    # Wait for the first chunk, so that the latency includes the time to first token.
+                    output = iter(output)
+                    first = next(output, None)
+                    output = (first, output)
+            except Exception as e:
+                if not (isinstance(e, ModelServiceError) and e.code in ('DeadlineExceeded', 'Cancelled')):
+                    self.stats[attempt.index].record_error()
+                results.put((attempt, None, e))
+                return
+            self.stats[attempt.index].record_latency(time.time() - attempt.start_time)
+            if attempt.abandoned:
+                if stream and hasattr(output[1], 'close'):
+                    output[1].close()
+                return
+            results.put((attempt, output, None))
+
+        def _launch():
+            attempt = _Attempt(candidates[len(attempts)])
+            attempts.append(attempt)
+            threading.Thread(target=_run, args=(attempt,), daemon=True).start()
+
+        _launch()
+        num_pending = 1
+        last_error = None
+        while True:
+            hedge_delay = None
+            if len(attempts) < len(candidates) and num_pending == 1:
+                hedge_delay = self._hedge_delay(attempts[-1].index)
+                if hedge_delay is not None:
+                    hedge_delay = max(hedge_delay - (time.time() - attempts[-1].start_time), 0)
+            try:
+                attempt, output, error = results.get(timeout=hedge_delay)
+            except queue.Empty:
+                logger.info(f'Hedging a slow call to {self.backends[attempts[-1].index].model} with '
+                            f'{self.backends[candidates[len(attempts)]].model}.')
+                _launch()
+                num_pending += 1
+                continue
+
+            num_pending -= 1
+            if error is not None:
+                logger.warning(f'Backend {self.backends[attempt.index].model} failed: {error}')
+                if isinstance(error, ModelServiceError) and error.code in ('DeadlineExceeded', 'Cancelled'):
+                    raise error
+                last_error = error
+                if len(attempts) < len(candidates):
+                    _launch()
+                    num_pending += 1
+                elif num_pending == 0:
+                    raise last_error
+                continue
+
+            for other in attempts:
+                if other is not attempt:
+                    other.abandoned = True
+            if attempt is not attempts[0]:
+                self.stats[attempt.index].num_fallback_wins += 1
+            if not stream:
+                return output
+            return self._stream_from(attempt.index, *output)
+
+    def _stream_from(self, index: int, first, rest: Iterator) -> Iterator:
+        if first is None:
+            return
+        yield first
+        try:
+            for rsp in rest:
+                yield rsp
+        except Exception:
+            self.stats[index].record_error()
+            raise
+
+    def _chat_with_functions(self, messages, functions, stream, delta_stream, generate_cfg, lang):
+        raise NotImplementedError('The router model forwards calls in `chat` and does not call the service itself.')
+
+    def _chat_stream(self, messages, delta_stream, generate_cfg):
+        raise NotImplementedError('The router model forwards calls in `chat` and does not call the service itself.')
+
+    def _chat_no_stream(self, messages, generate_cfg):
+        raise NotImplementedError('The router model forwards calls in `chat` and does not call the service itself.')
@@ -1,3 +1,4 @@
+import copy
 from typing import List, Literal, Optional, Tuple, Union
 
 from pydantic import BaseModel, field_validator, model_validator
@@ -19,6 +20,10 @@ IMAGE = 'image'
 AUDIO = 'audio'
 VIDEO = 'video'
 
+# A key of `Message.extra` of the system message: the text at the end of its content that changes from turn to turn,
+# e.g. the retrieved knowledge. Static instructions are kept in front of it, so that they form a stable prompt prefix.
+DYNAMIC_SUFFIX = 'dynamic_suffix'
+
 
 class BaseModelCompatibleDict(BaseModel):
 
@@ -100,9 +105,16 @@ class ContentItem(BaseModelCompatibleDict):
         return f'ContentItem({self.model_dump()})'
 
     def get_type_and_value(self) -> Tuple[Literal['text', 'image', 'file', 'audio', 'video'], str]:
-        (t, v), = self.model_dump().items()
-        assert t in ('text', 'image', 'file', 'audio', 'video')
-        return t, v
+        # Read the fields directly rather than through model_dump(), since this is called for every content item
+        # in the pre- and postprocessing of every streamed chunk. The validator ensures exactly one field is set.
+        if self.text is not None:
+            return 'text', self.text
+        for t in ('image', 'file', 'audio', 'video'):
+            v = getattr(self, t)
+            if v:
+                # Callers may edit dict and list values, which must not change the item itself
+                return t, copy.deepcopy(v) if isinstance(v, (dict, list)) else v
+        raise ValueError("Exactly one of 'text', 'image', 'file', 'audio', or 'video' must be provided.")
 
     @property
     def type(self) -> Literal['text', 'image', 'file', 'audio', 'video']:
@@ -150,3 +162,22 @@ class Message(BaseModelCompatibleDict):
         if value not in [USER, ASSISTANT, SYSTEM, FUNCTION]:
             raise ValueError(f'{value} must be one of {",".join([USER, ASSISTANT, SYSTEM, FUNCTION])}')
         return value
+
+
+def copy_messages(messages: List[Message]) -> List[Message]:
+    """Copy messages for in-place editing of their fields and content items.
+
+    Unlike copy.deepcopy, the values that are never edited in place, such as `extra` which may hold the raw service
+    response, are shared with the original messages instead of being copied for every streamed chunk.
+    """
+    new_messages = []
+    for msg in messages:
+        msg = msg.model_copy()
+        if isinstance(msg.content, list):
+            msg.content = [item.model_copy() for item in msg.content]
+        if isinstance(msg.reasoning_content, list):
+            msg.reasoning_content = [item.model_copy() for item in msg.reasoning_content]
+        if msg.function_call is not None:
+            msg.function_call = msg.function_call.model_copy()
+        new_messages.append(msg)
+    return new_messages
@@ -1,18 +1,18 @@
 import json
+import threading
+from collections import OrderedDict
 from importlib import import_module
-from typing import Dict, Iterator, List, Optional, Union
-
-import json5
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 from qwen_agent import Agent
 from qwen_agent.llm import BaseChatModel
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.log import logger
-from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_KEYGEN_STRATEGY,
-                                 DEFAULT_RAG_SEARCHERS)
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_CACHE_SIZE,
+                                 DEFAULT_RAG_KEYGEN_STRATEGY, DEFAULT_RAG_SEARCHERS)
 from qwen_agent.tools import BaseTool
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
-from qwen_agent.utils.utils import extract_files_from_messages, extract_text_from_message, get_file_type
+from qwen_agent.utils.utils import extract_files_from_messages, extract_text_from_message, get_file_type, json_loads
 
 
 class Memory(Agent):
@@ -36,15 +36,20 @@ class Memory(Agent):
                 'max_ref_token': 4000,
                 'parser_page_size': 500,
                 'rag_keygen_strategy': 'SplitQueryThenGenKeyword',
-                'rag_searchers': ['keyword_search', 'front_page_search']
+                'rag_searchers': ['keyword_search', 'front_page_search'],
+                'rag_cache_size': 32
               }
-              And the above is the default settings.
+              And the above is the default settings. `rag_cache_size` is the number of generated keywords and of
+              retrieval results that are kept, so that a repeated or regenerated turn skips the keyword generation
+              and the search. 0 disables the caches.
         """
         self.cfg = rag_cfg or {}
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
         self.parser_page_size: int = self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE)
         self.rag_searchers = self.cfg.get('rag_searchers', DEFAULT_RAG_SEARCHERS)
         self.rag_keygen_strategy = self.cfg.get('rag_keygen_strategy', DEFAULT_RAG_KEYGEN_STRATEGY)
+        self._keyword_cache = _ResultCache(self.cfg.get('rag_cache_size', DEFAULT_RAG_CACHE_SIZE))
+        self._retrieval_cache = _ResultCache(self.cfg.get('rag_cache_size', DEFAULT_RAG_CACHE_SIZE))
         if not llm:
             # There is no suitable model available for keygen
             self.rag_keygen_strategy = 'none'
@@ -90,8 +95,15 @@ class Memory(Agent):
             if messages and messages[-1].role == USER:
                 query = extract_text_from_message(messages[-1], add_upload_info=False)
 
+            files_key = self._get_files_key(rag_files)
+
             # Keyword generation
-            if query and self.rag_keygen_strategy.lower() != 'none':
+            keyword_cache_key = (query, files_key)
+            cached_query = self._keyword_cache.get(keyword_cache_key)
+            if cached_query is not None:
+                logger.info(f'Use the cached keywords: {cached_query}')
+                query = cached_query
+            elif query and self.rag_keygen_strategy.lower() != 'none':
                 module_name = 'qwen_agent.agents.keygen_strategies'
                 module = import_module(module_name)
                 cls = getattr(module, self.rag_keygen_strategy)
@@ -110,26 +122,42 @@ class Memory(Agent):
                 if keyword.endswith('```'):
                     keyword = keyword[:-3]
                 try:
-                    keyword_dict = json5.loads(keyword)
+                    keyword_dict = json_loads(keyword)
                     if 'text' not in keyword_dict:
                         keyword_dict['text'] = query
                     query = json.dumps(keyword_dict, ensure_ascii=False)
                     logger.info(query)
+                    self._keyword_cache.put(keyword_cache_key, query)
                 except Exception:
                     query = query
 
-            content = self.function_map['retrieval'].call(
-                {
-                    'query': query,
-                    'files': rag_files
-                },
-                **kwargs,
-            )
-            if not isinstance(content, str):
-                content = json.dumps(content, ensure_ascii=False, indent=4)
+            retrieval = self.function_map['retrieval']
+            retrieval_cache_key = (query, files_key, kwargs.get('max_ref_token', self.max_ref_token),
+                                   kwargs.get('parser_page_size', self.parser_page_size))
+            content = self._retrieval_cache.get(retrieval_cache_key)
+            if content is not None:
+                logger.info('Use the cached retrieval result.')
+            else:
+                content = retrieval.call(
+                    {
+                        'query': query,
+                        'files': rag_files
+                    },
+                    **kwargs,
+                )
+                if not isinstance(content, str):
+                    content = json.dumps(content, ensure_ascii=False, indent=4)
+                if getattr(retrieval, 'early_retrieval_timeout', None) is None:
+                    # Early retrieval may have searched a part of the files only
+                    self._retrieval_cache.put(retrieval_cache_key, content)
 
             yield [Message(role=ASSISTANT, content=content, name='memory')]
 
+    def _get_files_key(self, rag_files: List[str]) -> Tuple[str, ...]:
+        # Keyed by file content, so that a changed file invalidates the cached keywords and retrieval results
+        doc_extractor = self.function_map['doc_parser'].doc_extractor
+        return tuple(doc_extractor.get_cache_key(file) for file in rag_files)
+
     def get_rag_files(self, messages: List[Message]):
         session_files = extract_files_from_messages(messages, include_images=False)
         files = self.system_files + session_files
@@ -139,3 +167,28 @@ class Memory(Agent):
             if f_type in PARSER_SUPPORTED_FILE_TYPES and file not in rag_files:
                 rag_files.append(file)
         return rag_files
+
+
+class _ResultCache:
+    """A small thread-safe LRU of the keywords and retrieval results of a memory agent."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data: 'OrderedDict[tuple, str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: str):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
@@ -8,18 +8,39 @@ DEFAULT_MAX_INPUT_TOKENS: int = int(os.getenv(
 
 # Settings for agents
 MAX_LLM_CALL_PER_RUN: int = int(os.getenv('QWEN_AGENT_MAX_LLM_CALL_PER_RUN', 8))
+EARLY_TOOL_DISPATCH: bool = os.getenv('QWEN_AGENT_EARLY_TOOL_DISPATCH',
+                                      'false').lower() == 'true'  # Start complete tool calls while still streaming
 
 # Settings for tools
 DEFAULT_WORKSPACE: str = os.getenv('QWEN_AGENT_DEFAULT_WORKSPACE', 'workspace')
+DEFAULT_STORAGE_BACKEND: str = os.getenv('QWEN_AGENT_STORAGE_BACKEND',
+                                         'file')  # 'file': one text file per key, or 'sqlite': compressed binary values
+
+# Settings for tokenization
+TOKENIZER_CACHE_DIR: str = os.getenv(
+    'QWEN_AGENT_TOKENIZER_CACHE_DIR',
+    os.path.join(DEFAULT_WORKSPACE, 'tokenizer_cache'))  # Binary BPE rank tables. Set to an empty string to disable
+
+# Settings for MCP
+MCP_SCHEMA_CACHE_DIR: str = os.getenv(
+    'QWEN_AGENT_MCP_SCHEMA_CACHE_DIR',
+    os.path.join(DEFAULT_WORKSPACE, 'tools', 'mcp_schema_cache'))  # Set to an empty string to disable the cache
 
 # Settings for RAG
 DEFAULT_MAX_REF_TOKEN: int = int(os.getenv('QWEN_AGENT_DEFAULT_MAX_REF_TOKEN',
                                            20000))  # The window size reserved for RAG materials
 DEFAULT_PARSER_PAGE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_PAGE_SIZE',
                                               500))  # Max tokens per chunk when doing RAG
+DEFAULT_PARSER_WORKERS: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_WORKERS', min(
+    4, os.cpu_count() or 1)))  # Max processes for parsing multiple files at once. 1 parses the files one by one
 DEFAULT_RAG_KEYGEN_STRATEGY: Literal['None', 'GenKeyword', 'SplitQueryThenGenKeyword', 'GenKeywordWithKnowledge',
                                      'SplitQueryThenGenKeywordWithKnowledge'] = os.getenv(
                                          'QWEN_AGENT_DEFAULT_RAG_KEYGEN_STRATEGY', 'GenKeyword')
 DEFAULT_RAG_SEARCHERS: List[str] = ast.literal_eval(
     os.getenv('QWEN_AGENT_DEFAULT_RAG_SEARCHERS',
               "['keyword_search', 'front_page_search']"))  # Sub-searchers for hybrid retrieval
+DEFAULT_RAG_CACHE_SIZE: int = int(os.getenv(
+    'QWEN_AGENT_DEFAULT_RAG_CACHE_SIZE', 32))  # Keywords and retrieval results kept per memory agent. 0 disables
+DEFAULT_EMBEDDING_CFG: dict = ast.literal_eval(
+    os.getenv('QWEN_AGENT_DEFAULT_EMBEDDING_CFG',
+              "{'model_type': 'dashscope', 'model': 'text-embedding-v1'}"))  # Or 'sentence_transformers' (offline)
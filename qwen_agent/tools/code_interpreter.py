@@ -18,11 +18,9 @@ import uuid
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 
-import json5
-
 from qwen_agent.log import logger
 from qwen_agent.tools.base import BaseToolWithFileAccess, register_tool
-from qwen_agent.utils.utils import append_signal_handler, extract_code, has_chinese_chars, print_traceback
+from qwen_agent.utils.utils import append_signal_handler, extract_code, has_chinese_chars, json_loads, print_traceback
 
 LAUNCH_KERNEL_PY = """
 from ipykernel import kernelapp as app
@@ -83,7 +81,7 @@ class CodeInterpreter(BaseToolWithFileAccess):
         super().call(params=params, files=files)  # copy remote files to work_dir
 
         try:
-            params = json5.loads(params)
+            params = json_loads(params)
             code = params['code']
         except Exception:
             code = extract_code(params)
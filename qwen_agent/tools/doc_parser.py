@@ -1,15 +1,18 @@
-import json
+import bisect
+import itertools
 import os
 import re
+import threading
 import time
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
-from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_plain_doc
+from qwen_agent.tools.simple_doc_parser import (PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_plain_doc,
+                                                parse_cache_stats)
 from qwen_agent.tools.storage import KeyNotExistsError, Storage
 from qwen_agent.utils.tokenization_qwen import count_tokens, tokenizer
 from qwen_agent.utils.utils import get_basename_from_url, hash_sha256
@@ -39,6 +42,59 @@ class Record(BaseModel):
         return {'url': self.url, 'raw': [x.to_dict() for x in self.raw], 'title': self.title}
 
 
+class ParsingJob:
+    """A doc that is being parsed and chunked in a background thread, see `DocParser.parse_in_background`."""
+
+    def __init__(self, url: str, record: Optional[dict] = None):
+        self.url = url
+        self.chunks: List[Chunk] = []
+        self.record = record  # The complete record, once the whole doc is parsed
+        self.error: Optional[Exception] = None
+        self._cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return (self.record is not None) or (self.error is not None)
+
+    def add_chunk(self, chunk: Chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, record: Optional[dict] = None, error: Optional[Exception] = None):
+        with self._cond:
+            self.record = record
+            self.error = error
+            self._cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> dict:
+        """Wait for the whole doc, but return a partial record of the chunks ready so far after `timeout` seconds.
+
+        The first chunk is always waited for, so that the record is never empty.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self.done:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    if self.chunks:
+                        break
+                    remaining = None
+                self._cond.wait(remaining)
+            if self.error is not None:
+                raise self.error
+            if self.record is not None:
+                return self.record
+            chunks = list(self.chunks)
+        logger.info(f'Use the first {len(chunks)} chunks of {self.url}, the rest are still being parsed.')
+        return Record(url=self.url, raw=chunks, title=chunks[0].metadata['title']).to_dict()
+
+
+# The docs being parsed in the background, by url and page size, so that a doc is only parsed once at a time
+_parsing_jobs: Dict[str, ParsingJob] = {}
+_parsing_jobs_lock = threading.Lock()
+
+
 @register_tool('doc_parser')
 class DocParser(BaseTool):
     description = '对一个文件进行内容提取和分块、返回分块后的文件内容'
@@ -85,32 +141,112 @@ class DocParser(BaseTool):
 
         url = params['url']
 
-        cached_name_chunking = f'{hash_sha256(url)}_{str(parser_page_size)}'
+        doc_key = self.doc_extractor.get_cache_key(url)
+        record = self._read_cached_record(url, doc_key, parser_page_size)
+        if record is not None:
+            return record
+        return self._parse_and_chunk(url, doc_key, max_ref_token=max_ref_token, parser_page_size=parser_page_size)
+
+    def parse_in_background(self, params: Union[str, dict], **kwargs) -> 'ParsingJob':
+        """Start parsing a doc in a background thread, which makes its chunks available one by one.
+
+        Retrieval can then search the chunks that are ready, such as the front pages, while the rest of the doc is
+        still being parsed. If the same doc is already being parsed, the running job is returned.
+        """
+        params = self._verify_json_format_args(params)
+        max_ref_token = kwargs.get('max_ref_token', self.max_ref_token)
+        parser_page_size = kwargs.get('parser_page_size', self.parser_page_size)
+        url = params['url']
+
+        doc_key = self.doc_extractor.get_cache_key(url)
+        record = self._read_cached_record(url, doc_key, parser_page_size)
+        if record is not None:
+            return ParsingJob(url, record=record)
+
+        job_key = f'{hash_sha256(url)}_{str(parser_page_size)}'
+        with _parsing_jobs_lock:
+            if job_key in _parsing_jobs:
+                return _parsing_jobs[job_key]
+            job = ParsingJob(url)
+            _parsing_jobs[job_key] = job
+
+        def _run():
+            try:
+                job.finish(record=self._parse_and_chunk(url,
+                                                        doc_key,
+                                                        max_ref_token=max_ref_token,
+                                                        parser_page_size=parser_page_size,
+                                                        on_chunk=job.add_chunk))
+            except Exception as e:
+                job.finish(error=e)
+            finally:
+                with _parsing_jobs_lock:
+                    _parsing_jobs.pop(job_key, None)
+
+        threading.Thread(target=_run, name=f'doc-parser-{job_key[:8]}', daemon=True).start()
+        return job
+
+    def _read_cached_record(self, url: str, doc_key: str, parser_page_size: int) -> Optional[dict]:
+        cached_name_chunking = f'{doc_key}_{str(parser_page_size)}'
         try:
             # Directly load the chunked doc
-            record = self.db.get(cached_name_chunking)
-            record = json.loads(record)
-            logger.info(f'Read chunked {url} from cache.')
-            return record
+            record = self.db.get_obj(cached_name_chunking)
         except KeyNotExistsError:
-            doc = self.doc_extractor.call({'url': url})
+            parse_cache_stats.record('chunked', hit=False)
+            return None
+        parse_cache_stats.record('chunked', hit=True)
+        chunks_hash = record['raw'][0]['metadata'].get('chunks_hash') if record['raw'] else None
+        if chunks_hash is None:
+            # Docs chunked before the chunks kept their hash
+            chunks_hash = self._add_chunks_hash(record)
+            self.db.put_obj(cached_name_chunking, record)
+        if record['url'] != url:
+            # The same file was parsed from another path
+            record = self._rebind_record(record, url)
+        logger.info(f'Read chunked {url} from cache.')
+        self._save_keyword_index(record, chunks_hash)  # Docs chunked before the keyword index existed
+        return record
 
+    @staticmethod
+    def _rebind_record(record: dict, url: str) -> dict:
+        if record['title'] == get_basename_from_url(record['url']):
+            record['title'] = get_basename_from_url(url)
+        record['url'] = url
+        for chk in record['raw']:
+            chk['metadata']['source'] = url
+            chk['metadata']['title'] = record['title']
+        return record
+
+    def _parse_and_chunk(self,
+                         url: str,
+                         doc_key: str,
+                         max_ref_token: int,
+                         parser_page_size: int,
+                         on_chunk: Optional[Callable[[Chunk], None]] = None) -> dict:
+        # The pages are parsed lazily. Only those needed to tell if the doc fits into one chunk are read ahead, and
+        # the rest are chunked and indexed as they are parsed.
+        pages = self.doc_extractor.iter_pages(url, cache_key=doc_key)
+        head = []
         total_token = 0
-        for page in doc:
-            for para in page['content']:
-                total_token += para['token']
+        for page in pages:
+            head.append(page)
+            total_token += sum(para['token'] for para in page['content'])
+            if total_token > max_ref_token:
+                break
 
-        if doc and 'title' in doc[0]:
-            title = doc[0]['title']
+        if head and 'title' in head[0]:
+            title = head[0]['title']
         else:
             title = get_basename_from_url(url)
 
         logger.info(f'Start chunking {url} ({title})...')
         time1 = time.time()
+        content = []
+        index_builder = self._new_keyword_index_builder(url)
         if total_token <= max_ref_token:
             # The whole doc is one chunk
-            content = [
-                Chunk(content=get_plain_doc(doc),
+            chunks = [
+                Chunk(content=get_plain_doc(head),
                       metadata={
                           'source': url,
                           'title': title,
@@ -118,141 +254,164 @@ class DocParser(BaseTool):
                       },
                       token=total_token)
             ]
-            cached_name_chunking = f'{hash_sha256(url)}_without_chunking'
+            cached_name_chunking = f'{doc_key}_without_chunking'
         else:
-            content = self.split_doc_to_chunk(doc, url, title=title, parser_page_size=parser_page_size)
+            chunks = self.iter_doc_chunks(itertools.chain(head, pages),
+                                          url,
+                                          title=title,
+                                          parser_page_size=parser_page_size)
+            cached_name_chunking = f'{doc_key}_{str(parser_page_size)}'
+        for chunk in chunks:
+            content.append(chunk)
+            if index_builder is not None:
+                try:
+                    index_builder.add(chunk.content)
+                except Exception as e:
+                    logger.warning(f'Failed to build the keyword index of {url}: {e}')
+                    index_builder = None
+            if on_chunk is not None:
+                on_chunk(chunk)
 
         time2 = time.time()
         logger.info(f'Finished chunking {url} ({title}). Time spent: {time2 - time1} seconds.')
 
         # save the document data
         new_record = Record(url=url, raw=content, title=title).to_dict()
-        new_record_str = json.dumps(new_record, ensure_ascii=False)
-        self.db.put(cached_name_chunking, new_record_str)
+        chunks_hash = self._add_chunks_hash(new_record)
+        self.db.put_obj(cached_name_chunking, new_record)
+        if index_builder is not None:
+            self._save_keyword_index(new_record, chunks_hash, index=index_builder.index)
         return new_record
 
+    @staticmethod
+    def _new_keyword_index_builder(url: str):
+        try:
+            from qwen_agent.tools.search_tools.keyword_search import KeywordIndexBuilder
+            return KeywordIndexBuilder()
+        except Exception as e:
+            logger.warning(f'Failed to build the keyword index of {url}: {e}')
+            return None
+
+    @staticmethod
+    def _add_chunks_hash(record: dict) -> str:
+        """Keep the hash of the chunks in their metadata, by which keyword search finds the index of the doc."""
+        from qwen_agent.tools.search_tools.keyword_search import hash_chunks
+
+        chunks_hash = hash_chunks([chk['content'] for chk in record['raw']])
+        for chk in record['raw']:
+            # A new dict, since the metadata is shared with the chunks handed out while parsing
+            chk['metadata'] = {**chk['metadata'], 'chunks_hash': chunks_hash}
+        return chunks_hash
+
+    def _save_keyword_index(self, record: dict, chunks_hash: str, index: Optional[dict] = None):
+        """Store the inverted index used by keyword search next to the chunks, building it if not given."""
+        from qwen_agent.tools.search_tools.keyword_search import build_keyword_index, get_keyword_index_key
+
+        key = get_keyword_index_key(chunks_hash)
+        if self.db.exists(key):
+            return
+        if index is None:
+            try:
+                index = build_keyword_index([chk['content'] for chk in record['raw']])
+            except Exception as e:
+                logger.warning(f'Failed to build the keyword index of {record["url"]}: {e}')
+                return
+        self.db.put_obj(key, index)
+
     def split_doc_to_chunk(self,
                            doc: List[dict],
                            path: str,
                            title: str = '',
                            parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> List[Chunk]:
-        res = []
+        return list(self.iter_doc_chunks(doc, path, title=title, parser_page_size=parser_page_size))
+
+    def iter_doc_chunks(self,
+                        doc: Iterable[dict],
+                        path: str,
+                        title: str = '',
+                        parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> Iterator[Chunk]:
+        """Split the pages into chunks, yielding each chunk once it is complete, so that `doc` can be a stream.
+
+        The paragraphs of a page are packed by bisecting their running token offsets, which come from the token counts
+        of the parser. Only a paragraph too long for a chunk is tokenized again, once per sentence, to pack its
+        sentences the same way.
+        """
+        num_chunks = 0
         chunk = []
         available_token = parser_page_size
         has_para = False
+
+        def _complete_chunk() -> Chunk:
+            if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
+                chunk.pop()  # Redundant page information
+            return Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
+                         metadata={
+                             'source': path,
+                             'title': title,
+                             'chunk_id': num_chunks
+                         },
+                         token=parser_page_size - available_token)
+
+        def _next_chunk():
+            # Define new chunk, which starts with the end of the last one
+            overlap_txt = self._get_last_part(chunk)
+            if overlap_txt.strip():
+                return [f'[page: {str(chunk[-1][1])}]', overlap_txt], parser_page_size - count_tokens(overlap_txt)
+            return [], parser_page_size
+
         for page in doc:
             page_num = page['page_num']
-            if not chunk or f'[page: {str(page_num)}]' != chunk[0]:
-                chunk.append(f'[page: {str(page_num)}]')
+            page_info = f'[page: {str(page_num)}]'
+            if not chunk or page_info != chunk[0]:
+                chunk.append(page_info)
+            paras = page['content']
+            offsets = list(itertools.accumulate((para['token'] for para in paras), initial=0))
             idx = 0
-            len_para = len(page['content'])
-            while idx < len_para:
+            while idx < len(paras):
                 if not chunk:
-                    chunk.append(f'[page: {str(page_num)}]')
-                para = page['content'][idx]
-                txt = para.get('text', para.get('table'))
-                token = para['token']
-                if token <= available_token:
-                    available_token -= token
-                    chunk.append([txt, page_num])
+                    chunk.append(page_info)
+                end = _fit(offsets, idx, available_token)
+                if end > idx:
+                    # The paragraphs up to end fit into this chunk
+                    chunk.extend([para.get('text', para.get('table')), page_num] for para in paras[idx:end])
+                    available_token -= offsets[end] - offsets[idx]
                     has_para = True
-                    idx += 1
+                    idx = end
+                elif has_para:
+                    yield _complete_chunk()
+                    num_chunks += 1
+                    chunk, available_token = _next_chunk()
+                    has_para = False
                 else:
-                    if has_para:
-                        # Record one chunk
-                        if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
-                            chunk.pop()  # Redundant page information
-                        res.append(
-                            Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                [x if isinstance(x, str) else x[0] for x in chunk]),
-                                  metadata={
-                                      'source': path,
-                                      'title': title,
-                                      'chunk_id': len(res)
-                                  },
-                                  token=parser_page_size - available_token))
-
-                        # Define new chunk
-                        overlap_txt = self._get_last_part(chunk)
-                        if overlap_txt.strip():
-                            chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
-                            has_para = False
-                            available_token = parser_page_size - count_tokens(overlap_txt)
+                    # There are excessively long paragraphs present
+                    # Split paragraph to sentences
+                    para = paras[idx]
+                    sentences, tokens = _split_to_sentences(para.get('text', para.get('table')), available_token)
+                    sent_offsets = list(itertools.accumulate(tokens, initial=0))
+                    sent_index = 0
+                    while sent_index < len(sentences):
+                        if not chunk:
+                            chunk.append(page_info)
+                        sent_end = _fit(sent_offsets, sent_index, available_token)
+                        if sent_end == sent_index and not has_para:
+                            # Be sure to add at least one sentence
+                            # (not has_para) is a patch of the previous sentence splitting
+                            sent_end += 1
+                        if sent_end > sent_index:
+                            chunk.extend([s, page_num] for s in sentences[sent_index:sent_end])
+                            available_token -= sent_offsets[sent_end] - sent_offsets[sent_index]
+                            has_para = True
+                            sent_index = sent_end
                         else:
-                            chunk = []
+                            yield _complete_chunk()
+                            num_chunks += 1
+                            chunk, available_token = _next_chunk()
                             has_para = False
-                            available_token = parser_page_size
-                    else:
-                        # There are excessively long paragraphs present
-                        # Split paragraph to sentences
-                        _sentences = re.split(r'\. |。', txt)
-                        sentences = []
-                        for s in _sentences:
-                            token = count_tokens(s)
-                            if not s.strip() or token == 0:
-                                continue
-                            if token <= available_token:
-                                sentences.append([s, token])
-                            else:
-                                # Limit the length of a sentence to chunk size
-                                token_list = tokenizer.tokenize(s)
-                                for si in range(0, len(token_list), available_token):
-                                    ss = tokenizer.convert_tokens_to_string(
-                                        token_list[si:min(len(token_list), si + available_token)])
-                                    sentences.append([ss, min(available_token, len(token_list) - si)])
-                        sent_index = 0
-                        while sent_index < len(sentences):
-                            s = sentences[sent_index][0]
-                            token = sentences[sent_index][1]
-                            if not chunk:
-                                chunk.append(f'[page: {str(page_num)}]')
-
-                            if token <= available_token or (not has_para):
-                                # Be sure to add at least one sentence
-                                # (not has_para) is a patch of the previous sentence splitting
-                                available_token -= token
-                                chunk.append([s, page_num])
-                                has_para = True
-                                sent_index += 1
-                            else:
-                                assert has_para
-                                if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$',
-                                                                               chunk[-1]) is not None:
-                                    chunk.pop()  # Redundant page information
-                                res.append(
-                                    Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                        [x if isinstance(x, str) else x[0] for x in chunk]),
-                                          metadata={
-                                              'source': path,
-                                              'title': title,
-                                              'chunk_id': len(res)
-                                          },
-                                          token=parser_page_size - available_token))
-
-                                overlap_txt = self._get_last_part(chunk)
-                                if overlap_txt.strip():
-                                    chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
-                                    has_para = False
-                                    available_token = parser_page_size - count_tokens(overlap_txt)
-                                else:
-                                    chunk = []
-                                    has_para = False
-                                    available_token = parser_page_size
-                        # Has split this paragraph by sentence
-                        idx += 1
+                    # Has split this paragraph by sentence
+                    idx += 1
         if has_para:
-            if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
-                chunk.pop()  # Redundant page information
-            res.append(
-                Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
-                      metadata={
-                          'source': path,
-                          'title': title,
-                          'chunk_id': len(res)
-                      },
-                      token=parser_page_size - available_token))
-
-        return res
+            yield _complete_chunk()
+            num_chunks += 1
 
     def _get_last_part(self, chunk: list) -> str:
         overlap = ''
@@ -289,3 +448,31 @@ class DocParser(BaseTool):
                 else:
                     return overlap
         return overlap
+
+
+def _fit(offsets: List[int], start: int, available_token: int) -> int:
+    """Return the end of the longest run of items from `start` that fits into `available_token`, by token offsets."""
+    return max(bisect.bisect_right(offsets, offsets[start] + available_token, lo=start) - 1, start)
+
+
+def _split_to_sentences(txt: str, max_token: int) -> Tuple[List[str], List[int]]:
+    """Split a paragraph to sentences with their token counts, cutting sentences longer than `max_token` tokens."""
+    sentences, tokens = [], []
+    for s in re.split(r'\. |。', txt):
+        if not s.strip():
+            continue
+        token_ids = tokenizer.encode(s)
+        token = len(token_ids)
+        if token == 0:
+            continue
+        if token <= max_token:
+            sentences.append(s)
+            tokens.append(token)
+        else:
+            # Limit the length of a sentence to chunk size
+            token_list = tokenizer.convert_ids_to_tokens(token_ids)
+            for si in range(0, len(token_list), max_token):
+                piece = token_list[si:min(len(token_list), si + max_token)]
+                sentences.append(tokenizer.convert_tokens_to_string(piece))
+                tokens.append(len(piece))
+    return sentences, tokens
@@ -2,13 +2,12 @@ import json
 import os
 from typing import Dict, Optional, Union
 
-import json5
-
 from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.tools.search_tools.keyword_search import WORDS_TO_IGNORE, string_tokenizer
 from qwen_agent.tools.simple_doc_parser import SimpleDocParser
 from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import json_loads
 
 
 @register_tool('extract_doc_vocabulary')
@@ -37,7 +36,7 @@ class ExtractDocVocabulary(BaseTool):
         document_id = str(files)
 
         if isinstance(files, str):
-            files = json5.loads(files)
+            files = json_loads(files)
         docs = []
         for file in files:
             _doc = self.simple_doc_parse.call(params={'url': file}, **kwargs)
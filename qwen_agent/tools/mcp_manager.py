@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 import threading
 import hashlib
 from contextlib import AsyncExitStack
@@ -8,6 +9,7 @@ from typing import Dict, Optional, Union, List
 from dotenv import load_dotenv
 
 from qwen_agent.log import logger
+from qwen_agent.settings import MCP_SCHEMA_CACHE_DIR
 from qwen_agent.tools.base import BaseTool, register_tool
 
 
@@ -47,6 +49,10 @@ class MCPManager:
             load_dotenv()  # Load environment variables from .env file
             self.config_hash = config_hash
             self.clients: dict = {}
+            # 命中schema缓存、尚未建立连接的服务器配置，首次调用工具时再连接
+            self.server_configs: dict = {}
+            # 每个服务器一把连接锁（只在事件循环线程内创建和使用），连接慢的服务器不会阻塞其他服务器的调用
+            self._connect_locks: Dict[str, asyncio.Lock] = {}
             self.exit_stack = AsyncExitStack()
             self.loop = asyncio.new_event_loop()
             self.loop_thread = threading.Thread(target=self.start_loop, daemon=True)
@@ -182,55 +188,131 @@ class MCPManager:
         logger.info(f'[MCP初始化] 开始初始化MCP服务器，服务器数量: {len(mcp_servers)}')
         
         for server_name in mcp_servers:
-            logger.info(f'[MCP初始化] 正在连接MCP服务器: {server_name}')
-            client = MCPClient()
             server = mcp_servers[server_name]
-            await client.connection_server(self.exit_stack, server)  # Attempt to connect to the server
-            self.clients[server_name] = client  # Add to clients dict after successful connection
-            logger.info(f'[MCP初始化] MCP服务器连接成功: {server_name}, 可用工具数量: {len(client.tools) if client.tools else 0}')
-            
-            for tool in client.tools:
-                """MCP tool example:
-                {
-                "name": "read_query",
-                "description": "Execute a SELECT query on the SQLite database",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                        "type": "string",
-                        "description": "SELECT SQL query to execute"
-                        }
-                    },
-                    "required": ["query"]
-                }
-                """
-                parameters = tool.inputSchema
-                # The required field in inputSchema may be empty and needs to be initialized.
-                if 'required' not in parameters:
-                    parameters['required'] = []
-                # Remove keys from parameters that do not conform to the standard OpenAI schema
-                # Check if the required fields exist
-                required_fields = {'type', 'properties', 'required'}
-                missing_fields = required_fields - parameters.keys()
-                if missing_fields:
-                    raise ValueError(f'Missing required fields in schema: {missing_fields}')
-
-                # Keep only the necessary fields
-                cleaned_parameters = {
-                    'type': parameters['type'],
-                    'properties': parameters['properties'],
-                    'required': parameters['required']
-                }
-                register_name = server_name + '-' + tool.name
-                logger.info(f'[MCP初始化] 注册MCP工具: {register_name} (服务器: {server_name}, 工具: {tool.name})')
-                agent_tool = self.create_tool_class(register_name, server_name, tool.name, tool.description,
-                                                    cleaned_parameters)
+            tool_schemas = self._load_cached_schemas(server)
+            if tool_schemas is not None:
+                # 命中缓存：直接用缓存的schema注册工具，真实连接推迟到首次调用
+                self.server_configs[server_name] = server
+                logger.info(f'[MCP初始化] 命中工具schema缓存，延迟连接MCP服务器: {server_name}, 可用工具数量: {len(tool_schemas)}')
+            else:
+                logger.info(f'[MCP初始化] 正在连接MCP服务器: {server_name}')
+                client = MCPClient()
+                await client.connection_server(self.exit_stack, server)  # Attempt to connect to the server
+                self.clients[server_name] = client  # Add to clients dict after successful connection
+                logger.info(f'[MCP初始化] MCP服务器连接成功: {server_name}, 可用工具数量: {len(client.tools) if client.tools else 0}')
+                tool_schemas = [self._tool_to_schema(tool) for tool in (client.tools or [])]
+                if client.tools is not None:
+                    self._save_cached_schemas(server, tool_schemas)
+
+            for schema in tool_schemas:
+                register_name = server_name + '-' + schema['name']
+                logger.info(f'[MCP初始化] 注册MCP工具: {register_name} (服务器: {server_name}, 工具: {schema["name"]})')
+                agent_tool = self.create_tool_class(register_name, server_name, schema['name'], schema['description'],
+                                                    schema['parameters'])
                 tools.append(agent_tool)
         
         logger.info(f'[MCP初始化] MCP工具初始化完成，总计注册工具数量: {len(tools)}')
         return tools
 
+    @staticmethod
+    def _tool_to_schema(tool) -> Dict:
+        """将MCP工具描述转换为可缓存的schema字典
+
+        MCP tool example:
+        {
+        "name": "read_query",
+        "description": "Execute a SELECT query on the SQLite database",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                "type": "string",
+                "description": "SELECT SQL query to execute"
+                }
+            },
+            "required": ["query"]
+        }
+        """
+        parameters = tool.inputSchema
+        # The required field in inputSchema may be empty and needs to be initialized.
+        if 'required' not in parameters:
+            parameters['required'] = []
+        # Remove keys from parameters that do not conform to the standard OpenAI schema
+        # Check if the required fields exist
+        required_fields = {'type', 'properties', 'required'}
+        missing_fields = required_fields - parameters.keys()
+        if missing_fields:
+            raise ValueError(f'Missing required fields in schema: {missing_fields}')
+
+        # Keep only the necessary fields
+        cleaned_parameters = {
+            'type': parameters['type'],
+            'properties': parameters['properties'],
+            'required': parameters['required']
+        }
+        return {'name': tool.name, 'description': tool.description, 'parameters': cleaned_parameters}
+
+    def _schema_cache_path(self, server: Dict) -> Optional[str]:
+        """获取单个服务器配置对应的schema缓存文件路径，缓存禁用时返回None"""
+        if not MCP_SCHEMA_CACHE_DIR:
+            return None
+        return os.path.join(MCP_SCHEMA_CACHE_DIR, f'{self._generate_config_hash(server)}.json')
+
+    def _load_cached_schemas(self, server: Dict) -> Optional[List[Dict]]:
+        """读取服务器的工具schema缓存，未命中或缓存损坏时返回None"""
+        path = self._schema_cache_path(server)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                schemas = json.load(f)['tools']
+            for schema in schemas:
+                assert {'name', 'description', 'parameters'} <= schema.keys()
+            return schemas
+        except Exception as e:
+            logger.warning(f'[MCP初始化] 工具schema缓存读取失败，将重新连接服务器: {e}')
+            return None
+
+    def _save_cached_schemas(self, server: Dict, schemas: List[Dict]):
+        """原子写入服务器的工具schema缓存"""
+        path = self._schema_cache_path(server)
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'tools': schemas}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f'[MCP初始化] 工具schema缓存写入失败: {e}')
+
+    async def _get_client(self, server_name: str) -> 'MCPClient':
+        """获取服务器连接，对命中schema缓存的服务器在首次调用时建立连接"""
+        client = self.clients.get(server_name)
+        if client is not None:
+            return client
+        # 在事件循环线程内创建，保证锁绑定到self.loop
+        lock = self._connect_locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            client = self.clients.get(server_name)
+            if client is not None:
+                return client
+            server = self.server_configs[server_name]
+            logger.info(f'[MCP调用] 首次调用，正在连接MCP服务器: {server_name}')
+            client = MCPClient()
+            await client.connection_server(self.exit_stack, server)
+            if client.tools is None:
+                raise RuntimeError(f'Failed to connect to MCP server: {server_name}')
+            self.clients[server_name] = client
+            # 用真实的工具列表刷新缓存，避免服务端升级后缓存长期过期
+            self._save_cached_schemas(server, [self._tool_to_schema(tool) for tool in client.tools])
+            return client
+
+    async def execute_tool(self, server_name: str, tool_name: str, tool_args: dict):
+        client = await self._get_client(server_name)
+        return await client.execute_function(tool_name, tool_args)
+
     def create_tool_class(self, register_name, server_name, tool_name, tool_desc, tool_parameters):
         # 捕获当前manager实例的引用
         manager_instance = self
@@ -260,8 +342,8 @@ class MCPManager:
                         logger.warning(f'[MCP调用] 状态回调失败: {e}')
                 
                 # 使用捕获的manager实例而不是创建新实例
-                client = manager_instance.clients[server_name]
-                future = asyncio.run_coroutine_threadsafe(client.execute_function(tool_name, tool_args), manager_instance.loop)
+                future = asyncio.run_coroutine_threadsafe(
+                    manager_instance.execute_tool(server_name, tool_name, tool_args), manager_instance.loop)
                 
                 try:
                     result = future.result()
@@ -1,11 +1,17 @@
-from typing import Dict, Optional, Union
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
 
-import json5
-
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_SEARCHERS
+from qwen_agent.log import logger
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_PARSER_WORKERS,
+                                 DEFAULT_RAG_SEARCHERS)
 from qwen_agent.tools.base import TOOL_REGISTRY, BaseTool, register_tool
 from qwen_agent.tools.doc_parser import DocParser, Record
-from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
+from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES, parse_cache_stats
+from qwen_agent.utils.utils import json_loads
 
 
 def _check_deps_for_rag():
@@ -24,6 +30,55 @@ def _check_deps_for_rag():
                           'Please install the required dependencies by running: pip install "qwen-agent[rag]"') from e
 
 
+def _init_parser_worker():
+    # Load what parsing and indexing need once per worker process, instead of once per file
+    try:
+        import jieba
+        jieba.initialize()
+
+        from qwen_agent.utils.tokenization_qwen import get_tokenizer
+        get_tokenizer()
+    except Exception as e:
+        logger.warning(f'Failed to warm up the parser worker: {e}')
+
+
+def _parse_file(parser_cfg: dict, url: str, doc_key: str, max_ref_token: int,
+                parser_page_size: int) -> Tuple[dict, Dict[str, int]]:
+    # Runs in a worker process, so the parser is created there. The caller has already missed the cache.
+    # The cache counts recorded meanwhile are returned too, since those of a worker process are not seen by the caller.
+    counts = parse_cache_stats.counts()
+    record = DocParser(parser_cfg)._parse_and_chunk(url,
+                                                    doc_key,
+                                                    max_ref_token=max_ref_token,
+                                                    parser_page_size=parser_page_size)
+    return record, {k: v - counts.get(k, 0) for k, v in parse_cache_stats.counts().items() if v != counts.get(k, 0)}
+
+
+# The long-lived parser processes by the number of workers, shared by all Retrieval instances of the process
+_parser_pools: Dict[int, ProcessPoolExecutor] = {}
+_parser_pools_lock = threading.Lock()
+
+
+def _get_parser_pool(max_workers: int) -> ProcessPoolExecutor:
+    with _parser_pools_lock:
+        pool = _parser_pools.get(max_workers)
+        if pool is None:
+            # Not forked from the (possibly multithreaded) caller, whose locks and threads would be copied half-way
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = ProcessPoolExecutor(max_workers=max_workers,
+                                       mp_context=multiprocessing.get_context(start_method),
+                                       initializer=_init_parser_worker)
+            _parser_pools[max_workers] = pool
+        return pool
+
+
+def _discard_parser_pool(max_workers: int, pool: ProcessPoolExecutor):
+    with _parser_pools_lock:
+        if _parser_pools.get(max_workers) is pool:
+            del _parser_pools[max_workers]
+    pool.shutdown(wait=False)
+
+
 @register_tool('retrieval')
 class Retrieval(BaseTool):
     description = f'从给定文件列表中检索出和问题相关的内容，支持文件类型包括：{"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
@@ -47,13 +102,19 @@ class Retrieval(BaseTool):
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
         self.parser_page_size: int = self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE)
         self.doc_parse = DocParser({'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size})
+        self.parser_workers: int = self.cfg.get('parser_workers', DEFAULT_PARSER_WORKERS)
+        # If set, the files are parsed in the background, and retrieval uses the chunks that are ready after this many
+        # seconds (at least the first chunk of each file) instead of waiting for the whole files
+        self.early_retrieval_timeout: Optional[float] = self.cfg.get('early_retrieval_timeout', None)
 
         self.rag_searchers = self.cfg.get('rag_searchers', DEFAULT_RAG_SEARCHERS)
+        # Keyword search reads the indexes that the doc parser saves next to the chunks
+        search_cfg = {'max_ref_token': self.max_ref_token, 'doc_parser_path': self.doc_parse.data_root}
         if len(self.rag_searchers) == 1:
-            self.search = TOOL_REGISTRY[self.rag_searchers[0]]({'max_ref_token': self.max_ref_token})
+            self.search = TOOL_REGISTRY[self.rag_searchers[0]](search_cfg)
         else:
             from qwen_agent.tools.search_tools.hybrid_search import HybridSearch
-            self.search = HybridSearch({'max_ref_token': self.max_ref_token, 'rag_searchers': self.rag_searchers})
+            self.search = HybridSearch({**search_cfg, 'rag_searchers': self.rag_searchers})
 
     def call(self, params: Union[str, dict], **kwargs) -> list:
         """RAG tool.
@@ -73,14 +134,61 @@ class Retrieval(BaseTool):
         params = self._verify_json_format_args(params)
         files = params.get('files', [])
         if isinstance(files, str):
-            files = json5.loads(files)
-        records = []
-        for file in files:
-            _record = self.doc_parse.call(params={'url': file}, **kwargs)
-            records.append(_record)
+            files = json_loads(files)
+        records = self._parse_files(files, **kwargs)
 
         query = params.get('query', '')
         if records:
             return self.search.call(params={'query': query}, docs=[Record(**rec) for rec in records], **kwargs)
         else:
             return []
+
+    def _parse_files(self, files: List[str], **kwargs) -> List[dict]:
+        """Parse the files, in parallel worker processes if there are several of them.
+
+        Parsing (pdfminer, pdfplumber, etc.) is CPU-bound, so a process pool lets multiple files take roughly as long
+        as the largest one. Files that are already in the parser's cache are read in this process, and only the
+        others are sent to the workers.
+        """
+        if self.early_retrieval_timeout is not None:
+            # Background threads in this process, since the chunks of a worker process could not be streamed back
+            jobs = [self.doc_parse.parse_in_background(params={'url': file}, **kwargs) for file in files]
+            deadline = time.time() + self.early_retrieval_timeout
+            return [job.wait(timeout=max(deadline - time.time(), 0)) for job in jobs]
+
+        if len(files) <= 1 or self.parser_workers <= 1:
+            return [self.doc_parse.call(params={'url': file}, **kwargs) for file in files]
+
+        # Same as DocParser.call, which only reads these kwargs
+        max_ref_token = kwargs.get('max_ref_token', self.doc_parse.max_ref_token)
+        parser_page_size = kwargs.get('parser_page_size', self.doc_parse.parser_page_size)
+        records = {}
+        doc_keys = {}
+        for i, file in enumerate(files):
+            doc_key = self.doc_parse.doc_extractor.get_cache_key(file)
+            record = self.doc_parse._read_cached_record(file, doc_key, parser_page_size)
+            if record is None:
+                doc_keys[i] = doc_key
+            else:
+                records[i] = record
+
+        if len(doc_keys) > 1:
+            pool = _get_parser_pool(self.parser_workers)
+            try:
+                futures = {
+                    i: pool.submit(_parse_file, self.doc_parse.cfg, files[i], doc_key, max_ref_token, parser_page_size)
+                    for i, doc_key in doc_keys.items()
+                }
+                for i, future in futures.items():
+                    records[i], counts = future.result()
+                    parse_cache_stats.add(counts)
+            except BrokenProcessPool as e:
+                logger.warning(f'Parallel parsing failed, parse the files one by one instead: {e}')
+                _discard_parser_pool(self.parser_workers, pool)
+        for i, doc_key in doc_keys.items():
+            if i not in records:
+                records[i] = self.doc_parse._parse_and_chunk(files[i],
+                                                             doc_key,
+                                                             max_ref_token=max_ref_token,
+                                                             parser_page_size=parser_page_size)
+        return [records[i] for i in range(len(files))]
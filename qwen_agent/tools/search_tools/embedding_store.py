@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from qwen_agent.log import logger
+from qwen_agent.utils.utils import hash_sha256
+
+EMBEDDING_REGISTRY = {}
+
+
+def register_embedding(model_type: str):
+
+    def decorator(cls):
+        EMBEDDING_REGISTRY[model_type] = cls
+        return cls
+
+    return decorator
+
+
+def get_embedding(cfg: Dict) -> 'BaseEmbedding':
+    """Instantiate an embedding backend, e.g. {'model_type': 'dashscope', 'model': 'text-embedding-v1'}."""
+    model_type = cfg.get('model_type', 'dashscope')
+    if model_type not in EMBEDDING_REGISTRY:
+        raise ValueError(f'Please set model_type from {str(EMBEDDING_REGISTRY.keys())}')
+    return EMBEDDING_REGISTRY[model_type](cfg)
+
+
+class BaseEmbedding(ABC):
+    default_batch_size: int = 32
+    default_max_workers: int = 1
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        self.cfg = cfg or {}
+        self.model: str = self.cfg['model']
+        self.batch_size: int = self.cfg.get('batch_size', self.default_batch_size)  # Texts per embedding request
+        self.max_workers: int = self.cfg.get('max_workers', self.default_max_workers)  # Max concurrent requests
+
+    @property
+    def cache_name(self) -> str:
+        """The name of the directory of the embeddings computed by this backend."""
+        model_type = self.cfg.get('model_type', 'dashscope')
+        return re.sub(r'[^\w.-]', '_', f'{model_type}_{self.model}')
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@register_embedding('dashscope')
+class DashScopeEmbedding(BaseEmbedding):
+    default_batch_size = 25  # The max number of texts of one request
+    default_max_workers = 4
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        cfg.setdefault('model', 'text-embedding-v1')
+        super().__init__(cfg)
+        self.api_key = self.cfg.get('api_key') or os.getenv('DASHSCOPE_API_KEY', '')
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._call(texts[i:i + self.batch_size], text_type='document'))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call([text], text_type='query')[0]
+
+    def _call(self, texts: List[str], text_type: str) -> List[List[float]]:
+        import dashscope
+
+        resp = dashscope.TextEmbedding.call(model=self.model, input=texts, text_type=text_type, api_key=self.api_key)
+        if resp.status_code != 200:
+            raise RuntimeError(f'Failed to compute embeddings: {resp.code} {resp.message}')
+        embeddings = sorted(resp.output['embeddings'], key=lambda x: x['text_index'])
+        return [x['embedding'] for x in embeddings]
+
+
+@register_embedding('sentence_transformers')
+class SentenceTransformerEmbedding(BaseEmbedding):
+    """A local embedding model, which works offline once the model is downloaded."""
+    default_batch_size = 64
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        cfg.setdefault('model', 'BAAI/bge-small-zh-v1.5')
+        super().__init__(cfg)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError('Please install sentence-transformers by: `pip install sentence-transformers`')
+        self._model = SentenceTransformer(self.model, device=self.cfg.get('device'))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._model.encode(texts, normalize_embeddings=True).tolist()
+
+
+class EmbeddingStore:
+    """Chunk embeddings on disk, computed once per (document, chunk, embedding model).
+
+    The embeddings of a document are one float32 matrix, whose rows are the chunks, saved as a .npy file in the
+    directory of the embedding model and named after the hash of the document's chunks. The matrices are normalized,
+    so that dot products are cosine similarities, and are loaded memory-mapped.
+
+    Identical chunk texts are embedded once. The distinct texts are sent in batches of `batch_size`, with up to
+    `max_workers` requests in flight, and each finished batch is saved, so that an interrupted indexing resumes from
+    the batches that are already done.
+    """
+
+    def __init__(self, root: str, embedding: BaseEmbedding):
+        self.embedding = embedding
+        self.root = os.path.join(root, embedding.cache_name)
+        os.makedirs(self.root, exist_ok=True)
+
+    def get_matrix(self, url: str, contents: List[str]):
+        key = hash_sha256(json.dumps(contents, ensure_ascii=False))  # Shared by the same doc at different paths
+        path = os.path.join(self.root, key + '.npy')
+        matrix = _load_npy(path, num_rows=len(contents), mmap_mode='r')
+        if matrix is not None:
+            return matrix
+
+        texts = list(dict.fromkeys(contents))
+        logger.info(f'Start embedding {len(contents)} chunks ({len(texts)} distinct) of {url}...')
+        progress_dir = os.path.join(self.root, f'{key}.{self.embedding.batch_size}.progress')
+        vectors = self._embed_in_batches(texts, progress_dir)
+        row_of_text = {text: i for i, text in enumerate(texts)}
+        matrix = normalize(vectors[[row_of_text[text] for text in contents]])
+        if _save_npy(path, matrix):
+            shutil.rmtree(progress_dir, ignore_errors=True)
+        return matrix
+
+    def _embed_in_batches(self, texts: List[str], progress_dir: str):
+        import numpy as np
+
+        batch_size = self.embedding.batch_size
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        os.makedirs(progress_dir, exist_ok=True)
+        results = [_load_npy(os.path.join(progress_dir, f'{i}.npy'), num_rows=len(b)) for i, b in enumerate(batches)]
+        todo = [i for i, r in enumerate(results) if r is None]
+        if len(todo) < len(batches):
+            logger.info(f'Resume embedding: {len(batches) - len(todo)}/{len(batches)} batches are already done.')
+
+        def _embed_batch(i: int):
+            vectors = np.asarray(self.embedding.embed_documents(batches[i]), dtype=np.float32)
+            _save_npy(os.path.join(progress_dir, f'{i}.npy'), vectors)
+            return vectors
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(self.embedding.max_workers, len(todo))) as executor:
+                for i, vectors in zip(todo, executor.map(_embed_batch, todo)):
+                    results[i] = vectors
+        return np.concatenate(results)
+
+    def embed_query(self, text: str):
+        import numpy as np
+
+        return normalize(np.asarray(self.embedding.embed_query(text), dtype=np.float32))
+
+
+def _load_npy(path: str, num_rows: int, mmap_mode: Optional[str] = None):
+    import numpy as np
+
+    try:
+        array = np.load(path, mmap_mode=mmap_mode)
+    except (OSError, ValueError):
+        return None
+    return array if array.shape[0] == num_rows else None
+
+
+def _save_npy(path: str, array) -> bool:
+    import numpy as np
+
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)  # Atomic, so that a concurrent reader never loads a partial matrix
+        return True
+    except OSError as e:
+        logger.warning(f'Failed to save the embeddings to {path}: {e}')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def normalize(vectors):
+    import numpy as np
+
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
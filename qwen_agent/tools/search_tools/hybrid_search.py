@@ -1,3 +1,5 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
 from qwen_agent.settings import DEFAULT_RAG_SEARCHERS
@@ -6,6 +8,8 @@ from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
 from qwen_agent.tools.search_tools.front_page_search import POSITIVE_INFINITY
 
+RRF_K = 60  # The constant of reciprocal rank fusion
+
 
 @register_tool('hybrid_search')
 class HybridSearch(BaseSearch):
@@ -19,29 +23,64 @@ class HybridSearch(BaseSearch):
         self.search_objs = [TOOL_REGISTRY[name](cfg) for name in self.rag_searchers]
 
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        chunk_and_score_list = []
-        for s_obj in self.search_objs:
-            chunk_and_score_list.append(s_obj.sort_by_scores(query=query, docs=docs, **kwargs))
+        import numpy as np
+
+        # The sub-searchers are independent, and the vector search mostly waits for the embedding service
+        if len(self.search_objs) > 1:
+            with ThreadPoolExecutor(max_workers=len(self.search_objs)) as executor:
+                futures = [
+                    executor.submit(s_obj.sort_by_scores, query=query, docs=docs, **kwargs)
+                    for s_obj in self.search_objs
+                ]
+                chunk_and_score_list = [future.result() for future in futures]
+        else:
+            chunk_and_score_list = [
+                s_obj.sort_by_scores(query=query, docs=docs, **kwargs) for s_obj in self.search_objs
+            ]
 
-        chunk_score_map = {}
+        # Number all chunks of all docs, so that the fusion works on flat arrays
+        doc_offsets = {}
+        chunk_keys = []
         for doc in docs:
-            chunk_score_map[doc.url] = [0] * len(doc.raw)
+            doc_offsets[doc.url] = len(chunk_keys)
+            chunk_keys.extend((doc.url, i) for i in range(len(doc.raw)))
+        fused = np.zeros(len(chunk_keys), dtype=np.float64)
 
         for chunk_and_score in chunk_and_score_list:
-            for i in range(len(chunk_and_score)):
-                doc_id = chunk_and_score[i][0]
-                chunk_id = chunk_and_score[i][1]
-                score = chunk_and_score[i][2]
-                if score == POSITIVE_INFINITY:
-                    chunk_score_map[doc_id][chunk_id] = POSITIVE_INFINITY
-                else:
-                    # TODO: This needs to be adjusted for performance
-                    chunk_score_map[doc_id][chunk_id] += 1 / (i + 1 + 60)
-
-        all_chunk_and_score = []
-        for k, v in chunk_score_map.items():
-            for i, x in enumerate(v):
-                all_chunk_and_score.append((k, i, x))
-        all_chunk_and_score.sort(key=lambda item: item[2], reverse=True)
-
-        return all_chunk_and_score
+            if not chunk_and_score:
+                continue
+            positions = np.fromiter((doc_offsets[doc_id] + chunk_id for doc_id, chunk_id, _ in chunk_and_score),
+                                    dtype=np.int64,
+                                    count=len(chunk_and_score))
+            scores = np.fromiter((score for _, _, score in chunk_and_score),
+                                 dtype=np.float64,
+                                 count=len(chunk_and_score))
+            # TODO: This needs to be adjusted for performance
+            np.add.at(fused, positions, 1 / (np.arange(len(chunk_and_score)) + 1 + RRF_K))
+            fused[positions[scores == POSITIVE_INFINITY]] = POSITIVE_INFINITY
+
+        order = self._top_order(fused, docs, kwargs.get('max_ref_token'))
+        return [(chunk_keys[i][0], chunk_keys[i][1], float(fused[i])) for i in order]
+
+    @staticmethod
+    def _top_order(fused, docs: List[Record], max_ref_token: Optional[int]):
+        """The chunk positions by descending score, with ties in document order.
+
+        Only the chunks that can fit into `max_ref_token` are ranked: no more than the budget divided by the smallest
+        chunk can be retrieved, so the rest are cut off with argpartition instead of being sorted.
+        """
+        import numpy as np
+
+        n = len(fused)
+        k = n
+        if max_ref_token is not None and n > 0:
+            min_token = max(min(chk.token for doc in docs for chk in doc.raw), 1)
+            k = min(n, math.ceil(max_ref_token / min_token) + 1)
+        if k < n:
+            kth = fused[np.argpartition(-fused, k - 1)[k - 1]]
+            above = np.flatnonzero(fused > kth)
+            tied = np.flatnonzero(fused == kth)[:k - len(above)]  # The earliest chunks win ties, as in a stable sort
+            top = np.sort(np.concatenate([above, tied]))
+        else:
+            top = np.arange(n)
+        return top[np.argsort(-fused[top], kind='stable')]
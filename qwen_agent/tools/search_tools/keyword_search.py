@@ -1,29 +1,63 @@
+import itertools
+import json
+import math
+import os
 import re
 import string
-from typing import List, Tuple
-
-import json5
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN
+from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
-from qwen_agent.tools.doc_parser import Record
+from qwen_agent.tools.doc_parser import DocParser, Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
-from qwen_agent.utils.utils import has_chinese_chars
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.utils import has_chinese_chars, hash_sha256, json_loads
+
+# The parameters of rank_bm25.BM25Okapi, so that the scores are the same as before the index existed
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+KEYWORD_INDEX_VERSION = 2
+MAX_LOADED_KEYWORD_INDEXES = 64
 
 
 @register_tool('keyword_search')
 class KeywordSearch(BaseSearch):
+    """BM25 retrieval over per-document inverted indexes.
+
+    The index of a document is built once, when DocParser chunks it, and stored next to the chunk cache. A query only
+    merges the postings of its own terms, instead of tokenizing the whole corpus again.
+    """
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # The indexes are saved by DocParser, so they are read from its storage root
+        data_root = self.cfg.get('doc_parser_path', os.path.join(DEFAULT_WORKSPACE, 'tools', DocParser.name))
+        self.db = Storage({'storage_root_path': data_root})
 
     def search(self, query: str, docs: List[Record], max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
-        chunk_and_score = self.sort_by_scores(query=query, docs=docs)
-        if not chunk_and_score:
+        wordlist = parse_keyword(query)
+        logger.debug('wordlist: ' + ','.join(wordlist))
+        if not wordlist:
+            # This represents the queries that do not use retrieval: summarize, etc.
+            return self._get_the_front_part(docs, max_ref_token)
+
+        chunk_and_score = self._iter_ranked_chunks(docs, self._score_chunks(wordlist, docs))
+        first = next(chunk_and_score, None)
+        if first is None:
             return self._get_the_front_part(docs, max_ref_token)
 
-        max_sims = chunk_and_score[0][-1]
+        max_sims = first[-1]
 
         if max_sims != 0:
-            return super().get_topk(chunk_and_score=chunk_and_score, docs=docs, max_ref_token=max_ref_token)
+            # get_topk stops at the token budget, so the chunks without a score are only listed as far as needed
+            return super().get_topk(chunk_and_score=itertools.chain([first], chunk_and_score),
+                                    docs=docs,
+                                    max_ref_token=max_ref_token)
         else:
             return self._get_the_front_part(docs, max_ref_token)
 
@@ -34,23 +68,198 @@ class KeywordSearch(BaseSearch):
             # This represents the queries that do not use retrieval: summarize, etc.
             return []
 
-        # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            all_chunks.extend(doc.raw)
-
-        # Using bm25 retrieval
-        from rank_bm25 import BM25Okapi
-        bm25 = BM25Okapi([split_text_into_keywords(x.content) for x in all_chunks])
-        doc_scores = bm25.get_scores(wordlist)
-        chunk_and_score = [
-            (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(all_chunks, doc_scores)
-        ]
-        chunk_and_score.sort(key=lambda item: item[2], reverse=True)
+        chunk_and_score = list(self._iter_ranked_chunks(docs, self._score_chunks(wordlist, docs)))
         assert len(chunk_and_score) > 0
 
         return chunk_and_score
 
+    def _score_chunks(self, wordlist: List[str], docs: List[Record]) -> Dict[Tuple[int, int], float]:
+        """The nonzero bm25 scores by (doc index, chunk index), only computed for the chunks in the postings.
+
+        The corpus statistics are merged over the indexes of all docs.
+        """
+        keyed_indexes = [self._get_keyed_index(doc) for doc in docs]
+        indexes = [idx for _, idx in keyed_indexes]
+        corpus_size = sum(len(idx['doc_lens']) for idx in indexes)
+        if corpus_size == 0:
+            return {}
+        avgdl = sum(idx['doc_len_sum'] for idx in indexes) / corpus_size
+        scores = {}
+        idf_cache = {}
+        for word in wordlist:
+            if word not in idf_cache:
+                idf_cache[word] = self._get_idf(word, keyed_indexes, corpus_size)
+            idf = idf_cache[word]
+            if idf is None:
+                continue
+            for doc_idx, idx in enumerate(indexes):
+                doc_lens = idx['doc_lens']
+                for chunk_idx, tf in idx['postings'].get(word, []):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[chunk_idx] / avgdl)
+                    pos = (doc_idx, chunk_idx)
+                    scores[pos] = scores.get(pos, 0.0) + idf * (tf * (BM25_K1 + 1) / (tf + norm))
+        return {pos: score for pos, score in scores.items() if score != 0}
+
+    @staticmethod
+    def _iter_ranked_chunks(docs: List[Record],
+                            scores: Dict[Tuple[int, int], float]) -> Iterator[Tuple[str, int, float]]:
+        """All chunks by descending score, with ties in document order, as a stable sort of all chunks would give.
+
+        Only the scored chunks are sorted. The others all score zero, so they are listed lazily in document order.
+        """
+
+        def _item(pos: Tuple[int, int], score: float) -> Tuple[str, int, float]:
+            chk = docs[pos[0]].raw[pos[1]]
+            return chk.metadata['source'], chk.metadata['chunk_id'], score
+
+        ranked = sorted(scores, key=lambda pos: (-scores[pos], pos))
+        num_positive = sum(1 for score in scores.values() if score > 0)
+        for pos in ranked[:num_positive]:
+            yield _item(pos, scores[pos])
+        for doc_idx, doc in enumerate(docs):
+            for chunk_idx in range(len(doc.raw)):
+                if (doc_idx, chunk_idx) not in scores:
+                    yield _item((doc_idx, chunk_idx), 0.0)
+        for pos in ranked[num_positive:]:
+            yield _item(pos, scores[pos])
+
+    @staticmethod
+    def _get_idf(word: str, keyed_indexes: List[Tuple[str, dict]], corpus_size: int) -> Optional[float]:
+        df = sum(len(idx['postings'].get(word, [])) for _, idx in keyed_indexes)
+        if df == 0:
+            return None
+        idf = math.log(corpus_size - df + 0.5) - math.log(df + 0.5)
+        if idf >= 0:
+            return idf
+        # As in BM25Okapi, a term in more than half of the chunks gets a fraction of the average idf of all terms
+        return BM25_EPSILON * _get_average_idf(keyed_indexes)
+
+    def get_index(self, doc: Record) -> dict:
+        """Get the inverted index of a doc, from memory, from the storage, or by building it."""
+        return self._get_keyed_index(doc)[1]
+
+    def _get_keyed_index(self, doc: Record) -> Tuple[str, dict]:
+        # DocParser keeps the hash of the chunks in their metadata, so that they need not be hashed for every query
+        chunks_hash = doc.raw[0].metadata.get('chunks_hash') if doc.raw else None
+        parsed_by_doc_parser = chunks_hash is not None
+        if chunks_hash is None:
+            chunks_hash = hash_chunks([chk.content for chk in doc.raw])
+        key = get_keyword_index_key(chunks_hash)
+        index = _loaded_indexes.get(key)
+        if (index is not None) and (len(index['doc_lens']) == len(doc.raw)):
+            return key, index
+        try:
+            index = self.db.get_obj(key)
+            if (index.get('version') != KEYWORD_INDEX_VERSION) or (len(index['doc_lens']) != len(doc.raw)):
+                index = None
+        except (KeyNotExistsError, ValueError):
+            index = None
+        if index is None:
+            index = build_keyword_index([chk.content for chk in doc.raw])
+            # Docs that are not parsed by DocParser, such as plain strings, are only indexed in memory
+            if parsed_by_doc_parser:
+                self.db.put_obj(key, index)
+        _loaded_indexes.put(key, index)
+        return key, index
+
+
+class _IndexLRU:
+    """A small thread-safe LRU of loaded indexes (or their statistics), so that a conversation does not reload them
+    for every query.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            index = self._data.get(key)
+            if index is not None:
+                self._data.move_to_end(key)
+            return index
+
+    def put(self, key: str, index: dict):
+        with self._lock:
+            self._data[key] = index
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+_loaded_indexes = _IndexLRU(MAX_LOADED_KEYWORD_INDEXES)
+_average_idfs = _IndexLRU(MAX_LOADED_KEYWORD_INDEXES)  # The idf statistics merged over the indexes of a doc set
+
+
+def _get_average_idf(keyed_indexes: List[Tuple[str, dict]]) -> float:
+    """The average idf of all terms of the merged corpus of the docs, as BM25Okapi computes it."""
+    if len(keyed_indexes) == 1:
+        # Computed when the index is built
+        index = keyed_indexes[0][1]
+        return index['idf_sum'] / index['num_terms']
+
+    # The number of chunks is part of the key, since the index of a partially parsed doc grows
+    set_key = hash_sha256('|'.join(sorted(f'{key}:{len(idx["doc_lens"])}' for key, idx in keyed_indexes)))
+    stats = _average_idfs.get(set_key)
+    if stats is None:
+        corpus_size = sum(len(idx['doc_lens']) for _, idx in keyed_indexes)
+        dfs = Counter()
+        for _, idx in keyed_indexes:
+            for word, postings in idx['postings'].items():
+                dfs[word] += len(postings)
+        idf_sum = sum(math.log(corpus_size - df + 0.5) - math.log(df + 0.5) for df in dfs.values())
+        stats = {'average_idf': idf_sum / len(dfs)}
+        _average_idfs.put(set_key, stats)
+    return stats['average_idf']
+
+
+def hash_chunks(contents: List[str]) -> str:
+    """The hash of the chunks of a doc, which does not depend on the path of the doc."""
+    return hash_sha256(json.dumps(contents, ensure_ascii=False))
+
+
+def get_keyword_index_key(chunks_hash: str) -> str:
+    """The storage key of the index of a doc, see `hash_chunks`."""
+    return f'{chunks_hash}_keyword_index_v{KEYWORD_INDEX_VERSION}'
+
+
+def build_keyword_index(contents: List[str]) -> dict:
+    """Build the inverted index of the chunks of a doc: term -> [[chunk index, term frequency], ...]."""
+    builder = KeywordIndexBuilder()
+    for content in contents:
+        builder.add(content)
+    return builder.index
+
+
+class KeywordIndexBuilder:
+    """Builds the inverted index of a doc chunk by chunk, e.g. while the doc is still being parsed."""
+
+    def __init__(self):
+        self._doc_lens: List[int] = []
+        self._postings: Dict[str, List[List[int]]] = {}
+
+    def add(self, content: str):
+        chunk_idx = len(self._doc_lens)
+        words = split_text_into_keywords(content)
+        self._doc_lens.append(len(words))
+        for word, tf in Counter(words).items():
+            self._postings.setdefault(word, []).append([chunk_idx, tf])
+
+    @property
+    def index(self) -> dict:
+        """The index of the chunks added so far, with the corpus statistics that queries would otherwise recompute."""
+        corpus_size = len(self._doc_lens)
+        idf_sum = sum(math.log(corpus_size - len(p) + 0.5) - math.log(len(p) + 0.5) for p in self._postings.values())
+        return {
+            'version': KEYWORD_INDEX_VERSION,
+            'doc_lens': self._doc_lens,
+            'doc_len_sum': sum(self._doc_lens),
+            'idf_sum': idf_sum,
+            'num_terms': len(self._postings),
+            'postings': self._postings,
+        }
+
 
 WORDS_TO_IGNORE = [
     'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd", 'your',
@@ -154,7 +363,7 @@ def split_text_into_keywords(text: str) -> List[str]:
 
 def parse_keyword(text):
     try:
-        res = json5.loads(text)
+        res = json_loads(text)
     except Exception:
         return split_text_into_keywords(text)
 
@@ -1,29 +1,37 @@
 import json
 import os
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from qwen_agent.settings import DEFAULT_EMBEDDING_CFG, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
+from qwen_agent.tools.search_tools.embedding_store import EmbeddingStore, get_embedding
 
 
 @register_tool('vector_search')
 class VectorSearch(BaseSearch):
     # TODO: Optimize the accuracy of the embedding retriever.
 
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # The embedding backend, e.g. {'model_type': 'sentence_transformers', 'model': 'BAAI/bge-small-zh-v1.5'}
+        self.embedding_cfg: dict = self.cfg.get('embedding', DEFAULT_EMBEDDING_CFG)
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        self._store: Optional[EmbeddingStore] = None
+
+    @property
+    def store(self) -> EmbeddingStore:
+        # Created on first use, so that configuring the tool does not load a local embedding model
+        if self._store is None:
+            self._store = EmbeddingStore(self.data_root, get_embedding(dict(self.embedding_cfg)))
+        return self._store
+
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        # TODO: More types of embedding can be configured
         try:
-            from langchain.schema import Document
+            import numpy as np
         except ModuleNotFoundError:
-            raise ModuleNotFoundError('Please install langchain by: `pip install langchain`')
-        try:
-            from langchain_community.embeddings import DashScopeEmbeddings
-            from langchain_community.vectorstores import FAISS
-        except ModuleNotFoundError:
-            raise ModuleNotFoundError(
-                'Please install langchain_community by: `pip install langchain_community`, '
-                'and install faiss by: `pip install faiss-cpu` or `pip install faiss-gpu` (for CUDA supported GPU)')
+            raise ModuleNotFoundError('Please install numpy by: `pip install numpy`')
         # Extract raw query
         try:
             query_json = json.loads(query)
@@ -33,15 +41,17 @@ class VectorSearch(BaseSearch):
         except json.decoder.JSONDecodeError:
             pass
 
-        # Plain all chunks from all docs
+        # Plain all chunks from all docs, with the embeddings of each doc computed only once
         all_chunks = []
+        matrices = []
         for doc in docs:
-            for chk in doc.raw:
-                all_chunks.append(Document(page_content=chk.content[:2000], metadata=chk.metadata))
-
-        embeddings = DashScopeEmbeddings(model='text-embedding-v1',
-                                         dashscope_api_key=os.getenv('DASHSCOPE_API_KEY', ''))
-        db = FAISS.from_documents(all_chunks, embeddings)
-        chunk_and_score = db.similarity_search_with_score(query, k=len(all_chunks))
+            if not doc.raw:
+                continue
+            all_chunks.extend(doc.raw)
+            matrices.append(self.store.get_matrix(doc.url, [chk.content[:2000] for chk in doc.raw]))
+        if not all_chunks:
+            return []
 
-        return [(chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in chunk_and_score]
+        scores = np.concatenate(matrices) @ self.store.embed_query(query)
+        order = np.argsort(-scores, kind='stable')
+        return [(all_chunks[i].metadata['source'], all_chunks[i].metadata['chunk_id'], float(scores[i])) for i in order]
@@ -1,9 +1,10 @@
-import json
+import hashlib
 import os
 import re
+import threading
 import time
 from collections import Counter
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
 
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_WORKSPACE
@@ -224,55 +225,63 @@ def parse_html_bs(path: str, extract_image: bool = False):
 
 
 def parse_pdf(pdf_path: str, extract_image: bool = False) -> List[dict]:
+    return list(iter_pdf_pages(pdf_path, extract_image))
+
+
+def iter_pdf_pages(pdf_path: str, extract_image: bool = False) -> Iterator[dict]:
+    """Parse a pdf lazily, yielding each page as soon as it is extracted."""
     # Todo: header and footer
     from pdfminer.high_level import extract_pages
     from pdfminer.layout import LTImage, LTRect, LTTextContainer
 
-    doc = []
-    import pdfplumber
-    pdf = pdfplumber.open(pdf_path)
-    for i, page_layout in enumerate(extract_pages(pdf_path)):
-        page = {'page_num': page_layout.pageid, 'content': []}
-
-        elements = []
-        for element in page_layout:
-            elements.append(element)
-
-        # Init params for table
-        table_num = 0
-        tables = []
-
-        for element in elements:
-            if isinstance(element, LTRect):
-                if not tables:
-                    tables = extract_tables(pdf, i)
-                if table_num < len(tables):
-                    table_string = table_converter(tables[table_num])
-                    table_num += 1
-                    if table_string:
-                        page['content'].append({'table': table_string, 'obj': element})
-            elif isinstance(element, LTTextContainer):
-                # Delete line breaks in the same paragraph
-                text = element.get_text()
-                # Todo: Further analysis using font
-                font = get_font(element)
-                if text.strip():
-                    new_content_item = {'text': text, 'obj': element}
-                    if font:
-                        new_content_item['font-size'] = round(font[1])
-                        # new_content_item['font-name'] = font[0]
-                    page['content'].append(new_content_item)
-            elif extract_image and isinstance(element, LTImage):
-                # Todo: ocr
-                raise ValueError('Currently, extracting images is not supported!')
-            else:
-                pass
-
-        # merge elements
-        page['content'] = postprocess_page_content(page['content'])
-        doc.append(page)
+    pdf = None  # pdfplumber is only opened once a page has tables
+    try:
+        for i, page_layout in enumerate(extract_pages(pdf_path)):
+            page = {'page_num': page_layout.pageid, 'content': []}
+
+            elements = []
+            for element in page_layout:
+                elements.append(element)
+
+            # Init params for table
+            table_num = 0
+            tables = []
+
+            for element in elements:
+                if isinstance(element, LTRect):
+                    if not tables:
+                        if pdf is None:
+                            import pdfplumber
+                            pdf = pdfplumber.open(pdf_path)
+                        tables = extract_tables(pdf, i)
+                    if table_num < len(tables):
+                        table_string = table_converter(tables[table_num])
+                        table_num += 1
+                        if table_string:
+                            page['content'].append({'table': table_string, 'obj': element})
+                elif isinstance(element, LTTextContainer):
+                    # Delete line breaks in the same paragraph
+                    text = element.get_text()
+                    # Todo: Further analysis using font
+                    font = get_font(element)
+                    if text.strip():
+                        new_content_item = {'text': text, 'obj': element}
+                        if font:
+                            new_content_item['font-size'] = round(font[1])
+                            # new_content_item['font-name'] = font[0]
+                        page['content'].append(new_content_item)
+                elif extract_image and isinstance(element, LTImage):
+                    # Todo: ocr
+                    raise ValueError('Currently, extracting images is not supported!')
+                else:
+                    pass
 
-    return doc
+            # merge elements
+            page['content'] = postprocess_page_content(page['content'])
+            yield page
+    finally:
+        if pdf is not None:
+            pdf.close()
 
 
 def postprocess_page_content(page_content: list) -> list:
@@ -353,6 +362,61 @@ def table_converter(table):
 PARSER_SUPPORTED_FILE_TYPES = ['pdf', 'docx', 'pptx', 'txt', 'html', 'csv', 'tsv', 'xlsx', 'xls']
 
 
+class ParseCacheStats:
+    """Hit counts of the parsing caches, shared by all parsers in the process.
+
+    - parsed: the extracted pages of a doc, cached by SimpleDocParser
+    - chunked: the chunks of a doc, cached by DocParser
+    - file_hash: the content hash of a local file, reused if the size and mtime of the file are unchanged
+    """
+
+    KINDS = ('parsed', 'chunked', 'file_hash')
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, hit: bool):
+        with self._lock:
+            self._counts[f'{kind}_hits' if hit else f'{kind}_misses'] += 1
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def add(self, counts: Dict[str, int]):
+        """Merge the counts recorded elsewhere, such as in a parser worker process."""
+        with self._lock:
+            self._counts.update(counts)
+
+    def to_dict(self) -> dict:
+        counts = self.counts()
+        stats = {'pid': os.getpid()}  # The counts are of this process only
+        for kind in self.KINDS:
+            hits, misses = counts.get(f'{kind}_hits', 0), counts.get(f'{kind}_misses', 0)
+            stats[kind] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if (hits + misses) else None,
+            }
+        return stats
+
+
+parse_cache_stats = ParseCacheStats()
+
+
+def get_parse_cache_stats() -> dict:
+    return parse_cache_stats.to_dict()
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
 def get_plain_doc(doc: list):
     paras = []
     for page in doc:
@@ -402,67 +466,117 @@ class SimpleDocParser(BaseTool):
         """
 
         params = self._verify_json_format_args(params)
-        path = params['url']
-        cached_name_ori = f'{hash_sha256(path)}_ori'
+        parsed_file = list(self.iter_pages(params['url']))
+
+        if not self.structured_doc:
+            return get_plain_doc(parsed_file)
+        else:
+            return parsed_file
+
+    def get_cache_key(self, path: str) -> str:
+        """The key of a doc in the parsing caches.
+
+        Local files are keyed by the sha256 of their content, so that the same file at different paths is parsed
+        once, and a changed file is parsed again. The hash is stored with the size and mtime of the file, and only
+        recomputed when they change. Urls are keyed by the url itself.
+        """
+        if is_http_url(path):
+            return hash_sha256(path)
+        local_path = sanitize_chrome_file_path(path)
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            return hash_sha256(path)  # Parsing will report the missing file
+
+        cached_name_stat = f'file_hash_{hash_sha256(os.path.abspath(local_path))}'
+        try:
+            size, mtime_ns, content_hash = self.db.get_obj(cached_name_stat)
+            if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                parse_cache_stats.record('file_hash', hit=True)
+                return content_hash
+        except (KeyNotExistsError, ValueError, TypeError):
+            pass
+        parse_cache_stats.record('file_hash', hit=False)
+        content_hash = hash_file(local_path)
+        self.db.put_obj(cached_name_stat, [stat.st_size, stat.st_mtime_ns, content_hash])
+        return content_hash
+
+    def iter_pages(self, path: str, cache_key: Optional[str] = None) -> Iterator[dict]:
+        """Parse a doc and yield its pages in the structured format of `call`, one by one.
+
+        Pdfs are yielded as each page is extracted, so that the caller can process the first pages while the rest are
+        still being parsed. The other file types are parsed at once. The whole doc is cached after the last page.
+        """
+        cache_key = cache_key or self.get_cache_key(path)
+        cached_name_ori = f'{cache_key}_ori'
         try:
             # Directly load the parsed doc
-            parsed_file = self.db.get(cached_name_ori)
-            parsed_file = json.loads(parsed_file)
+            parsed_file = self.db.get_obj(cached_name_ori)
+            parse_cache_stats.record('parsed', hit=True)
             logger.info(f'Read parsed {path} from cache.')
+            yield from parsed_file
+            return
         except KeyNotExistsError:
-            logger.info(f'Start parsing {path}...')
-            time1 = time.time()
-
-            f_type = get_file_type(path)
-            if f_type in PARSER_SUPPORTED_FILE_TYPES:
-                if path.startswith('https://') or path.startswith('http://') or re.match(
-                        r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
-                    path = path
-                else:
-                    path = sanitize_chrome_file_path(path)
-
-            os.makedirs(self.data_root, exist_ok=True)
-            if is_http_url(path):
-                # download online url
-                tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
-                os.makedirs(tmp_file_root, exist_ok=True)
-                path = save_url_to_local_work_dir(path, tmp_file_root)
+            parse_cache_stats.record('parsed', hit=False)
+
+        logger.info(f'Start parsing {path}...')
+        time1 = time.time()
+
+        f_type = get_file_type(path)
+        if f_type in PARSER_SUPPORTED_FILE_TYPES:
+            if path.startswith('https://') or path.startswith('http://') or re.match(
+                    r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
+                path = path
+            else:
+                path = sanitize_chrome_file_path(path)
+
+        os.makedirs(self.data_root, exist_ok=True)
+        if is_http_url(path):
+            # download online url
+            tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
+            os.makedirs(tmp_file_root, exist_ok=True)
+            path = save_url_to_local_work_dir(path, tmp_file_root)
+
+        parsed_file = []
+        pages = self._iter_parsed_pages(f_type, path)
+        while True:
             try:
-                if f_type == 'pdf':
-                    parsed_file = parse_pdf(path, self.extract_image)
-                elif f_type == 'docx':
-                    parsed_file = parse_word(path, self.extract_image)
-                elif f_type == 'pptx':
-                    parsed_file = parse_ppt(path, self.extract_image)
-                elif f_type == 'txt':
-                    parsed_file = parse_txt(path)
-                elif f_type == 'html':
-                    parsed_file = parse_html_bs(path, self.extract_image)
-                elif f_type == 'csv':
-                    parsed_file = parse_csv(path, self.extract_image)
-                elif f_type == 'tsv':
-                    parsed_file = parse_tsv(path, self.extract_image)
-                elif f_type in ['xlsx', 'xls']:
-                    parsed_file = parse_excel(path, self.extract_image)
-                else:
-                    raise ValueError(
-                        f'Failed: The current parser does not support this file type! Supported types: {"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
-                    )
+                page = next(pages, None)
             except Exception as ex:
                 exception_type = type(ex).__name__
                 exception_message = str(ex)
                 raise DocParserError(code=exception_type, message=exception_message)
-
-            for page in parsed_file:
-                for para in page['content']:
-                    # Todo: More attribute types
-                    para['token'] = count_tokens(para.get('text', para.get('table')))
-            time2 = time.time()
-            logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
-            # Cache the parsing doc
-            self.db.put(cached_name_ori, json.dumps(parsed_file, ensure_ascii=False, indent=2))
-
-        if not self.structured_doc:
-            return get_plain_doc(parsed_file)
+            if page is None:
+                break
+            for para in page['content']:
+                # Todo: More attribute types
+                para['token'] = count_tokens(para.get('text', para.get('table')))
+            parsed_file.append(page)
+            yield page
+
+        time2 = time.time()
+        logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
+        # Cache the parsing doc
+        self.db.put_obj(cached_name_ori, parsed_file)
+
+    def _iter_parsed_pages(self, f_type: str, path: str) -> Iterator[dict]:
+        if f_type == 'pdf':
+            yield from iter_pdf_pages(path, self.extract_image)
+        elif f_type == 'docx':
+            yield from parse_word(path, self.extract_image)
+        elif f_type == 'pptx':
+            yield from parse_ppt(path, self.extract_image)
+        elif f_type == 'txt':
+            yield from parse_txt(path)
+        elif f_type == 'html':
+            yield from parse_html_bs(path, self.extract_image)
+        elif f_type == 'csv':
+            yield from parse_csv(path, self.extract_image)
+        elif f_type == 'tsv':
+            yield from parse_tsv(path, self.extract_image)
+        elif f_type in ['xlsx', 'xls']:
+            yield from parse_excel(path, self.extract_image)
         else:
-            return parsed_file
+            raise ValueError(
+                f'Failed: The current parser does not support this file type! Supported types: {"/".join(PARSER_SUPPORTED_FILE_TYPES)}'
+            )
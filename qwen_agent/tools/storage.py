@@ -1,15 +1,190 @@
+import json
 import os
-from typing import Dict, Optional, Union
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Union
 
-from qwen_agent.settings import DEFAULT_WORKSPACE
+from qwen_agent.settings import DEFAULT_STORAGE_BACKEND, DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.utils.utils import read_text_from_file, save_text_to_file
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 class KeyNotExistsError(ValueError):
     pass
 
 
+class FileStorageBackend:
+    """One text file per key under the root directory. Objects are stored as json."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, key: str, value: str):
+        path = os.path.join(self.root, key)
+        path_dir = path[:path.rfind('/') + 1]
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        save_text_to_file(path, value)
+
+    def get(self, key: str) -> str:
+        if not os.path.exists(os.path.join(self.root, key)):
+            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
+        return read_text_from_file(os.path.join(self.root, key))
+
+    def put_obj(self, key: str, obj: Any):
+        self.put(key, json.dumps(obj, ensure_ascii=False))
+
+    def get_obj(self, key: str, fields: Optional[List[str]] = None) -> Any:
+        obj = json.loads(self.get(key))
+        if fields is not None and isinstance(obj, dict):
+            obj = {k: obj[k] for k in fields if k in obj}
+        return obj
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, key))
+
+    def delete(self, key: str) -> bool:
+        path = os.path.join(self.root, key)
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def scan(self, key: str) -> Optional[Dict[str, str]]:
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            raise NotADirectoryError(path)
+        # All key-value pairs
+        kvs = {}
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                k = os.path.join(root, file)[len(path):]
+                if not k.startswith('/'):
+                    k = '/' + k
+                v = read_text_from_file(os.path.join(root, file))
+                kvs[k] = v
+        return kvs
+
+
+class SQLiteStorageBackend:
+    """All keys of the root directory in one SQLite database, with zlib-compressed values.
+
+    Objects are encoded with msgpack (or json if msgpack is not installed). A dict is stored as one row per top-level
+    field, so that some of its fields can be read without loading and decoding the others.
+    """
+
+    TEXT_FIELD = ''  # The row of a text value
+    OBJ_FIELD = '.'  # The row of an object that is not a dict
+    FIELD_PREFIX = '.'  # Rows of the fields of a dict are named '.<field>'
+
+    def __init__(self, root: str):
+        self.root = root
+        self.db_path = os.path.join(root, 'storage.sqlite3')
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT NOT NULL, field TEXT NOT NULL, pos INTEGER NOT NULL, '
+                         'codec TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (key, field)) WITHOUT ROWID')
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and per process, since connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _encode(obj: Any):
+        if msgpack is not None:
+            return 'msgpack', zlib.compress(msgpack.packb(obj, use_bin_type=True), 3)
+        return 'json', zlib.compress(json.dumps(obj, ensure_ascii=False).encode('utf-8'), 3)
+
+    @staticmethod
+    def _decode(codec: str, value: bytes) -> Any:
+        data = zlib.decompress(value)
+        if codec == 'text':
+            return data.decode('utf-8')
+        if codec == 'msgpack':
+            return msgpack.unpackb(data, raw=False)
+        return json.loads(data)
+
+    def _write_rows(self, key: str, rows: List[tuple]):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO kv (key, field, pos, codec, value) VALUES (?, ?, ?, ?, ?)',
+                             [(key, field, pos, codec, value) for pos, (field, codec, value) in enumerate(rows)])
+
+    def _read_rows(self, key: str, fields: Optional[List[str]] = None) -> List[tuple]:
+        sql = 'SELECT field, codec, value FROM kv WHERE key = ?'
+        args = [key]
+        if fields is not None:
+            names = [self.TEXT_FIELD, self.OBJ_FIELD] + [self.FIELD_PREFIX + f for f in fields]
+            sql += f' AND field IN ({", ".join("?" * len(names))})'
+            args += names
+        sql += ' ORDER BY pos'
+        rows = self._conn().execute(sql, args).fetchall()
+        if not rows and not self.exists(key):
+            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
+        return rows
+
+    def put(self, key: str, value: str):
+        self._write_rows(key, [(self.TEXT_FIELD, 'text', zlib.compress(value.encode('utf-8'), 3))])
+
+    def get(self, key: str) -> str:
+        rows = self._read_rows(key)
+        if len(rows) == 1 and rows[0][0] == self.TEXT_FIELD:
+            return self._decode(rows[0][1], rows[0][2])
+        return json.dumps(self._rows_to_obj(rows), ensure_ascii=False)
+
+    def put_obj(self, key: str, obj: Any):
+        if isinstance(obj, dict) and obj and all(isinstance(k, str) for k in obj):
+            rows = [(self.FIELD_PREFIX + k, *self._encode(v)) for k, v in obj.items()]
+        else:
+            rows = [(self.OBJ_FIELD, *self._encode(obj))]
+        self._write_rows(key, rows)
+
+    def get_obj(self, key: str, fields: Optional[List[str]] = None) -> Any:
+        return self._rows_to_obj(self._read_rows(key, fields))
+
+    def _rows_to_obj(self, rows: List[tuple]) -> Any:
+        if len(rows) == 1 and rows[0][0] == self.TEXT_FIELD:
+            return json.loads(self._decode(rows[0][1], rows[0][2]))
+        if len(rows) == 1 and rows[0][0] == self.OBJ_FIELD:
+            return self._decode(rows[0][1], rows[0][2])
+        return {field[len(self.FIELD_PREFIX):]: self._decode(codec, value) for field, codec, value in rows}
+
+    def exists(self, key: str) -> bool:
+        return self._conn().execute('SELECT 1 FROM kv WHERE key = ? LIMIT 1', (key,)).fetchone() is not None
+
+    def delete(self, key: str) -> bool:
+        with self._conn() as conn:
+            return conn.execute('DELETE FROM kv WHERE key = ?', (key,)).rowcount > 0
+
+    def scan(self, key: str) -> Optional[Dict[str, str]]:
+        # Keys under a folder share the prefix '<folder>/', which is found with a range query on the primary key
+        prefix = key.rstrip('/') + '/' if key.strip('/') else ''
+        if prefix and self.exists(key.rstrip('/')):
+            raise NotADirectoryError(key)
+        rows = self._conn().execute('SELECT DISTINCT key FROM kv WHERE key >= ? AND key < ? ORDER BY key',
+                                    (prefix, prefix + '\U0010ffff')).fetchall()
+        if not rows:
+            return None
+        return {'/' + k[len(prefix):]: self.get(k) for (k,) in rows}
+
+
+STORAGE_BACKENDS = {'file': FileStorageBackend, 'sqlite': SQLiteStorageBackend}
+
+
 @register_tool('storage')
 class Storage(BaseTool):
     """
@@ -36,6 +211,18 @@ class Storage(BaseTool):
         super().__init__(cfg)
         self.root = self.cfg.get('storage_root_path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
         os.makedirs(self.root, exist_ok=True)
+        self.backend_type = self.cfg.get('storage_backend', DEFAULT_STORAGE_BACKEND)
+        if self.backend_type not in STORAGE_BACKENDS:
+            raise ValueError(f'storage_backend must be one of {list(STORAGE_BACKENDS.keys())}, '
+                             f'but storage_backend="{self.backend_type}" is received.')
+        self._backends = {}
+
+    def _backend(self, path: Optional[str] = None):
+        path = path or self.root
+        if path not in self._backends:
+            os.makedirs(path, exist_ok=True)
+            self._backends[path] = STORAGE_BACKENDS[self.backend_type](path)
+        return self._backends[path]
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
@@ -55,48 +242,34 @@ class Storage(BaseTool):
             return self.scan(key)
 
     def put(self, key: str, value: str, path: Optional[str] = None) -> str:
-        path = path or self.root
+        self._backend(path).put(key, value)
+        return f'Successfully saved {key}.'
 
-        # one file for one key value pair
-        path = os.path.join(path, key)
+    def get(self, key: str, path: Optional[str] = None) -> str:
+        return self._backend(path).get(key)
 
-        path_dir = path[:path.rfind('/') + 1]
-        if path_dir:
-            os.makedirs(path_dir, exist_ok=True)
+    def put_obj(self, key: str, obj: Any, path: Optional[str] = None):
+        """Save a json-serializable object, in the compact binary format of the backend if it has one."""
+        self._backend(path).put_obj(key, obj)
 
-        save_text_to_file(path, value)
-        return f'Successfully saved {key}.'
+    def get_obj(self, key: str, fields: Optional[List[str]] = None, path: Optional[str] = None) -> Any:
+        """Load an object saved by `put_obj`. If `fields` is given, only these top-level fields of a dict are loaded."""
+        return self._backend(path).get_obj(key, fields=fields)
 
-    def get(self, key: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-        if not os.path.exists(os.path.join(path, key)):
-            raise KeyNotExistsError(f'Get Failed: {key} does not exist')
-        return read_text_from_file(os.path.join(path, key))
+    def exists(self, key: str, path: Optional[str] = None) -> bool:
+        return self._backend(path).exists(key)
 
     def delete(self, key, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
-        if os.path.exists(path):
-            os.remove(path)
+        if self._backend(path).delete(key):
             return f'Successfully deleted {key}'
         else:
             return f'Delete Failed: {key} does not exist'
 
     def scan(self, key: str, path: Optional[str] = None) -> str:
-        path = path or self.root
-        path = os.path.join(path, key)
-        if os.path.exists(path):
-            if not os.path.isdir(path):
-                return 'Scan Failed: The scan operation requires passing in a folder path as the key.'
-            # All key-value pairs
-            kvs = {}
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    k = os.path.join(root, file)[len(path):]
-                    if not k.startswith('/'):
-                        k = '/' + k
-                    v = read_text_from_file(os.path.join(root, file))
-                    kvs[k] = v
-            return '\n'.join([f'{k}: {v}' for k, v in kvs.items()])
-        else:
+        try:
+            kvs = self._backend(path).scan(key)
+        except NotADirectoryError:
+            return 'Scan Failed: The scan operation requires passing in a folder path as the key.'
+        if kvs is None:
             return f'Scan Failed: {key} does not exist.'
+        return '\n'.join([f'{k}: {v}' for k, v in kvs.items()])
@@ -1,13 +1,21 @@
 """Tokenization classes for QWen."""
 
 import base64
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import threading
 import unicodedata
+from array import array
 from pathlib import Path
-from typing import Collection, Dict, List, Set, Union
+from typing import Collection, Dict, List, Optional, Set, Union
 
 import tiktoken
 
 from qwen_agent.log import logger
+from qwen_agent.settings import TOKENIZER_CACHE_DIR
 
 VOCAB_FILES_NAMES = {'vocab_file': 'qwen.tiktoken'}
 
@@ -30,14 +38,83 @@ SPECIAL_TOKENS = tuple(enumerate(
     start=SPECIAL_START_ID,
 ))
 SPECIAL_TOKENS_SET = set(t for i, t in SPECIAL_TOKENS)
+SPECIAL_TOKEN_PREFIX = '<|'  # Shared by all the special tokens
+
+
+# The binary rank cache: a header, the token lengths and the ranks as native uint32 arrays, and the token bytes.
+# The header records the size and mtime of the source file, so that a changed vocabulary invalidates the cache.
+RANK_CACHE_MAGIC = b'QWRK'
+RANK_CACHE_VERSION = 1
+_RANK_CACHE_HEADER = struct.Struct('=4sIIQq')  # magic, version, number of tokens, source size, source mtime_ns
 
 
 def _load_tiktoken_bpe(tiktoken_bpe_file: str) -> Dict[bytes, int]:
+    """Load the BPE ranks from the binary rank cache if it is up to date, and from the base64 text file otherwise."""
+    stat = os.stat(tiktoken_bpe_file)
+    cache_file = _get_rank_cache_file(tiktoken_bpe_file)
+    if cache_file:
+        mergeable_ranks = _read_rank_cache(cache_file, stat)
+        if mergeable_ranks is not None:
+            return mergeable_ranks
+
     with open(tiktoken_bpe_file, 'rb') as f:
         contents = f.read()
-    return {
+    mergeable_ranks = {
         base64.b64decode(token): int(rank) for token, rank in (line.split() for line in contents.splitlines() if line)
     }
+    if cache_file:
+        _write_rank_cache(cache_file, mergeable_ranks, stat)
+    return mergeable_ranks
+
+
+def _get_rank_cache_file(tiktoken_bpe_file: str) -> Optional[str]:
+    if not TOKENIZER_CACHE_DIR:
+        return None
+    path = os.path.abspath(tiktoken_bpe_file)
+    path_hash = hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(TOKENIZER_CACHE_DIR, f'{os.path.basename(path)}.{path_hash}.ranks')
+
+
+def _read_rank_cache(cache_file: str, stat: os.stat_result) -> Optional[Dict[bytes, int]]:
+    try:
+        with open(cache_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, n, src_size, src_mtime_ns = _RANK_CACHE_HEADER.unpack_from(mm, 0)
+            if (magic, version, src_size, src_mtime_ns) != (RANK_CACHE_MAGIC, RANK_CACHE_VERSION, stat.st_size,
+                                                            stat.st_mtime_ns):
+                return None
+            start = _RANK_CACHE_HEADER.size
+            with memoryview(mm) as view:
+                with view[start:start + 4 * n] as v, v.cast('I') as c:
+                    lengths = c.tolist()
+                with view[start + 4 * n:start + 8 * n] as v, v.cast('I') as c:
+                    ranks = c.tolist()
+            offsets = list(itertools.accumulate(lengths, initial=start + 8 * n))
+            if offsets[-1] != len(mm):
+                return None
+            return dict(zip((mm[i:j] for i, j in zip(offsets, offsets[1:])), ranks))
+    except (OSError, ValueError, TypeError, struct.error) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f'Failed to read the tokenizer rank cache {cache_file}: {e}')
+        return None
+
+
+def _write_rank_cache(cache_file: str, mergeable_ranks: Dict[bytes, int], stat: os.stat_result):
+    tokens = list(mergeable_ranks.keys())
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            f.write(
+                _RANK_CACHE_HEADER.pack(RANK_CACHE_MAGIC, RANK_CACHE_VERSION, len(tokens), stat.st_size,
+                                        stat.st_mtime_ns))
+            f.write(array('I', [len(t) for t in tokens]).tobytes())
+            f.write(array('I', list(mergeable_ranks.values())).tobytes())
+            f.write(b''.join(tokens))
+        os.replace(tmp_file, cache_file)  # Atomic, so that concurrent processes never read a partial cache
+    except OSError as e:
+        logger.warning(f'Failed to write the tokenizer rank cache {cache_file}: {e}')
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
 
 class QWenTokenizer:
@@ -154,33 +231,37 @@ class QWenTokenizer:
         Returns:
             `List[bytes|str]`: The list of tokens.
         """
-        tokens = []
+        if allowed_special == 'all' and not disallowed_special:
+            return self.convert_ids_to_tokens(self.encode(text))
         text = unicodedata.normalize('NFC', text)
 
         # this implementation takes a detour: text -> token id -> token surface forms
-        for t in self.tokenizer.encode(text, allowed_special=allowed_special, disallowed_special=disallowed_special):
-            tokens.append(self.decoder[t])
-        return tokens
+        return self.convert_ids_to_tokens(
+            self.tokenizer.encode(text, allowed_special=allowed_special, disallowed_special=disallowed_special))
+
+    def convert_ids_to_tokens(self, ids: List[int]) -> List[Union[bytes, str]]:
+        decoder = self.decoder
+        return [decoder[t] for t in ids]
 
     def convert_tokens_to_string(self, tokens: List[Union[bytes, str]]) -> str:
         """
         Converts a sequence of tokens in a single string.
         """
-        text = ''
-        temp = b''
+        text = []
+        temp = []  # Joined once, as concatenating bytes one by one takes quadratic time
         for t in tokens:
             if isinstance(t, str):
                 if temp:
-                    text += temp.decode('utf-8', errors=self.errors)
-                    temp = b''
-                text += t
+                    text.append(b''.join(temp).decode('utf-8', errors=self.errors))
+                    temp = []
+                text.append(t)
             elif isinstance(t, bytes):
-                temp += t
+                temp.append(t)
             else:
                 raise TypeError('token should only be of type types or str')
         if temp:
-            text += temp.decode('utf-8', errors=self.errors)
-        return text
+            text.append(b''.join(temp).decode('utf-8', errors=self.errors))
+        return ''.join(text)
 
     @property
     def vocab_size(self):
@@ -199,10 +280,14 @@ class QWenTokenizer:
         return self.tokenizer.decode(token_ids, errors=errors or self.errors)
 
     def encode(self, text: str) -> List[int]:
-        return self.convert_tokens_to_ids(self.tokenize(text))
+        text = unicodedata.normalize('NFC', text)
+        if SPECIAL_TOKEN_PREFIX not in text:
+            # Matching the special tokens makes tiktoken several times slower, and texts rarely contain any
+            return self.tokenizer.encode_ordinary(text)
+        return self.tokenizer.encode(text, allowed_special='all', disallowed_special=())
 
     def count_tokens(self, text: str) -> int:
-        return len(self.tokenize(text))
+        return len(self.encode(text))
 
     def truncate(self, text: str, max_token: int, start_token: int = 0) -> str:
         token_list = self.tokenize(text)
@@ -210,7 +295,37 @@ class QWenTokenizer:
         return self.convert_tokens_to_string(token_list)
 
 
-tokenizer = QWenTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
+class _LazyTokenizer:
+    """A stand-in for the shared tokenizer, which loads the vocabulary on first use instead of at import time."""
+
+    def __init__(self, vocab_file: Union[str, Path]):
+        self._vocab_file = vocab_file
+        self._tokenizer: Optional[QWenTokenizer] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> QWenTokenizer:
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = QWenTokenizer(self._vocab_file)
+        return self._tokenizer
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+tokenizer = _LazyTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
+
+
+def get_tokenizer() -> QWenTokenizer:
+    """
+    Return the shared tokenizer, loading it if necessary. A server that forks worker processes can call this before
+    forking, so that the workers share the loaded tokenizer through copy-on-write instead of each loading its own.
+    """
+    return tokenizer.load()
 
 
 def count_tokens(text: str) -> int:
@@ -0,0 +1,20 @@
+from qwen_agent.llm import base
+from qwen_agent.llm.base import ModelServiceError, retry_model_service_iterator_resumable
+from qwen_agent.llm.schema import ASSISTANT, Message
+
+
+def test_resumable_retry_continues_from_emitted_prefix(monkeypatch):
+    monkeypatch.setattr(base.time, 'sleep', lambda _: None)
+    prefixes = []
+
+    def it_fn(prefix):
+        prefixes.append(prefix)
+        if len(prefixes) == 1:
+            yield [Message(ASSISTANT, 'Hello')]
+            yield [Message(ASSISTANT, 'Hello, wor')]
+            raise ModelServiceError(code='500', message='Connection reset')
+        yield [Message(ASSISTANT, 'ld!')]
+
+    outputs = [rsp[-1].content for rsp in retry_model_service_iterator_resumable(it_fn, max_retries=3)]
+    assert prefixes == ['', 'Hello, wor']
+    assert outputs[-1] == 'Hello, world!'
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+from rank_bm25 import BM25Okapi
+
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools.keyword_search import KeywordSearch, split_text_into_keywords
+
+WORDS = ['revenue', 'growth', 'margin', 'quarter', 'market', 'model', 'retrieval', 'index', 'profit', 'cash']
+
+
+def _make_docs(seed: int):
+    rng = random.Random(seed)
+    docs = []
+    for doc_idx in range(rng.randint(2, 3)):
+        url = f'doc{doc_idx}.txt'
+        chunks = []
+        for chunk_id in range(rng.randint(1, 6)):
+            # Few distinct words, so that some terms are in more than half of the chunks and get negative idfs
+            content = ' '.join(rng.choice(WORDS[:rng.randint(2, len(WORDS))]) for _ in range(rng.randint(0, 12)))
+            chunks.append(Chunk(content=content, metadata={'source': url, 'chunk_id': chunk_id}, token=0))
+        docs.append(Record(url=url, raw=chunks, title=url))
+    return docs
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_scores_equal_bm25okapi_over_several_docs(tmp_path, seed):
+    docs = _make_docs(seed)
+    query = ' '.join(random.Random(seed).sample(WORDS, 3))
+
+    all_chunks = [chk for doc in docs for chk in doc.raw]
+    bm25 = BM25Okapi([split_text_into_keywords(chk.content) for chk in all_chunks])
+    expected = {(chk.metadata['source'], chk.metadata['chunk_id']): score
+                for chk, score in zip(all_chunks, bm25.get_scores(split_text_into_keywords(query)))}
+
+    chunk_and_score = KeywordSearch({'doc_parser_path': str(tmp_path)}).sort_by_scores(query, docs)
+    assert len(chunk_and_score) == len(all_chunks)
+    for source, chunk_id, score in chunk_and_score:
+        assert score == pytest.approx(expected[(source, chunk_id)])
+    scores = [score for _, _, score in chunk_and_score]
+    assert scores == sorted(scores, reverse=True)